@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark the frame-aligned correlation engine against the old flattened one.
+
+Plants a noisy copy of a random "intro" chromagram at a known frame offset in
+a random "episode" chromagram and times both implementations on it.
+
+Usage:
+    python3 benchmarks/bench_correlation.py [--episode-minutes 45] [--intro-seconds 90] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.signal import correlate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intro-detection"))
+
+from matcher import normalized_cross_correlation  # noqa: E402
+
+SAMPLE_RATE = 22050
+HOP_LENGTH = 1024
+
+
+def legacy_compute_correlation(intro_features, chunk_features):
+    """compute_correlation as it was before the frame-aligned engine."""
+    intro_flat = intro_features.flatten()
+    chunk_flat = chunk_features.flatten()
+
+    intro_norm = (intro_flat - np.mean(intro_flat)) / (np.std(intro_flat) + 1e-8)
+    chunk_norm = (chunk_flat - np.mean(chunk_flat)) / (np.std(chunk_flat) + 1e-8)
+
+    correlation = correlate(chunk_norm, intro_norm, mode='valid')
+    return correlation / len(intro_norm)
+
+
+def best_of(func, repeat):
+    """Run func repeat times, return (fastest wall time, last result)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compute_correlation implementations")
+    parser.add_argument("--episode-minutes", type=float, default=45, help="Length of the searched feature matrix")
+    parser.add_argument("--intro-seconds", type=float, default=90, help="Length of the template")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per implementation (best is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    frames_per_second = SAMPLE_RATE / HOP_LENGTH
+    episode_frames = int(args.episode_minutes * 60 * frames_per_second)
+    intro_frames = int(args.intro_seconds * frames_per_second)
+
+    rng = np.random.default_rng(args.seed)
+    episode = rng.random((12, episode_frames)).astype(np.float32)
+    intro = rng.random((12, intro_frames)).astype(np.float32)
+    offset = int(rng.integers(0, episode_frames - intro_frames))
+    episode[:, offset:offset + intro_frames] = intro + 0.3 * rng.random((12, intro_frames))
+
+    print(f"Episode: {episode_frames} frames ({args.episode_minutes:.0f} min), "
+          f"intro: {intro_frames} frames ({args.intro_seconds:.0f} s), planted at frame {offset}")
+
+    legacy_time, legacy_scores = best_of(lambda: legacy_compute_correlation(intro, episode), args.repeat)
+    new_time, new_scores = best_of(lambda: normalized_cross_correlation(intro, episode), args.repeat)
+
+    legacy_frame = int(np.argmax(legacy_scores)) // intro.shape[0]
+    new_frame = int(np.argmax(new_scores))
+
+    print(f"\n{'implementation':<22}{'time':>10}{'lags':>12}{'peak frame':>12}{'peak score':>12}")
+    print(f"{'legacy (flattened)':<22}{legacy_time * 1000:>8.1f}ms{len(legacy_scores):>12}"
+          f"{legacy_frame:>12}{np.max(legacy_scores):>12.4f}")
+    print(f"{'frame-aligned NCC':<22}{new_time * 1000:>8.1f}ms{len(new_scores):>12}"
+          f"{new_frame:>12}{np.max(new_scores):>12.4f}")
+    print(f"\nSpeedup: {legacy_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Benchmark the landmark fingerprint index: build and query throughput.
+
+The synthetic episodes of bench_scan.py are indexed one after the other in
+this process, timing the decode and landmark extraction separately from the
+SQLite inserts. The intro snippet is then queried repeatedly: the report lists
+the lookup and voting time per query, the time to verify the candidates with
+compute_correlation and the timestamp error of the verified matches.
+
+Lookups cost more as the index grows. --filler-files adds that many files of
+random landmarks (as many per file as the real episodes have) to the index
+before querying, to measure the query time of a large library without
+decoding one.
+
+Usage:
+    python3 benchmarks/bench_landmarks.py [--episodes 6] [--negatives 1] [--episode-minutes 10] [--intro-seconds 30]
+                                          [--filler-files 0] [--queries 20] [--work-dir DIR] [--output results.json]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import bench_scan
+
+RESULT_FORMAT_VERSION = 1
+
+
+def load_landmark_index(work_dir):
+    """Import landmark_index with the scanner's database in work_dir."""
+    os.chdir(work_dir)
+    sys.path.insert(0, bench_scan.SCANNER_DIR)
+    import landmark_index
+    return landmark_index
+
+
+def build_index(landmark_index, index, episodes):
+    """Index all episodes; returns the build timings."""
+    extract_seconds = insert_seconds = 0.0
+    total_landmarks = 0
+    for episode in episodes:
+        started = time.perf_counter()
+        _, duration, hashes, frames = landmark_index.file_landmarks(episode["path"])
+        extracted = time.perf_counter()
+        index.add_file(episode["path"], None, os.path.getsize(episode["path"]), os.path.getmtime(episode["path"]),
+                       duration, hashes, frames)
+        insert_seconds += time.perf_counter() - extracted
+        extract_seconds += extracted - started
+        total_landmarks += len(hashes)
+
+    media_seconds = sum(min(episode["duration"], landmark_index.INDEX_HEAD_DURATION + landmark_index.INDEX_TAIL_DURATION)
+                        for episode in episodes)
+    elapsed = extract_seconds + insert_seconds
+    return {
+        "files": len(episodes),
+        "landmarks": total_landmarks,
+        "landmarks_per_media_second": total_landmarks / media_seconds,
+        "extract_seconds": extract_seconds,
+        "insert_seconds": insert_seconds,
+        "media_seconds_per_second": media_seconds / elapsed,
+        "landmarks_per_second": total_landmarks / elapsed,
+    }
+
+
+def add_filler(landmark_index, index, files, landmarks_per_file, seed):
+    """Add files of random landmarks; returns the seconds it took."""
+    rng = np.random.default_rng(seed)
+    max_frame = int((landmark_index.INDEX_HEAD_DURATION + landmark_index.INDEX_TAIL_DURATION)
+                    * landmark_index.LANDMARK_SAMPLE_RATE / landmark_index.LANDMARK_HOP_LENGTH)
+    started = time.perf_counter()
+    for number in range(files):
+        hashes = rng.integers(0, 1 << 24, landmarks_per_file)
+        frames = rng.integers(0, max_frame, landmarks_per_file)
+        index.add_file(f"/filler/{number}.mkv", None, 0, 0.0, None, hashes, frames)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the landmark fingerprint index on synthetic episodes")
+    parser.add_argument("--episodes", type=int, default=6, help="Episodes containing the intro")
+    parser.add_argument("--negatives", type=int, default=1, help="Episodes without the intro")
+    parser.add_argument("--episode-minutes", type=float, default=10, help="Length of each episode")
+    parser.add_argument("--intro-seconds", type=float, default=30, help="Length of the intro")
+    parser.add_argument("--filler-files", type=int, default=0, help="Files of random landmarks added before querying")
+    parser.add_argument("--queries", type=int, default=20, help="Repetitions of the index lookup")
+    parser.add_argument("--correlation-threshold", type=float, default=0.8)
+    parser.add_argument("--max-error", type=float, default=0.5,
+                        help="Largest timestamp error in seconds counted as a correct detection")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="Keep the generated episodes in this directory and reuse them")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        work_dir_context = contextlib.nullcontext(os.path.abspath(args.work_dir))
+    else:
+        work_dir_context = tempfile.TemporaryDirectory(prefix="bench_landmarks_")
+
+    with work_dir_context as work_dir:
+        intro_path, episodes = bench_scan.generated_episodes(work_dir, args)
+        landmark_index = load_landmark_index(work_dir)
+        scanner = landmark_index.scanner
+
+        index_path = os.path.join(work_dir, landmark_index.LANDMARK_INDEX_FILE)
+        for suffix in ("", "-wal", "-shm"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(index_path + suffix)
+        index = landmark_index.LandmarkIndex(index_path)
+
+        print(f"Indexing {len(episodes)} episodes...")
+        build = build_index(landmark_index, index, episodes)
+        if args.filler_files:
+            print(f"Adding {args.filler_files} filler files...")
+            build["filler_seconds"] = add_filler(landmark_index, index, args.filler_files,
+                                                 build["landmarks"] // len(episodes), args.seed)
+        index.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        build["index_files"], build["index_landmarks"] = index.stats()
+        build["index_bytes"] = os.path.getsize(index_path)
+
+        # Query: snippet landmarks, then lookup and voting (repeated), then verification
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            snippet = scanner.load_audio_from_file(intro_path, landmark_index.LANDMARK_SAMPLE_RATE)
+            intro_features, _, intro_duration = scanner.load_intro_template(intro_path)
+        started = time.perf_counter()
+        snippet_hashes, snippet_frames = landmark_index.landmarks(snippet)
+        snippet_seconds = time.perf_counter() - started
+
+        vote_times = []
+        for _ in range(args.queries):
+            started = time.perf_counter()
+            candidates = index.vote(snippet_hashes, snippet_frames)
+            vote_times.append(time.perf_counter() - started)
+        candidates = [candidate for candidate in candidates if candidate[2] >= landmark_index.MIN_VOTES]
+
+        by_path = {episode["path"]: episode for episode in episodes}
+        verify_seconds = 0.0
+        results = []
+        for file_id, offset, votes in candidates:
+            path = index.file(file_id)[0]
+            if path not in by_path:
+                results.append({"name": path, "votes": votes, "detected": False, "filler": True})
+                continue
+            started = time.perf_counter()
+            start_time, score = landmark_index.verify(path, intro_features, intro_duration,
+                                                      landmark_index.landmark_seconds(offset))
+            verify_seconds += time.perf_counter() - started
+            episode = by_path[path]
+            detected = start_time is not None and score >= args.correlation_threshold
+            error = None
+            if detected and episode["intro_offset"] is not None:
+                error = abs(start_time - episode["intro_offset"])
+            results.append({"name": episode["name"], "votes": votes, "found": start_time if detected else None,
+                            "expected": episode["intro_offset"], "score": score, "detected": detected, "error": error})
+        index.close()
+
+    positives = [episode for episode in episodes if episode["intro_offset"] is not None]
+    errors = [result["error"] for result in results if result.get("error") is not None]
+    query = {
+        "snippet_landmarks": len(snippet_hashes),
+        "snippet_seconds": snippet_seconds,
+        "vote_ms": 1000 * float(np.median(vote_times)),
+        "queries_per_second": 1 / float(np.median(vote_times)),
+        "candidates": len(candidates),
+        "verify_seconds": verify_seconds,
+        "detection_rate": sum(error <= args.max_error for error in errors) / len(positives) if positives else None,
+        "false_positives": sum(result["detected"] for result in results if result.get("expected", 0) is None),
+        "filler_candidates": sum(result.get("filler", False) for result in results),
+        "mean_error": float(np.mean(errors)) if errors else None,
+        "max_error": float(np.max(errors)) if errors else None,
+    }
+
+    for result in results:
+        if result.get("filler"):
+            continue
+        found = "-" if result["found"] is None else f"{result['found']:.3f}"
+        expected = "-" if result["expected"] is None else f"{result['expected']:.3f}"
+        print(f"  {result['name']:<16}expected {expected:>8}  found {found:>8}  votes {result['votes']:6d}  "
+              f"score {result['score']:.4f}")
+
+    print(f"\n{'='*60}")
+    print(f"Build:    {build['media_seconds_per_second']:.1f} media-seconds per second, "
+          f"{build['landmarks_per_second']:.0f} landmarks per second "
+          f"({build['extract_seconds']:.1f}s decode + landmarks, {build['insert_seconds']:.2f}s insert)")
+    print(f"Index:    {build['index_files']} files, {build['index_landmarks']} landmarks, "
+          f"{build['index_bytes'] / 1024 / 1024:.1f} MB")
+    print(f"Query:    {query['vote_ms']:.1f}ms lookup and voting ({query['queries_per_second']:.1f} queries per second, "
+          f"{query['snippet_landmarks']} snippet landmarks in {query['snippet_seconds'] * 1000:.0f}ms)")
+    print(f"Verify:   {query['candidates']} candidates in {query['verify_seconds']:.2f}s")
+    if query["detection_rate"] is not None:
+        print(f"Detection rate:  {100.0 * query['detection_rate']:.0f}%")
+    if query["mean_error"] is not None:
+        print(f"Timestamp error: mean {query['mean_error'] * 1000:.1f}ms, max {query['max_error'] * 1000:.1f}ms")
+    print(f"False positives: {query['false_positives']} of {args.negatives}, "
+          f"{query['filler_candidates']} filler files among the candidates")
+    print(f"{'='*60}")
+
+    if args.output:
+        report = {
+            "version": RESULT_FORMAT_VERSION,
+            "revision": bench_scan.git_revision(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "settings": vars(args),
+            "build": build,
+            "query": query,
+            "episodes": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Benchmark scan speed and detection accuracy on synthetic episodes.
+
+Episodes are generated with libavfilter sources through PyAV, the library the
+scanner decodes with: a tonal "intro" melody (aevalsrc) is spliced into
+filler music at a known offset, its level is changed, pink noise (anoisesrc)
+is mixed in and the result is encoded lossily, for some episodes twice. A
+few episodes without the intro check for false positives.
+
+Every episode is scanned with find_intro_in_video in a fresh process, so the
+reported peak RSS belongs to that scan alone. The report lists media-seconds
+scanned per second, peak RSS and timestamp error; --output saves it as JSON
+and --compare prints the change against an earlier result file. Generating
+the episodes takes a while; with --work-dir they are kept and reused by later
+runs with the same generation settings, so two commits are compared on
+identical input.
+
+Usage:
+    python3 benchmarks/bench_scan.py [--episodes 6] [--negatives 1] [--episode-minutes 10] [--intro-seconds 30]
+                                     [--features cqt] [--work-dir DIR] [--output results.json] [--compare old.json]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import av
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCANNER_DIR = os.path.join(REPO_DIR, "intro-detection")
+
+SAMPLE_RATE = 44100
+NOTES_PER_SECOND = 4
+INTRO_SEED = 1
+RESULT_FORMAT_VERSION = 1
+EPISODE_INDEX = "episodes.json"  # generation settings and episode list in a --work-dir
+
+# (codec, container extension, bit rate, sample rate) per episode, cycled
+ENCODINGS = [
+    ("aac", "mp4", 128000, 44100),
+    ("libmp3lame", "mkv", 96000, 44100),
+    ("libopus", "mkv", 64000, 48000),  # Opus only supports 48 kHz
+]
+TRANSCODE_BIT_RATE = 64000  # second, lower-quality encode of every other episode
+
+
+def melody(seed, duration, level=1.0):
+    """
+    aevalsrc options for a pseudo-random melody: a new note every
+    1/NOTES_PER_SECOND seconds, picked from three octaves by a hash of the
+    note index, with a decaying envelope and one overtone.
+    """
+    note = f"floor(t*{NOTES_PER_SECOND})+{seed * 1000}"
+    frequency = f"110*pow(2,floor(36*mod(abs(sin(({note})*12.9898)*43758.5453),1))/12)"
+    envelope = f"exp(-6*mod(t,{1 / NOTES_PER_SECOND}))"
+    expression = f"{0.2 * level}*{envelope}*(sin(2*PI*{frequency}*t)+0.5*sin(4*PI*{frequency}*t))"
+    return f"exprs='{expression}':s={SAMPLE_RATE}:d={duration}"
+
+
+def render(graph_setup):
+    """
+    Run a filter graph and return its output as mono float32 PCM.
+
+    Args:
+        graph_setup: Function (graph) -> last filter, adding the sources and filters
+    """
+    graph = av.filter.Graph()
+    last = graph_setup(graph)
+    convert = graph.add("aformat", f"sample_fmts=flt:channel_layouts=mono:sample_rates={SAMPLE_RATE}")
+    sink = graph.add("abuffersink")
+    last.link_to(convert)
+    convert.link_to(sink)
+    graph.configure()
+
+    blocks = []
+    while True:
+        try:
+            frame = sink.pull()
+        except (av.error.EOFError, av.error.BlockingIOError):
+            break
+        blocks.append(frame.to_ndarray().reshape(-1))
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+
+def render_episode(duration, intro_duration, intro_offset, filler_seed, gain_db, noise_level, noise_seed):
+    """Filler music with the intro spliced in at intro_offset (None = no intro), plus noise."""
+    def setup(graph):
+        if intro_offset is None:
+            music = graph.add("aevalsrc", melody(filler_seed, duration))
+        else:
+            parts = [
+                graph.add("aevalsrc", melody(filler_seed, intro_offset)),
+                graph.add("aevalsrc", melody(INTRO_SEED, intro_duration, 10 ** (gain_db / 20))),
+                graph.add("aevalsrc", melody(filler_seed + 1, duration - intro_offset - intro_duration)),
+            ]
+            music = graph.add("concat", "n=3:v=0:a=1")
+            for index, part in enumerate(parts):
+                part.link_to(music, 0, index)
+
+        noise = graph.add("anoisesrc", f"color=pink:amplitude={noise_level}:r={SAMPLE_RATE}:d={duration}:seed={noise_seed}")
+        mix = graph.add("amix", "inputs=2:normalize=0:duration=shortest")
+        music.link_to(mix, 0, 0)
+        noise.link_to(mix, 0, 1)
+        return mix
+
+    return render(setup)
+
+
+def encode(path, audio, codec, bit_rate, rate=SAMPLE_RATE):
+    """Encode mono PCM (at SAMPLE_RATE) into a container, resampled to rate."""
+    with av.open(path, "w") as container:
+        stream = container.add_stream(codec, rate=rate)
+        stream.bit_rate = bit_rate
+        stream.layout = "mono"
+        resampler = av.AudioResampler(format=stream.format.name, layout="mono", rate=rate)
+
+        block = SAMPLE_RATE // 10
+        for start in range(0, len(audio), block):
+            frame = av.AudioFrame.from_ndarray(audio[np.newaxis, start:start + block], format="flt", layout="mono")
+            frame.sample_rate = SAMPLE_RATE
+            for resampled in resampler.resample(frame):
+                for packet in stream.encode(resampled):
+                    container.mux(packet)
+        for resampled in resampler.resample(None):
+            for packet in stream.encode(resampled):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+
+def decode(path):
+    """Decode a file back to mono float32 PCM (for the second encode of a transcode)."""
+    with av.open(path) as container:
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+        blocks = []
+        for frame in container.decode(audio=0):
+            for resampled in resampler.resample(frame):
+                blocks.append(resampled.to_ndarray().reshape(-1))
+    return np.concatenate(blocks)
+
+
+def write_wav(path, audio):
+    """Write mono PCM as a 16-bit WAV file."""
+    encode(path, audio, "pcm_s16le", 0)
+
+
+def generate(work_dir, args):
+    """
+    Generate the intro snippet and all episodes.
+
+    Returns:
+        (intro path, list of episode dicts)
+    """
+    rng = np.random.default_rng(args.seed)
+    duration = args.episode_minutes * 60
+
+    intro_path = os.path.join(work_dir, "intro.wav")
+    write_wav(intro_path, render(lambda graph: graph.add("aevalsrc", melody(INTRO_SEED, args.intro_seconds))))
+
+    episodes = []
+    for index in range(args.episodes + args.negatives):
+        negative = index >= args.episodes
+        codec, extension, bit_rate, rate = ENCODINGS[index % len(ENCODINGS)]
+        episode = {
+            "name": f"episode{index + 1:02d}.{extension}",
+            "duration": duration,
+            "intro_offset": None if negative else round(float(rng.uniform(0, min(duration - args.intro_seconds, 600))), 3),
+            "codec": codec,
+            "bit_rate": bit_rate,
+            "transcoded": index % 2 == 1,
+            "gain_db": round(float(rng.uniform(-6, 6)), 1),
+            "noise_level": round(float(rng.uniform(0.01, 0.05)), 3),
+        }
+        episode["path"] = os.path.join(work_dir, episode["name"])
+
+        audio = render_episode(duration, args.intro_seconds, episode["intro_offset"], 100 + index,
+                               episode["gain_db"], episode["noise_level"], index)
+        if episode["transcoded"]:
+            first_pass = os.path.join(work_dir, f"first-pass-{episode['name']}")
+            encode(first_pass, audio, codec, bit_rate, rate)
+            audio = decode(first_pass)
+            os.remove(first_pass)
+            encode(episode["path"], audio, "aac", TRANSCODE_BIT_RATE)
+        else:
+            encode(episode["path"], audio, codec, bit_rate, rate)
+        episodes.append(episode)
+
+    return intro_path, episodes
+
+
+def generated_episodes(work_dir, args):
+    """
+    Return (intro path, episodes) from work_dir, generating them unless a
+    previous run already did so with the same settings.
+    """
+    settings = {name: getattr(args, name) for name in ("episodes", "negatives", "episode_minutes", "intro_seconds", "seed")}
+    index_path = os.path.join(work_dir, EPISODE_INDEX)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["settings"] == settings and all(os.path.exists(episode["path"]) for episode in index["episodes"]):
+            print(f"Reusing episodes in {work_dir}")
+            return index["intro"], index["episodes"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    print(f"Generating {args.episodes + args.negatives} episodes of {args.episode_minutes:g} min...")
+    started = time.perf_counter()
+    intro_path, episodes = generate(work_dir, args)
+    print(f"  done in {time.perf_counter() - started:.1f}s")
+
+    with open(index_path, "w") as f:
+        json.dump({"settings": settings, "intro": intro_path, "episodes": episodes}, f, indent=2)
+    return intro_path, episodes
+
+
+def scan_episode(task):
+    """
+    Scan one episode (runs in its own process).
+
+    The scanner opens intro_timestamps.db in the working directory on import,
+    so it is imported from within the benchmark's temporary directory.
+    """
+    episode, intro_path, work_dir, options = task
+    os.chdir(work_dir)
+    sys.path.insert(0, SCANNER_DIR)
+    spec = importlib.util.spec_from_file_location("audio_scan", os.path.join(SCANNER_DIR, "audio-scan.py"))
+    scanner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(scanner)
+
+    with open(os.devnull, "w") as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            started = time.perf_counter()
+            start_time, score, _ = scanner.find_intro_in_video(
+                episode["path"], intro_path, None, None,
+                correlation_threshold=options["correlation_threshold"],
+                save=False,
+                features=options["features"]
+            )
+            elapsed = time.perf_counter() - started
+        finally:
+            sys.stdout = stdout
+
+    detected = start_time is not None and score >= options["correlation_threshold"]
+    error = None
+    if detected and episode["intro_offset"] is not None:
+        error = abs(start_time - episode["intro_offset"])
+
+    return {
+        **{key: value for key, value in episode.items() if key != "path"},
+        "found": start_time if detected else None,
+        "score": float(score),
+        "detected": detected,
+        "error": error,
+        "elapsed": elapsed,
+        "media_seconds_per_second": episode["duration"] / elapsed,
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024),
+    }
+
+
+def summarize(results, max_error):
+    """Aggregate the per-episode results."""
+    positives = [result for result in results if result["intro_offset"] is not None]
+    negatives = [result for result in results if result["intro_offset"] is None]
+    errors = [result["error"] for result in positives if result["error"] is not None]
+    correct = [error for error in errors if error <= max_error]
+    total_media = sum(result["duration"] for result in results)
+    total_elapsed = sum(result["elapsed"] for result in results)
+
+    return {
+        "episodes": len(results),
+        "media_seconds_per_second": total_media / total_elapsed if total_elapsed else 0.0,
+        "peak_rss_mb": max(result["peak_rss_mb"] for result in results),
+        "detection_rate": len(correct) / len(positives) if positives else None,
+        "false_positives": sum(result["detected"] for result in negatives),
+        "wrong_offsets": len(errors) - len(correct),
+        "mean_error": float(np.mean(errors)) if errors else None,
+        "max_error": float(np.max(errors)) if errors else None,
+    }
+
+
+def git_revision():
+    """Current commit of the repository, if available."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(summary, previous):
+    """Print the change of each summary value against an earlier result file."""
+    print(f"\nCompared to {previous.get('revision') or 'previous run'}:")
+    for key, value in summary.items():
+        old = previous["summary"].get(key)
+        if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            print(f"  {key:<26}{old:>12.4g} → {value:<12.4g}({100.0 * (value - old) / old:+.1f}%)")
+        else:
+            print(f"  {key:<26}{str(old):>12} → {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark intro scan speed and accuracy on synthetic episodes")
+    parser.add_argument("--episodes", type=int, default=6, help="Episodes containing the intro")
+    parser.add_argument("--negatives", type=int, default=1, help="Episodes without the intro")
+    parser.add_argument("--episode-minutes", type=float, default=10, help="Length of each episode")
+    parser.add_argument("--intro-seconds", type=float, default=30, help="Length of the intro")
+    parser.add_argument("--features", default="cqt", help="Feature profile passed to the scanner")
+    parser.add_argument("--correlation-threshold", type=float, default=0.8)
+    parser.add_argument("--max-error", type=float, default=0.5,
+                        help="Largest timestamp error in seconds counted as a correct detection")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="Keep the generated episodes in this directory and reuse them")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        work_dir_context = contextlib.nullcontext(os.path.abspath(args.work_dir))
+    else:
+        work_dir_context = tempfile.TemporaryDirectory(prefix="bench_scan_")
+
+    with work_dir_context as work_dir:
+        intro_path, episodes = generated_episodes(work_dir, args)
+
+        options = {"correlation_threshold": args.correlation_threshold, "features": args.features}
+        tasks = [(episode, intro_path, work_dir, options) for episode in episodes]
+        # One process per episode: peak RSS is per scan, and nothing is warm except the template cache
+        with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+            results = []
+            for result in pool.imap(scan_episode, tasks):
+                found = "-" if result["found"] is None else f"{result['found']:.3f}"
+                expected = "-" if result["intro_offset"] is None else f"{result['intro_offset']:.3f}"
+                print(f"  {result['name']:<16}{result['codec']:<12}expected {expected:>8}  found {found:>8}  "
+                      f"score {result['score']:.4f}  {result['media_seconds_per_second']:7.1f} media-s/s  "
+                      f"{result['peak_rss_mb']:6.0f} MB")
+                results.append(result)
+
+    summary = summarize(results, args.max_error)
+    print(f"\n{'='*60}")
+    print(f"Throughput:      {summary['media_seconds_per_second']:.1f} media-seconds per second")
+    print(f"Peak RSS:        {summary['peak_rss_mb']:.0f} MB")
+    if summary["detection_rate"] is not None:
+        print(f"Detection rate:  {100.0 * summary['detection_rate']:.0f}% "
+              f"({summary['wrong_offsets']} at a wrong offset)")
+    if summary["mean_error"] is not None:
+        print(f"Timestamp error: mean {summary['mean_error'] * 1000:.1f}ms, max {summary['max_error'] * 1000:.1f}ms")
+    print(f"False positives: {summary['false_positives']} of {args.negatives}")
+    print(f"{'='*60}")
+
+    report = {
+        "version": RESULT_FORMAT_VERSION,
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "summary": summary,
+        "episodes": results,
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(summary, json.load(f))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,20 @@ compression and encoding differences than MFCCs.`
 """
 
 import numpy as np
-import subprocess
 import librosa
 from pathlib import Path
 import sys
-import sqlite3
 import os
-import struct
+import audio_cache
+import instrumentation
+import movie_hash
+import storage
 import tmdb_lookup
-from scipy.signal import correlate
+import template_cache
+from search_priors import SeriesPriors
+from audio_decoder import AudioRingBuffer, DECODE_BLOCK_DURATION, decode_audio_blocks, probe_duration
+from matcher import find_peaks, interpolate_peak, normalized_cross_correlation, normalized_cross_correlation_batch
+from features import FEATURE_BACKENDS, FeatureRingBuffer, FEATURE_BLOCK_DURATION, FEATURE_CONTEXT, chroma_features
 
 # Configuration
 SAMPLE_RATE = 22050  # Hz - good balance of quality and speed
@@ -23,30 +28,45 @@ SLIDE_INTERVAL = 3  # seconds - how much to slide the window forward each iterat
 HOP_LENGTH = 1024  # samples between frames
 CORRELATION_THRESHOLD = 0.8  # Correlation coefficient threshold (0-1)
 
-# Two-stage refinement thresholds
-REFINEMENT_TRIGGER = 0.42  # Trigger fine-grained search when correlation > this
-REFINEMENT_THRESHOLD = 0.8  # Stop when fine-grained search finds correlation > this
-REFINEMENT_WINDOW = 15  # seconds before/after to search in fine-grained mode
-REFINEMENT_INTERVAL = 0.4  # seconds to slide in fine-grained mode
-
-db_path="intro_timestamps.db"
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
-cursor.execute("""
-        CREATE TABLE IF NOT EXISTS intro_timestamps (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_name TEXT NOT NULL,
-            movie_hash TEXT,
-            file_size INTEGER,
-            start_time REAL NOT NULL,
-            end_time REAL NOT NULL,
-            correlation_score REAL NOT NULL,
-            tmdb_id TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-
+# Coarse-to-fine search
+COARSE_HOP_LENGTH = 4096  # samples between frames in the whole-file screening pass
+REFINEMENT_CANDIDATES = 3  # best coarse peaks rescored at full resolution
+REFINEMENT_MARGIN = 2  # seconds around a coarse peak searched at full resolution
+REFINEMENT_PHASES = 4  # frame grids, shifted by a fraction of a hop, scored per candidate
+REFINEMENT_MIN_RATIO = 0.5  # coarse peaks below this fraction of the threshold are not refined
+OUTRO_SEARCH_DURATION = 300  # seconds at the end of a video searched for the outro snippet
+
+# Feature backends (see features.FEATURE_BACKENDS) used for the whole-file
+# screening pass and for confirming candidates at full resolution. Both
+# backends of a profile must share a sample rate, the audio is decoded once.
+# Scores of the cheaper backends are not on the CQT scale; "auto" confirms
+# with CQT and "onset" with the CQT chroma of "lowrate" (its sample rate), so
+# the usual correlation threshold applies to them.
+FEATURE_PROFILES = {
+    "cqt": ("cqt", "cqt"),
+    "lowrate": ("lowrate", "lowrate"),
+    "stft": ("stft", "stft"),
+    "onset": ("onset", "lowrate"),
+    "auto": ("stft", "cqt"),
+}
+DEFAULT_FEATURES = "cqt"
+
+db_path = storage.DB_PATH
+_database = None
+
+
+def get_database():
+    """Open the intro database on first use; importing this module does not touch it."""
+    global _database
+    if _database is None:
+        _database = storage.IntroDatabase(db_path)
+    return _database
+
+
+def enable_audio_cache(max_size=audio_cache.AUDIO_CACHE_MAX_SIZE):
+    """Cache decoded audio in audio_cache/ next to the database, for re-scans (see audio_cache)."""
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), audio_cache.AUDIO_CACHE_DIR)
+    audio_cache.configure(cache_dir, max_size)
 
 
 def format_timestamp(seconds):
@@ -67,46 +87,15 @@ def calculate_opensubtitles_hash(video_path):
     - Add file size to the sum
     - Return as 16-character hex string
 
+    See movie_hash for the implementation and for hashing many files at once.
+
     Args:
         video_path: Path to video file
 
     Returns:
         Tuple of (hash string, file size in bytes)
     """
-    if not os.path.exists(video_path):
-        raise FileNotFoundError(f"Video file not found: {video_path}")
-
-    if not os.path.isfile(video_path):
-        raise FileNotFoundError(f"Path is not a file: {video_path}")
-
-    longlongformat = '<q'  # little-endian long long (64-bit)
-    bytesize = struct.calcsize(longlongformat)
-    file_size = os.path.getsize(video_path)
-
-    file_hash = file_size
-
-    with open(video_path, "rb") as f:
-        # Read first 64KB
-        for _ in range(65536 // bytesize):
-            buffer = f.read(bytesize)
-            if len(buffer) < bytesize:
-                break
-            (l_value,) = struct.unpack(longlongformat, buffer)
-            file_hash += l_value
-            file_hash &= 0xFFFFFFFFFFFFFFFF  # Keep it 64-bit
-
-        # Read last 64KB
-        f.seek(max(0, file_size - 65536), 0)
-        for _ in range(65536 // bytesize):
-            buffer = f.read(bytesize)
-            if len(buffer) < bytesize:
-                break
-            (l_value,) = struct.unpack(longlongformat, buffer)
-            file_hash += l_value
-            file_hash &= 0xFFFFFFFFFFFFFFFF  # Keep it 64-bit
-
-    hash_string = "%016x" % file_hash
-    return hash_string, file_size
+    return movie_hash.opensubtitles_hash(video_path)
 
 
 def save_intro_timestamps(video_path, start_time, end_time, correlation_score, movie_hash, file_size, outro_length=0):
@@ -120,16 +109,19 @@ def save_intro_timestamps(video_path, start_time, end_time, correlation_score, m
 
     file_name = str(os.path.basename(video_path))
 
-    tmdb_id = tmdb_lookup.find_tmdb_id(video_path)
+    # A batch of earlier rows holds the database write lock; commit it before
+    # a lookup that may wait on the network
+    if tmdb_lookup.get_resolver().needs_request(video_path):
+        with instrumentation.stage("database"):
+            get_database().commit()
 
-    # Insert or replace the record for this video
-    cursor.execute("""
-        INSERT INTO intro_timestamps (file_name, movie_hash, file_size, start_time, end_time, correlation_score, outro_length, tmdb_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (file_name, movie_hash, file_size, start_time, end_time, correlation_score, outro_length, tmdb_id))
+    with instrumentation.stage("tmdb"):
+        tmdb_id = tmdb_lookup.find_tmdb_id(video_path)
 
-    conn.commit()
-    conn.close()
+    # Insert or update the record for this video
+    with instrumentation.stage("database"):
+        get_database().save(file_name, movie_hash, file_size, start_time, end_time, correlation_score,
+                            outro_length, tmdb_id)
 
     print(f"\n✓ Saved to database: {db_path}")
     print(f"  Video: {video_path}")
@@ -138,6 +130,23 @@ def save_intro_timestamps(video_path, start_time, end_time, correlation_score, m
         print(f"  Outro: last {format_timestamp(outro_length)}")
 
 
+def is_known(file_name, movie_hash):
+    """Check whether a file is already in the database, by name or hash."""
+    with instrumentation.stage("database"):
+        return get_database().is_known(file_name, movie_hash)
+
+
+def load_known():
+    """
+    Load the names and hashes of all files in the database in one query.
+
+    Returns:
+        (set of file names, set of movie hashes) tuple
+    """
+    with instrumentation.stage("database"):
+        return get_database().load_known()
+
+
 def extract_audio_features(audio_data, sr=SAMPLE_RATE):
     """
     Extract audio fingerprint using chromagram (pitch-based features).
@@ -145,17 +154,30 @@ def extract_audio_features(audio_data, sr=SAMPLE_RATE):
     Chromagram is more robust to compression and encoding variations than MFCCs,
     and preserves musical/tonal content better.
     """
-    # Compute chromagram (12 pitch classes)
-    chroma = librosa.feature.chroma_cqt(
-        y=audio_data,
-        sr=sr,
-        hop_length=HOP_LENGTH
-    )
+    return chroma_features(audio_data, sr, HOP_LENGTH)
+
+
+def feature_profile(features):
+    """Return the (screening, confirmation) FeatureBackends of a profile in FEATURE_PROFILES."""
+    screen, confirm = FEATURE_PROFILES[features]
+    return FEATURE_BACKENDS[screen], FEATURE_BACKENDS[confirm]
+
+
+def describe_feature_profiles():
+    """Command line help text listing the feature profiles with their relative screening cost."""
+    descriptions = []
+    for name, (screen, confirm) in FEATURE_PROFILES.items():
+        backend = FEATURE_BACKENDS[screen]
+        if screen == confirm:
+            descriptions.append(f"{name}: {backend.description}, cost {backend.cost:g}")
+        else:
+            descriptions.append(f"{name}: screen with {screen} (cost {backend.cost:g}), confirm with {confirm}")
+    return "; ".join(descriptions)
 
-    # Normalize each frame
-    chroma = librosa.util.normalize(chroma, axis=0)
 
-    return chroma
+def scaled_hop(hop_length, backend):
+    """Hop length at the backend's sample rate spanning the same time as hop_length at SAMPLE_RATE."""
+    return hop_length * backend.sample_rate // SAMPLE_RATE
 
 
 def compute_correlation(intro_features, chunk_features):
@@ -163,23 +185,10 @@ def compute_correlation(intro_features, chunk_features):
     Compute normalized cross-correlation between intro and chunk.
 
     Returns:
-        Array of correlation scores for each possible alignment position.
+        Array of correlation scores, one per frame offset of the intro
+        within the chunk (index = offset in feature frames).
     """
-    # Flatten features to 1D for correlation
-    intro_flat = intro_features.flatten()
-    chunk_flat = chunk_features.flatten()
-
-    # Normalize
-    intro_norm = (intro_flat - np.mean(intro_flat)) / (np.std(intro_flat) + 1e-8)
-    chunk_norm = (chunk_flat - np.mean(chunk_flat)) / (np.std(chunk_flat) + 1e-8)
-
-    # Cross-correlation
-    correlation = correlate(chunk_norm, intro_norm, mode='valid')
-
-    # Normalize by length
-    correlation = correlation / len(intro_norm)
-
-    return correlation
+    return normalized_cross_correlation(intro_features, chunk_features)
 
 
 def load_audio_from_file(file_path, sr=SAMPLE_RATE):
@@ -197,317 +206,489 @@ def load_audio_from_file(file_path, sr=SAMPLE_RATE):
     return audio
 
 
+def load_intro_template(intro_audio_path, features=DEFAULT_FEATURES):
+    """
+    Load the features of the intro snippet at full and coarse resolution.
+
+    Features are served from the on-disk template cache next to the database
+    when the snippet and analysis parameters are unchanged.
+
+    Args:
+        features: Feature profile (key of FEATURE_PROFILES); coarse features
+            come from its screening backend, full-resolution features from
+            its confirmation backend
+
+    Returns:
+        (intro_features, intro_coarse, intro_duration) tuple
+    """
+    if not Path(intro_audio_path).exists():
+        raise FileNotFoundError(f"Audio file not found: {intro_audio_path}")
+
+    screen, confirm = feature_profile(features)
+    sr = confirm.sample_rate
+
+    def compute():
+        intro_audio = load_audio_from_file(intro_audio_path, sr)
+        return {
+            "features": confirm.extract(intro_audio, scaled_hop(HOP_LENGTH, confirm)),
+            "coarse": screen.extract(intro_audio, scaled_hop(COARSE_HOP_LENGTH, screen)),
+            "duration": np.array(len(intro_audio) / sr),
+        }
+
+    params = {
+        "sample_rate": sr,
+        "hop_length": HOP_LENGTH,
+        "coarse_hop_length": COARSE_HOP_LENGTH,
+        "feature_type": f"{screen.name}/{confirm.name}",
+    }
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), template_cache.TEMPLATE_CACHE_DIR)
+    with instrumentation.stage("template"):
+        template, hit = template_cache.get_or_compute(intro_audio_path, params, compute, cache_dir)
+    instrumentation.count("template_cache_hits" if hit else "template_cache_misses")
+    if hit:
+        print(f"Loaded intro features from template cache: {intro_audio_path}")
+
+    return template["features"], template["coarse"], float(template["duration"])
+
+
 def stream_audio_from_video(video_path, chunk_duration, sr=SAMPLE_RATE):
+    """
+    Slide a window of chunk_duration seconds over the audio of a video.
+
+    The container is opened and decoded once; decoded PCM is pushed into a ring
+    buffer and each window is cut from there, advancing by SLIDE_INTERVAL.
+
+    Yields:
+        (audio_chunk, chunk_start) tuples
+    """
     print(f"Streaming audio from video: {video_path}")
 
     if not Path(video_path).exists():
         raise FileNotFoundError(f"Video file not found: {video_path}")
 
-    # Get video duration first
-    duration_cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        video_path
-    ]
-
     try:
-        duration_output = subprocess.check_output(duration_cmd, stderr=subprocess.STDOUT, text=True)
-        total_duration = float(duration_output.strip())
-        print(f"Video duration: {format_timestamp(total_duration)}")
+        total_duration = probe_duration(video_path)
+        if total_duration:
+            print(f"Video duration: {format_timestamp(total_duration)}")
     except Exception as e:
         print(f"Warning: Could not get video duration: {e}")
-        total_duration = None
 
-    # Stream audio in chunks
-    chunk_start = 0
+    window_samples = int(chunk_duration * sr)
+    slide_samples = int(SLIDE_INTERVAL * sr)
+    ring = AudioRingBuffer(window_samples + slide_samples + int(DECODE_BLOCK_DURATION * sr) + 1)
+
+    chunk_start_sample = 0
     chunk_num = 0
 
-    while True:
-        # Stop if we know we're past the end
-        if total_duration and chunk_start >= total_duration:
-            break
+    def window(end_sample):
+        nonlocal chunk_num
+        chunk_num += 1
+        audio_chunk = ring.read(chunk_start_sample, end_sample)
+        chunk_start = chunk_start_sample / sr
+        window_end = chunk_start + chunk_duration
+        actual_duration = len(audio_chunk) / sr
+        print(f"  Window {chunk_num}: {format_timestamp(chunk_start)} - {format_timestamp(window_end)} "
+              f"({format_timestamp(actual_duration)} actual)")
+        return audio_chunk, chunk_start
 
-        # Extract audio chunk using ffmpeg
-        cmd = [
-            'ffmpeg',
-            '-ss', str(chunk_start),  # Start time
-            '-t', str(chunk_duration),  # Duration
-            '-i', video_path,
-            '-vn',  # No video
-            '-acodec', 'pcm_s16le',  # Raw PCM
-            '-ar', str(sr),  # Sample rate
-            '-ac', '1',  # Mono
-            '-f', 's16le',  # Output format
-            '-'  # Output to stdout
-        ]
-
-        try:
-            # Run ffmpeg
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-
-            audio_data, stderr = process.communicate()
-
-            if process.returncode != 0:
-                if chunk_num == 0:
-                    # First chunk failed - real error
-                    raise RuntimeError(f"ffmpeg failed: {stderr.decode()}")
-                else:
-                    # Later chunk failed - probably reached end of file
-                    break
-
-            if len(audio_data) == 0:
-                # No more data
-                break
-
-            # Convert bytes to numpy array
-            audio_chunk = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32)
-            audio_chunk /= 32768.0  # Normalize to [-1, 1]
-
-            if len(audio_chunk) == 0:
-                break
-
-            chunk_num += 1
-            window_end = chunk_start + chunk_duration
-            actual_duration = len(audio_chunk) / sr
-            print(f"  Window {chunk_num}: {format_timestamp(chunk_start)} - {format_timestamp(window_end)} "
-                  f"({format_timestamp(actual_duration)} actual)")
-
-            yield audio_chunk, chunk_start
-
-            chunk_start += SLIDE_INTERVAL  # Slide window forward by 5 seconds
-
-        except Exception as e:
-            print(f"Error extracting audio chunk: {e}")
-            break
+    for block, _ in decode_audio_blocks(video_path, sr):
+        ring.append(block)
+
+        while chunk_start_sample + window_samples <= ring.total_written:
+            yield window(chunk_start_sample + window_samples)
+            chunk_start_sample += slide_samples
 
+    # Partial windows at the end of the stream
+    while chunk_start_sample < ring.total_written:
+        yield window(ring.total_written)
+        chunk_start_sample += slide_samples
 
-def extract_audio_snippet(video_path, start_time, duration, sr=SAMPLE_RATE):
-    # Ensure start_time is not negative
-    start_time = max(0, start_time)
 
-    cmd = [
-        'ffmpeg',
-        '-ss', str(start_time),
-        '-t', str(duration),
-        '-i', video_path,
-        '-vn',
-        '-acodec', 'pcm_s16le',
-        '-ar', str(sr),
-        '-ac', '1',
-        '-f', 's16le',
-        '-'
-    ]
+def stream_coarse_features(video_path, audio_buffer, sr=SAMPLE_RATE, hop_length=COARSE_HOP_LENGTH, start_time=0.0, duration=None,
+                           backend=FEATURE_BACKENDS["cqt"]):
+    """
+    Decode the audio of a video once and compute its low-resolution features.
+
+    Decoded PCM is also pushed into audio_buffer, so candidate regions can
+    later be rescored at full resolution without decoding them again. With
+    start_time/duration only that part of the video is decoded; frame 0 and
+    sample 0 of audio_buffer then lie at start_time.
+
+    Args:
+        sr: Decoding sample rate, must be the sample rate of backend
+        backend: FeatureBackend computing the features
+
+    Yields:
+        Feature frames (backend.n_features x n) in stream order, as soon as they are computable
+    """
+    print(f"Streaming audio from video: {video_path}")
+
+    if not Path(video_path).exists():
+        raise FileNotFoundError(f"Video file not found: {video_path}")
 
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        audio_data, stderr = process.communicate()
+        with instrumentation.stage("probe"):
+            total_duration = probe_duration(video_path)
+        if total_duration:
+            print(f"Video duration: {format_timestamp(total_duration)}")
+    except Exception as e:
+        print(f"Warning: Could not get video duration: {e}")
 
-        if process.returncode != 0 or len(audio_data) == 0:
-            return None
+    feature_stream = backend.stream(hop_length)
 
-        audio_chunk = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32)
-        audio_chunk /= 32768.0
+    for block, _ in instrumentation.timed(audio_cache.audio_blocks(video_path, sr, start_time, duration), "decode"):
+        instrumentation.count("decoded_seconds", len(block) / sr)
+        audio_buffer.append(block)
+        with instrumentation.stage("features"):
+            frames = feature_stream.push(block)
+        if frames.shape[1]:
+            yield frames
 
-        return audio_chunk
-    except Exception:
-        return None
+    with instrumentation.stage("features"):
+        frames = feature_stream.flush()
+    if frames.shape[1]:
+        yield frames
 
 
-def refine_match_location(video_path, intro_features, coarse_match_time, intro_duration, interval=REFINEMENT_INTERVAL):
+def refine_match_location(audio_buffer, intro_features, coarse_match_time, intro_duration, stream_start=0.0,
+                          backend=FEATURE_BACKENDS["cqt"]):
     """
-    Perform fine-grained search around a coarse match location.
+    Rescore a coarse match at full resolution from already-decoded audio.
+
+    Computes full-resolution features for the intro plus REFINEMENT_MARGIN on
+    each side and correlates them with the intro; the peak is interpolated to
+    sub-frame precision.
 
     Args:
-        video_path: Path to video file
-        intro_features: Pre-computed intro features
+        audio_buffer: AudioRingBuffer holding the decoded audio around the match
+        intro_features: Full-resolution intro features
         coarse_match_time: Timestamp from coarse search
         intro_duration: Duration of intro in seconds
+        stream_start: Video timestamp of the first sample in audio_buffer
+        backend: FeatureBackend the intro features were computed with; its
+            sample rate must be the one of audio_buffer
 
     Returns:
         (best_time, best_score) tuple
     """
-    # Extract a snippet around the coarse match
-    snippet_start = coarse_match_time - REFINEMENT_WINDOW
-    snippet_duration = 2 * REFINEMENT_WINDOW + intro_duration + interval
+    sr = backend.sample_rate
 
-    print(f"\n  → Refining search around {format_timestamp(coarse_match_time)}...")
-    print(f"     Extracting snippet: {format_timestamp(max(0, snippet_start))} - {format_timestamp(snippet_start + snippet_duration)}")
+    # Extra context keeps feature edge effects out of the searched lags
+    region_start = max(0, coarse_match_time - stream_start - REFINEMENT_MARGIN - backend.context)
+    region_end = coarse_match_time - stream_start + intro_duration + REFINEMENT_MARGIN + backend.context
 
-    snippet_audio = extract_audio_snippet(video_path, snippet_start, snippet_duration)
+    start_sample = max(int(region_start * sr), audio_buffer.first_sample)
+    end_sample = min(int(region_end * sr), audio_buffer.total_written)
+    if end_sample <= start_sample:
+        return coarse_match_time, 0.0
 
-    if snippet_audio is None:
-        print(f"     Failed to extract snippet for refinement")
+    print(f"  → Refining {format_timestamp(coarse_match_time)} at full resolution...")
+
+    # Score the region on REFINEMENT_PHASES frame grids shifted by a fraction
+    # of a hop; interleaved, the curves sample every hop / REFINEMENT_PHASES
+    # samples, so the score no longer depends on where the intro falls on one
+    # grid. All grids come from one extraction at the finer hop.
+    phase_step = scaled_hop(HOP_LENGTH, backend) // REFINEMENT_PHASES
+    region_features = backend.extract(audio_buffer.read(start_sample, end_sample), phase_step)
+    curves = [compute_correlation(intro_features, region_features[:, phase::REFINEMENT_PHASES])
+              for phase in range(REFINEMENT_PHASES)]
+
+    n_lags = min(len(curve) for curve in curves)
+    if n_lags == 0:
+        return coarse_match_time, 0.0
+    correlation_scores = np.stack([curve[:n_lags] for curve in curves], axis=1).reshape(-1)
+
+    # Only lags within REFINEMENT_MARGIN of the coarse match; lags in the
+    # context band see padded chroma and can peak on a partial overlap
+    step = phase_step / sr
+    coarse_offset = coarse_match_time - stream_start - start_sample / sr
+    first_lag = max(0, int(np.floor((coarse_offset - REFINEMENT_MARGIN) / step)))
+    last_lag = min(len(correlation_scores), int(np.ceil((coarse_offset + REFINEMENT_MARGIN) / step)) + 1)
+    if last_lag <= first_lag:
         return coarse_match_time, 0.0
 
-    # Slide through snippet with fine-grained intervals
-    best_time = coarse_match_time
-    best_score = 0.0
+    max_corr_idx = first_lag + int(np.argmax(correlation_scores[first_lag:last_lag]))
+    offset = interpolate_peak(correlation_scores, max_corr_idx)
+    best_time = stream_start + start_sample / sr + offset * step
 
-    actual_snippet_start = max(0, snippet_start)
-    window_start = 0
-    snippet_duration_actual = len(snippet_audio) / SAMPLE_RATE
+    return best_time, float(correlation_scores[max_corr_idx])
 
-    while window_start < snippet_duration_actual - intro_duration:
-        # Extract window from snippet
-        window_start_sample = int(window_start * SAMPLE_RATE)
-        window_end_sample = int((window_start + intro_duration) * SAMPLE_RATE)
 
-        if window_end_sample > len(snippet_audio):
-            break
+def search_intro(video_path, templates, intro_paths, correlation_threshold, start_time=0.0, duration=None,
+                 features=DEFAULT_FEATURES):
+    """
+    Coarse-to-fine search for the intro templates in (part of) a video.
 
-        window_audio = snippet_audio[window_start_sample:window_end_sample]
-        window_features = extract_audio_features(window_audio)
+    Args:
+        templates: List of (intro_features, intro_coarse, intro_duration) tuples,
+            loaded with the same feature profile
+        intro_paths: Snippet path of each template, for reporting
+        start_time: Video timestamp to start decoding at
+        duration: Seconds of video to search (None = until the end)
+        features: Feature profile (key of FEATURE_PROFILES)
 
-        # Check if window is long enough
-        if window_features.shape[1] >= intro_features.shape[1]:
-            correlation_scores = compute_correlation(intro_features, window_features)
+    Returns:
+        (best_match_time, best_match_score, best_template_index) tuple; the
+        score is always one of the confirmation backend, best_match_time is
+        None if no coarse peak was strong enough to be refined
+    """
+    screen, confirm = feature_profile(features)
+    sr = screen.sample_rate
+    coarse_hop_length = scaled_hop(COARSE_HOP_LENGTH, screen)
 
-            if len(correlation_scores) > 0:
-                max_corr_idx = np.argmax(correlation_scores)
-                max_corr_score = correlation_scores[max_corr_idx]
+    intro_coarse_list = [template[1] for template in templates]
+    max_intro_duration = max(template[2] for template in templates)
 
-                # Convert to absolute timestamp
-                offset_frames = max_corr_idx // intro_features.shape[0]
-                offset_time = offset_frames * HOP_LENGTH / SAMPLE_RATE
-                absolute_time = actual_snippet_start + window_start + offset_time
+    coarse_frames_per_second = sr / coarse_hop_length
+    intro_frames = max(intro_coarse.shape[1] for intro_coarse in intro_coarse_list)
+    neighbourhood = int(np.ceil(REFINEMENT_MARGIN * coarse_frames_per_second))
 
-                if max_corr_score > best_score:
-                    best_score = max_corr_score
-                    best_time = absolute_time
-                    print(f"     Fine-grained match: {format_timestamp(best_time)} (correlation: {max_corr_score:.4f})")
+    # Enough audio history to rescore a peak once its neighbourhood is scored
+    lookahead = FEATURE_BLOCK_DURATION + 2 * FEATURE_CONTEXT + 2 * DECODE_BLOCK_DURATION
+    audio_buffer = AudioRingBuffer(int((max_intro_duration + 2 * REFINEMENT_MARGIN + lookahead) * sr))
+    feature_buffer = FeatureRingBuffer(screen.n_features, intro_frames + neighbourhood + int(lookahead * coarse_frames_per_second))
 
-                # Found strong match - stop refining!
-                if max_corr_score >= REFINEMENT_THRESHOLD:
-                    print(f"     ✓ Strong match found!")
-                    break
+    # Best score over all templates per coarse lag, and the template that reached it
+    coarse_scores = np.zeros(0)
+    coarse_winners = np.zeros(0, dtype=int)
+    next_peak_lag = 0  # first coarse lag not yet examined for peaks
+    top_coarse_scores = []  # best REFINEMENT_CANDIDATES coarse peak scores so far
 
-        window_start += interval
+    best_match_time = None
+    best_match_score = 0.0
+    best_template = 0
+    best_coarse = None  # (time, score) of the best screening peak too weak to refine, for reporting
+
+    def rescore_peaks(end_lag):
+        """Rescore new coarse peaks that rank among the best so far; return the first strong match."""
+        nonlocal next_peak_lag, best_match_time, best_match_score, best_template, best_coarse
+
+        peaks = find_peaks(coarse_scores, next_peak_lag, end_lag, neighbourhood)
+        next_peak_lag = max(next_peak_lag, end_lag)
+
+        for lag in peaks:
+            coarse_score = coarse_scores[lag]
+            if len(top_coarse_scores) >= REFINEMENT_CANDIDATES and coarse_score <= top_coarse_scores[-1]:
+                continue
+            top_coarse_scores.append(coarse_score)
+            top_coarse_scores.sort(reverse=True)
+            del top_coarse_scores[REFINEMENT_CANDIDATES:]
+
+            winner = int(coarse_winners[lag])
+            intro_features, _, intro_duration = templates[winner]
+            coarse_time = start_time + lag / coarse_frames_per_second
+
+            # Refinement rarely lifts a score by this much; on a slowly rising
+            # noise floor, refining every new top peak would cost more than the scan
+            if coarse_score < correlation_threshold * REFINEMENT_MIN_RATIO:
+                if best_coarse is None or coarse_score > best_coarse[1]:
+                    best_coarse = (coarse_time, float(coarse_score))
+                continue
+
+            template_note = f", {os.path.basename(str(intro_paths[winner]))}" if len(templates) > 1 else ""
+            print(f"    Candidate at {format_timestamp(coarse_time)} (coarse correlation: {coarse_score:.4f}{template_note})")
+
+            with instrumentation.stage("refinement"):
+                refined_time, refined_score = refine_match_location(audio_buffer, intro_features, coarse_time, intro_duration,
+                                                                    stream_start=start_time, backend=confirm)
+            instrumentation.count("refinements")
+            if refined_score > best_match_score:
+                best_match_score = refined_score
+                best_match_time = refined_time
+                best_template = winner
+                print(f"    New best match at {format_timestamp(best_match_time)} (correlation: {best_match_score:.4f})")
+
+            if refined_score >= correlation_threshold:
+                instrumentation.count("early_exits")
+                return True
+        return False
+
+    for new_frames in stream_coarse_features(video_path, audio_buffer, sr, coarse_hop_length, start_time, duration,
+                                             backend=screen):
+        feature_buffer.append(new_frames)
+
+        # Score every alignment at which all templates fit completely now
+        first_lag = len(coarse_scores)
+        if feature_buffer.total_written - first_lag >= intro_frames:
+            window = feature_buffer.read(first_lag, feature_buffer.total_written)
+            with instrumentation.stage("correlation"):
+                scores = normalized_cross_correlation_batch(intro_coarse_list, window)
+            coarse_scores = np.concatenate((coarse_scores, scores.max(axis=0)))
+            coarse_winners = np.concatenate((coarse_winners, scores.argmax(axis=0)))
+
+        # A peak is final once its whole neighbourhood has been scored
+        if rescore_peaks(len(coarse_scores) - neighbourhood):
+            break
+    else:
+        # End of stream: peaks near the end have no complete neighbourhood
+        rescore_peaks(len(coarse_scores))
 
-    return best_time, best_score
+    if best_match_time is None and best_coarse is not None:
+        # Nothing was worth refining. Screening scores are not on the scale of
+        # the confirmation backend (and its audio is gone), so no match is reported
+        print(f"    Best screening peak at {format_timestamp(best_coarse[0])} "
+              f"(coarse correlation: {best_coarse[1]:.4f}), too weak to refine")
 
+    return best_match_time, best_match_score, best_template
 
-def find_intro_in_video(video_path, intro_audio_path, movie_hash, file_size, correlation_threshold=CORRELATION_THRESHOLD, outro_length=0):
-    # Load intro audio and extract features
-    intro_audio = load_audio_from_file(intro_audio_path)
-    intro_features = extract_audio_features(intro_audio)
-    intro_duration = len(intro_audio) / SAMPLE_RATE
 
-    print(f"\nIntro features shape: {intro_features.shape}")
-    print(f"Intro duration: {format_timestamp(intro_duration)}")
-    print(f"Correlation threshold: {correlation_threshold}")
-    print(f"\nScanning video...")
+def find_outro_in_video(video_path, outro_audio_path, correlation_threshold=CORRELATION_THRESHOLD, templates=None,
+                        search_duration=OUTRO_SEARCH_DURATION, media_duration=None, features=DEFAULT_FEATURES):
+    """
+    Find an outro (credits) snippet at the end of a video.
 
-    best_match_time = None
-    best_match_score = 0.0
+    Only the last search_duration seconds are decoded: the decoder seeks
+    straight to them and the same coarse-to-fine search as for the intro
+    runs on that part.
 
-    # Stream through video chunks using intro duration as window size
-    for chunk_audio, chunk_start_time in stream_audio_from_video(video_path, intro_duration):
-        chunk_duration_actual = len(chunk_audio) / SAMPLE_RATE
-
-        # Extract features from chunk
-        chunk_features = extract_audio_features(chunk_audio)
-
-        # Check if chunk is long enough
-        intro_frames = intro_features.shape[1]
-        chunk_frames = chunk_features.shape[1]
-
-        if chunk_frames < intro_frames:
-            # Chunk too short to contain intro
-            continue
-
-        # Compute correlation across entire chunk
-        correlation_scores = compute_correlation(intro_features, chunk_features)
-
-        # Find peak correlation
-        if len(correlation_scores) > 0:
-            max_corr_idx = np.argmax(correlation_scores)
-            max_corr_score = correlation_scores[max_corr_idx]
-
-            # Convert correlation index to timestamp
-            # Each correlation point corresponds to a feature frame
-            feature_size = intro_features.shape[0] * intro_features.shape[1]
-            offset_frames = max_corr_idx // intro_features.shape[0]
-            offset_time = offset_frames * HOP_LENGTH / SAMPLE_RATE
-            match_time = chunk_start_time + offset_time
-
-            # Update best match
-            if max_corr_score > best_match_score:
-                best_match_score = max_corr_score
-                best_match_time = match_time
-
-                print(f"    New best match at {format_timestamp(best_match_time)} (correlation: {max_corr_score:.4f})")
-
-                # Trigger fine-grained refinement if score is promising
-                if max_corr_score >= REFINEMENT_TRIGGER:
-                    refined_time, refined_score = refine_match_location(
-                        video_path, intro_features, best_match_time, intro_duration
-                    )
-
-                    if refined_score > best_match_score:
-                        best_match_score = refined_score
-                        best_match_time = refined_time
-
-                    # Found strong match after refinement - stop searching!
-                    if refined_score >= REFINEMENT_THRESHOLD:
-                        print(f"\n✓ MATCH FOUND (after refinement)!")
-                        print(f"  Timestamp: {format_timestamp(best_match_time)}")
-                        print(f"  Correlation: {best_match_score:.4f}")
-
-                        # Save to database
-                        end_time = best_match_time + intro_duration
-                        save_intro_timestamps(video_path, best_match_time, end_time, best_match_score,
-                                              movie_hash, file_size, outro_length)
-
-                        return best_match_time, best_match_score
-
-            # Found a match above threshold in coarse search - stop searching!
-            if max_corr_score >= correlation_threshold:
-                print(f"\n✓ MATCH FOUND!")
-                print(f"  Timestamp: {format_timestamp(best_match_time)}")
-                print(f"  Correlation: {max_corr_score:.4f}")
-
-                # Save to database
-                end_time = best_match_time + intro_duration
-                save_intro_timestamps(video_path, best_match_time, end_time, max_corr_score, movie_hash, file_size, outro_length)
-
-                return best_match_time, max_corr_score
-
-    # Finished scanning without finding match above threshold
-    # Last resort: refine around the best coarse match we saw
-    if best_match_time is not None and best_match_score < correlation_threshold:
-        print(f"\n  No match above threshold, attempting refinement on best coarse match at {format_timestamp(best_match_time)} ({best_match_score:.4f})...")
-        refined_time, refined_score = refine_match_location(
-            video_path, intro_features, best_match_time, intro_duration,
-            interval=REFINEMENT_INTERVAL / 2
-        )
+    Args:
+        outro_audio_path: Path to the outro snippet, or a list of paths
+        templates: Pre-loaded templates of the snippets (see load_intro_template)
+        search_duration: Seconds at the end of the video to search
+        media_duration: Duration of the video in seconds, probed if None
+        features: Feature profile (key of FEATURE_PROFILES)
 
-        if refined_score >= correlation_threshold:
-            best_match_score = refined_score
-            best_match_time = refined_time
-            print(f"\n✓ MATCH FOUND (after last-resort refinement)!")
-            print(f"  Timestamp: {format_timestamp(best_match_time)}")
-            print(f"  Correlation: {best_match_score:.4f}")
+    Returns:
+        (outro_length, best_match_score, best_outro_path) tuple; outro_length
+        is the time from the start of the match to the end of the video, None
+        if no match reached correlation_threshold
+    """
+    if isinstance(outro_audio_path, (str, os.PathLike)):
+        outro_paths = [outro_audio_path]
+    else:
+        outro_paths = list(outro_audio_path)
+    if templates is None:
+        templates = [load_intro_template(path, features) for path in outro_paths]
+
+    if media_duration is None:
+        with instrumentation.stage("probe"):
+            media_duration = probe_duration(video_path)
+    if not media_duration:
+        print(f"\n✗ Outro: video duration unknown, cannot search the end")
+        return None, 0.0, None
+
+    search_start = max(0.0, media_duration - search_duration)
+    print(f"\nScanning the last {format_timestamp(media_duration - search_start)} for the outro...")
+    match_time, match_score, match_template = search_intro(video_path, templates, outro_paths, correlation_threshold,
+                                                           search_start, features=features)
+
+    if match_time is None or match_score < correlation_threshold:
+        best = "" if match_time is None else f" (best correlation: {match_score:.4f})"
+        print(f"✗ Outro not found{best}")
+        instrumentation.count("outro_misses")
+        return None, match_score, None
+
+    outro_length = max(0.0, media_duration - match_time)
+    print(f"✓ Outro at {format_timestamp(match_time)}, last {format_timestamp(outro_length)} "
+          f"(correlation: {match_score:.4f})")
+    instrumentation.count("outro_matches")
+    return outro_length, match_score, outro_paths[match_template]
+
+
+def find_intro_in_video(video_path, intro_audio_path, movie_hash, file_size, correlation_threshold=CORRELATION_THRESHOLD, outro_length=0,
+                        templates=None, save=True, search_window=None, features=DEFAULT_FEATURES,
+                        outro_audio_path=None, outro_templates=None, outro_search_duration=OUTRO_SEARCH_DURATION):
+    """
+    Scan a video for one or more intro snippets and save the match to the database.
 
-            end_time = best_match_time + intro_duration
-            save_intro_timestamps(video_path, best_match_time, end_time, best_match_score,
-                                  movie_hash, file_size, outro_length)
+    All snippets are scored against the same decoded audio and coarse feature
+    stream in one batched correlation, so decoding and feature extraction are
+    paid once however many snippets are given. The best-scoring snippet wins.
 
-            return best_match_time, best_match_score
+    Args:
+        intro_audio_path: Path to the intro snippet, or a list of paths
+        templates: Pre-loaded list of (intro_features, intro_coarse, intro_duration)
+            tuples as returned by load_intro_template, one per snippet
+            (loaded from intro_audio_path if None)
+        save: Write a match to the database; batch callers that collect results
+            in a single writer pass False
+        search_window: Optional (earliest, latest) intro start time in seconds,
+            e.g. from search_priors; searched first, the whole video only on a miss
+        features: Feature profile (key of FEATURE_PROFILES) used for screening
+            and confirmation; pre-loaded templates must use the same profile
+        outro_audio_path: Optional outro snippet (or list of them); if the
+            intro matches, the end of the video is searched for it and the
+            detected outro length is saved instead of outro_length
+        outro_templates: Pre-loaded templates of the outro snippets
+        outro_search_duration: Seconds at the end of the video searched for the outro
+
+    Returns:
+        (best_match_time, best_match_score, best_intro_path) tuple
+    """
+    if isinstance(intro_audio_path, (str, os.PathLike)):
+        intro_paths = [intro_audio_path]
+    else:
+        intro_paths = list(intro_audio_path)
+    if templates is None:
+        templates = [load_intro_template(path, features) for path in intro_paths]
+
+    for path, (intro_features, intro_coarse, intro_duration) in zip(intro_paths, templates):
+        print(f"\nIntro: {path}")
+        print(f"  Features shape: {intro_features.shape} (coarse: {intro_coarse.shape})")
+        print(f"  Duration: {format_timestamp(intro_duration)}")
+    print(f"Features: {features}")
+    print(f"Correlation threshold: {correlation_threshold}")
+
+    best_match_time = None
+    best_match_score = 0.0
+    best_template = 0
+
+    if search_window is not None:
+        earliest, latest = search_window
+        # Room for the chroma context and the refinement margin on both sides
+        window_start = max(0.0, earliest - REFINEMENT_MARGIN - FEATURE_CONTEXT)
+        window_duration = (latest - window_start + max(template[2] for template in templates)
+                           + REFINEMENT_MARGIN + FEATURE_CONTEXT)
+
+        print(f"\nScanning prior window {format_timestamp(earliest)} - {format_timestamp(latest)}...")
+        best_match_time, best_match_score, best_template = search_intro(
+            video_path, templates, intro_paths, correlation_threshold, window_start, window_duration, features
+        )
+        if best_match_score >= correlation_threshold:
+            print(f"  Prior window hit")
+            instrumentation.count("prior_window_hits")
+        else:
+            print(f"  Prior window missed, widening to the whole video")
+            instrumentation.count("prior_window_misses")
+
+    if best_match_score < correlation_threshold:
+        print(f"\nScanning video...")
+        match_time, match_score, match_template = search_intro(video_path, templates, intro_paths, correlation_threshold,
+                                                               features=features)
+        if match_time is not None and match_score > best_match_score:
+            best_match_time, best_match_score, best_template = match_time, match_score, match_template
+
+    best_intro_path = intro_paths[best_template] if best_match_time is not None else None
+
+    if best_match_score >= correlation_threshold:
+        print(f"\n✓ MATCH FOUND!")
+        print(f"  Timestamp: {format_timestamp(best_match_time)}")
+        print(f"  Correlation: {best_match_score:.4f}")
+        if len(templates) > 1:
+            print(f"  Intro: {best_intro_path}")
+
+        # Save to database
+        if save:
+            if outro_audio_path:
+                detected_length, _, _ = find_outro_in_video(video_path, outro_audio_path, correlation_threshold,
+                                                            outro_templates, outro_search_duration, features=features)
+                if detected_length is not None:
+                    outro_length = detected_length
+            end_time = best_match_time + templates[best_template][2]
+            save_intro_timestamps(video_path, best_match_time, end_time, best_match_score, movie_hash, file_size, outro_length)
+
+        return best_match_time, best_match_score, best_intro_path
 
     if best_match_time is not None:
         print(f"\n✗ No match above threshold")
         print(f"  Best match: {format_timestamp(best_match_time)} (correlation: {best_match_score:.4f})")
+        if len(templates) > 1:
+            print(f"  Intro: {best_intro_path}")
         print(f"  Try lowering --correlation-threshold below {best_match_score:.4f}")
     else:
         print(f"\n✗ No match found")
 
-    return best_match_time, best_match_score
+    return best_match_time, best_match_score, best_intro_path
 
 
 if __name__ == "__main__":
@@ -517,7 +698,8 @@ if __name__ == "__main__":
         description="Find where an audio snippet occurs in a video file using chromagram correlation"
     )
     parser.add_argument("video", help="Path to video file")
-    parser.add_argument("audio_snippet", help="Path to audio snippet (intro)")
+    parser.add_argument("audio_snippet", nargs="+",
+                        help="Path to audio snippet (intro); give several to match e.g. one snippet per season at once")
     parser.add_argument(
         "--correlation-threshold",
         type=float,
@@ -528,45 +710,114 @@ if __name__ == "__main__":
         "--outro-length",
         type=float,
         default=0,
-        help="Length of outro in seconds (default: 0, disabled)"
+        help="Length of outro in seconds (default: 0, disabled); with --outro, used if the outro is not found"
+    )
+    parser.add_argument(
+        "--outro",
+        nargs="+",
+        help="Outro (credits) snippet; the end of the video is searched for it to save the outro length of the episode"
+    )
+    parser.add_argument(
+        "--outro-search",
+        type=float,
+        default=OUTRO_SEARCH_DURATION,
+        help=f"Seconds at the end of the video searched for the outro (default: {OUTRO_SEARCH_DURATION})"
+    )
+    parser.add_argument(
+        "--features",
+        choices=sorted(FEATURE_PROFILES),
+        default=DEFAULT_FEATURES,
+        help=f"Feature backend ({describe_feature_profiles()}) (default: {DEFAULT_FEATURES})"
     )
     parser.add_argument(
         "--force",
         action="store_true",
-        help="Re-process files even if already known, overwriting existing data"
+        help="Re-process files even if already known; a match overwrites the stored intro"
+    )
+    parser.add_argument(
+        "--no-prior",
+        action="store_true",
+        help="Always scan from the start instead of searching the usual intro offset of the series first"
+    )
+    parser.add_argument(
+        "--tmdb-offline",
+        action="store_true",
+        help="Only use cached TMDB ids; unknown titles are left for tmdb_lookup.py --update-db"
+    )
+    parser.add_argument(
+        "--audio-cache",
+        action="store_true",
+        help="Keep the decoded audio on local disk, so scanning this file again does not decode it again"
+    )
+    parser.add_argument(
+        "--audio-cache-size",
+        type=float,
+        default=audio_cache.AUDIO_CACHE_MAX_SIZE / 1024 ** 3,
+        help=f"Size limit of the audio cache in GiB (default: {audio_cache.AUDIO_CACHE_MAX_SIZE // 1024 ** 3})"
+    )
+    parser.add_argument(
+        "--stats",
+        help="Append a JSON record with the time spent per stage to this file"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the scan and write the result to this file (cProfile; pyinstrument for *.html)"
     )
 
     args = parser.parse_args()
 
+    if args.tmdb_offline:
+        tmdb_lookup.configure(offline=True)
+    if args.audio_cache:
+        enable_audio_cache(int(args.audio_cache_size * 1024 ** 3))
+
+    instrumentation.start(args.video)
 
     file_name = os.path.basename(args.video)
-    movie_hash, file_size = calculate_opensubtitles_hash(args.video)
+    with instrumentation.stage("hash"):
+        movie_hash, file_size = calculate_opensubtitles_hash(args.video)
 
     print(f'checking name: {file_name}, hash: {movie_hash}')
-    cursor.execute("SELECT COUNT(*) FROM intro_timestamps WHERE file_name = ? or movie_hash = ?", (file_name, movie_hash))
-    count = int(cursor.fetchone()[0])
-    if count != 0:
+    if is_known(file_name, movie_hash):
         if not args.force:
             print(f'file already known, skipping')
             exit(0)
         print(f'file already known, re-processing (--force)')
-        cursor.execute("DELETE FROM intro_timestamps WHERE file_name = ? or movie_hash = ?", (file_name, movie_hash))
-        conn.commit()
+
+    search_window = None
+    if not args.no_prior:
+        search_window = SeriesPriors.from_database(get_database()).window(args.video)
 
     # Run detection
-    timestamp, score = find_intro_in_video(
-        args.video,
-        args.audio_snippet,
-        movie_hash,
-        file_size,
-        correlation_threshold=args.correlation_threshold,
-        outro_length=args.outro_length
-    )
+    with instrumentation.profiled(args.profile):
+        timestamp, score, intro_path = find_intro_in_video(
+            args.video,
+            args.audio_snippet,
+            movie_hash,
+            file_size,
+            correlation_threshold=args.correlation_threshold,
+            outro_length=args.outro_length,
+            search_window=search_window,
+            features=args.features,
+            outro_audio_path=args.outro,
+            outro_search_duration=args.outro_search
+        )
+
+    stats = instrumentation.finish()
+    stats["start_time"] = timestamp
+    stats["score"] = float(score)
+    print(f"\nTiming: {instrumentation.format_record(stats)}")
+    if args.stats:
+        instrumentation.write_record(args.stats, stats)
+    if args.profile:
+        print(f"Profile written to {args.profile}")
 
     if timestamp is not None and score >= args.correlation_threshold:
         print(f"\n{'='*60}")
         print(f"SUCCESS: Intro found at {format_timestamp(timestamp)}")
         print(f"Correlation score: {score:.4f}")
+        if len(args.audio_snippet) > 1:
+            print(f"Matching intro: {intro_path}")
         print(f"{'='*60}")
         sys.exit(0)
     else:
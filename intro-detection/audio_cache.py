@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Local disk cache of decoded audio, for scanning the same files again.
+
+Tuning the threshold, trying another snippet or re-running with --force used
+to decode every episode from the (network) share again. With the cache
+enabled (configure(), --audio-cache on the command line) the mono float32 PCM
+a scan decodes is also written to a raw file in AUDIO_CACHE_DIR, named after
+the movie hash, the sample rate and the first sample of the decoded range.
+
+A later request for a range inside a cached one memory-maps the file and
+hands out views into the mapping, so nothing is decoded or copied. A request
+that starts inside a cached range but goes beyond it reads the cached part,
+decodes only the rest, and the combined range replaces the old entry. Seeking
+is off by a few milliseconds with some codecs, so the rest is decoded from a
+little earlier and joined where the cached samples end. A scan that stops
+early (a match was found) still leaves the part it decoded.
+
+Entries are kept as float32, so a cached scan sees exactly the samples of a
+decoded one. The directory is kept below a size limit by evicting the least
+recently used entries, as the template cache does (template_cache.evict); a
+hit refreshes the entry's mtime.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+from scipy.signal import correlate
+
+import instrumentation
+import template_cache
+from audio_decoder import DECODE_BLOCK_DURATION, decode_audio_blocks
+from movie_hash import opensubtitles_hash
+
+AUDIO_CACHE_DIR = "audio_cache"  # relative to the database directory
+AUDIO_CACHE_MAX_SIZE = 20 * 1024 ** 3  # bytes; an hour of audio at 22050 Hz takes ~320 MB
+ENTRY_SUFFIX = ".f32"
+EOF_MARK = "eof"  # last field of the name of entries that reach the end of the file
+SAMPLE_BYTES = 4
+COPY_CHUNK = 1 << 20  # samples copied at a time when a cached range is extended
+EXTEND_OVERLAP = 0.25  # seconds decoded again before the end of a cached range when extending it
+ALIGN_SAMPLES = 2048  # samples at the end of a cached range the extension is aligned to
+
+_cache_dir = None  # None: the cache is disabled
+_max_size = AUDIO_CACHE_MAX_SIZE
+_hashes = {}  # path -> ((size, mtime), movie hash)
+
+
+def configure(cache_dir, max_size=AUDIO_CACHE_MAX_SIZE):
+    """Enable the cache in cache_dir, or disable it with None."""
+    global _cache_dir, _max_size
+    _cache_dir = cache_dir
+    _max_size = max_size
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+def _file_key(media_path):
+    """Movie hash of a file, remembered per path while its size and mtime are unchanged."""
+    stat = os.stat(media_path)
+    version = (stat.st_size, stat.st_mtime)
+    known = _hashes.get(media_path)
+    if known is not None and known[0] == version:
+        return known[1]
+    movie_hash, _ = opensubtitles_hash(media_path)
+    _hashes[media_path] = (version, movie_hash)
+    return movie_hash
+
+
+def _entry_path(cache_dir, key, sr, start, eof):
+    name = f"{key}_{sr}_{start}" + (f"_{EOF_MARK}" if eof else "")
+    return os.path.join(cache_dir, name + ENTRY_SUFFIX)
+
+
+def _entries(cache_dir, key, sr):
+    """
+    List the cached ranges of a file at one sample rate.
+
+    Returns:
+        List of (first sample, number of samples, reaches end of file, path)
+    """
+    prefix = f"{key}_{sr}_"
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.startswith(prefix) or not name.endswith(ENTRY_SUFFIX):
+            continue
+        fields = name[len(prefix):-len(ENTRY_SUFFIX)].split("_")
+        path = os.path.join(cache_dir, name)
+        try:
+            start = int(fields[0])
+            samples = os.path.getsize(path) // SAMPLE_BYTES
+        except (ValueError, OSError):
+            continue
+        if samples:
+            entries.append((start, samples, fields[-1] == EOF_MARK, path))
+    return entries
+
+
+def audio_blocks(media_path, sr, start_time=0.0, duration=None, block_duration=DECODE_BLOCK_DURATION):
+    """
+    decode_audio_blocks() through the cache: same arguments, same blocks.
+
+    Decodes directly when the cache is not enabled.
+    """
+    if _cache_dir is None:
+        yield from decode_audio_blocks(media_path, sr, start_time, duration, block_duration)
+        return
+
+    try:
+        key = _file_key(media_path)
+        entries = _entries(_cache_dir, key, sr)
+    except OSError:
+        yield from decode_audio_blocks(media_path, sr, start_time, duration, block_duration)
+        return
+
+    start = int(round(start_time * sr))
+    end = None if duration is None else start + int(round(duration * sr))
+    block_size = max(1, int(block_duration * sr))
+
+    # The cached range reaching furthest from the requested start
+    covering = [entry for entry in entries if entry[0] <= start <= entry[0] + entry[1]]
+    entry = max(covering, key=lambda entry: (entry[2], entry[0] + entry[1]), default=None)
+
+    if entry is None:
+        instrumentation.count("audio_cache_misses")
+        yield from _decode_and_store(media_path, sr, start_time, start, end, block_size, block_duration, key)
+        return
+
+    entry_start, samples, eof, path = entry
+    instrumentation.count("audio_cache_hits")
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    data = np.memmap(path, dtype=np.float32, mode="r")
+    stop = samples if end is None else min(samples, end - entry_start)
+    for offset in range(start - entry_start, stop, block_size):
+        yield data[offset:min(offset + block_size, stop)], start_time + (offset + entry_start - start) / sr
+    if eof or (end is not None and entry_start + samples >= end):
+        return
+
+    # Still reading: decode the rest and cache the combined range
+    instrumentation.count("audio_cache_extensions")
+    yield from _decode_and_store(media_path, sr, start_time, start, end, block_size, block_duration, key,
+                                 (entry_start, data))
+
+
+def _decode_and_store(media_path, sr, start_time, start, end, block_size, block_duration, key, cached=None):
+    """
+    Decode the requested range after the cached samples and write the combined range to a new entry.
+
+    Args:
+        cached: (first sample, samples) of the cached range the request starts
+            in, whose samples were already handed out; None to decode all of it
+
+    Yields:
+        (samples, start time) like decode_audio_blocks()
+    """
+    entry_start = start if cached is None else cached[0]
+    fd, tmp_path = tempfile.mkstemp(dir=_cache_dir, suffix=".tmp")
+    written = 0
+    eof = False
+    failed = True
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if cached is None:
+                resume = start
+                remaining = None if end is None else (end - resume) / sr
+                blocks = (block for block, _ in decode_audio_blocks(media_path, sr, start_time, remaining, block_duration))
+            else:
+                # The new entry starts with the whole cached range
+                data = cached[1]
+                for offset in range(0, len(data), COPY_CHUNK):
+                    f.write(data[offset:offset + COPY_CHUNK])
+                written = len(data)
+                resume = entry_start + written
+                overlap = min(resume, int(EXTEND_OVERLAP * sr))
+                # Decoded beyond the end as well, the seek may land late
+                remaining = None if end is None else (end - resume + 2 * overlap) / sr
+                decoded = decode_audio_blocks(media_path, sr, (resume - overlap) / sr, remaining, block_duration)
+                blocks = _continue_after((block for block, _ in decoded), np.array(data[-ALIGN_SAMPLES:]), overlap)
+
+            decoded = 0
+            for block in blocks:
+                if end is not None:
+                    block = block[:end - resume - decoded]
+                    if len(block) == 0:
+                        break
+                f.write(np.asarray(block, dtype=np.float32).tobytes())
+                yield block, start_time + (resume + decoded - start) / sr
+                decoded += len(block)
+                written += len(block)
+            # The decoder stopped before the requested end: the file ended there
+            eof = end is None or resume + decoded < end
+        failed = False
+    except GeneratorExit:
+        # The caller stopped early; what was written is a valid, shorter range
+        failed = False
+        raise
+    finally:
+        if failed or written == 0:
+            _remove(tmp_path)
+        else:
+            _store(tmp_path, key, sr, entry_start, written, eof)
+
+
+def _continue_after(blocks, tail, overlap):
+    """
+    Skip the samples of a decode that repeat the end of a cached range.
+
+    Seeking is only accurate to a few milliseconds with some codecs, so an
+    extension is decoded from overlap samples before the end of the cached
+    range, and the cached tail is looked up in the first decoded samples.
+
+    Yields:
+        Sample arrays continuing right after tail
+    """
+    head = []
+    head_samples = 0
+    for block in blocks:
+        head.append(block)
+        head_samples += len(block)
+        if head_samples >= 2 * overlap + len(tail):
+            break
+    if not head:
+        return
+    head = np.concatenate(head)
+
+    # Position of the tail in the head by least squared error, the expected
+    # position among equally good ones (silence)
+    expected = overlap - len(tail)
+    if len(head) >= len(tail) > 0 and expected >= 0:
+        energy = np.concatenate(([0.0], np.cumsum(np.square(head, dtype=np.float64))))
+        window_energy = energy[len(tail):] - energy[:-len(tail)]
+        cross = correlate(head.astype(np.float64), tail.astype(np.float64), mode="valid")
+        errors = window_energy - 2 * cross + np.square(tail, dtype=np.float64).sum()
+        best = np.flatnonzero(errors <= errors.min() + 1e-9 * (window_energy.max() + 1e-12))
+        skip = best[np.argmin(np.abs(best - expected))] + len(tail)
+    else:
+        skip = overlap
+
+    if skip < len(head):
+        yield head[skip:]
+    yield from blocks
+
+
+def _store(tmp_path, key, sr, start, samples, eof):
+    """Move a written range into the cache, dropping the ranges it contains, and evict old entries."""
+    path = _entry_path(_cache_dir, key, sr, start, eof)
+    try:
+        for entry_start, entry_samples, entry_eof, entry_path in _entries(_cache_dir, key, sr):
+            contained = entry_start >= start and (
+                eof or (not entry_eof and entry_start + entry_samples <= start + samples))
+            if contained and entry_path != path:
+                _remove(entry_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"  Warning: Could not write audio cache: {e}")
+        _remove(tmp_path)
+        return
+    template_cache.evict(_cache_dir, _max_size, ENTRY_SUFFIX)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+In-process audio decoding for the intro scanner.
+
+Opens the media container once with PyAV and decodes the first audio stream
+into mono float32 PCM at the requested sample rate. Decoded blocks are pushed
+into a ring buffer so the scanner can slide its analysis window over the
+stream without re-opening, re-seeking or re-decoding the file.
+"""
+
+import numpy as np
+import av
+
+DECODE_BLOCK_DURATION = 1.0  # seconds of PCM handed out per decoded block
+
+
+class AudioRingBuffer:
+    """
+    Fixed-capacity circular buffer of mono PCM samples.
+
+    Samples are addressed by their absolute index in the decoded stream, so
+    callers can ask for "samples 44100..66150" without caring where the data
+    currently sits in the underlying array.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.data = np.zeros(self.capacity, dtype=np.float32)
+        self.total_written = 0  # absolute index one past the newest sample
+
+    @property
+    def first_sample(self):
+        """Absolute index of the oldest sample still held in the buffer."""
+        return max(0, self.total_written - self.capacity)
+
+    def append(self, samples):
+        """Append samples, overwriting the oldest data once the buffer is full."""
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(samples) >= self.capacity:
+            # Only the tail can survive anyway
+            self.total_written += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+
+        pos = self.total_written % self.capacity
+        first = min(len(samples), self.capacity - pos)
+        self.data[pos:pos + first] = samples[:first]
+        self.data[:len(samples) - first] = samples[first:]
+        self.total_written += len(samples)
+
+    def read(self, start_sample, end_sample):
+        """
+        Return a copy of the samples in [start_sample, end_sample).
+
+        Raises:
+            IndexError: if part of the range was already overwritten or not yet written
+        """
+        if start_sample < self.first_sample or end_sample > self.total_written or start_sample > end_sample:
+            raise IndexError(
+                f"Samples {start_sample}-{end_sample} not in buffer "
+                f"({self.first_sample}-{self.total_written})"
+            )
+
+        start = start_sample % self.capacity
+        length = end_sample - start_sample
+        if start + length <= self.capacity:
+            return self.data[start:start + length].copy()
+        return np.concatenate((self.data[start:], self.data[:start + length - self.capacity]))
+
+
+def probe_duration(media_path):
+    """
+    Return the container duration in seconds, or None if it is unknown.
+    """
+    with av.open(str(media_path)) as container:
+        if container.duration is None:
+            return None
+        return container.duration / av.time_base
+
+
+def decode_audio_blocks(media_path, sr, start_time=0.0, duration=None, block_duration=DECODE_BLOCK_DURATION):
+    """
+    Decode the first audio stream of a media file into mono float32 PCM blocks.
+
+    The container is opened once and decoded sequentially. When start_time is
+    given, the demuxer seeks to the nearest preceding keyframe and the samples
+    before start_time are dropped, so the first yielded sample lies at start_time.
+
+    Args:
+        media_path: Path to video/audio file
+        sr: Target sample rate
+        start_time: Offset in seconds to start decoding at
+        duration: Maximum number of seconds to decode (None = until end of file)
+        block_duration: Approximate length of each yielded block in seconds
+
+    Yields:
+        (samples, block_start_time) tuples, samples in [-1, 1]
+
+    Raises:
+        RuntimeError: if the file has no audio stream or cannot be decoded
+    """
+    block_size = max(1, int(block_duration * sr))
+    max_samples = None if duration is None else int(round(duration * sr))
+
+    try:
+        container = av.open(str(media_path))
+    except av.error.FFmpegError as e:
+        raise RuntimeError(f"Could not open {media_path}: {e}")
+
+    with container:
+        if not container.streams.audio:
+            raise RuntimeError(f"No audio stream in {media_path}")
+
+        stream = container.streams.audio[0]
+        stream.thread_type = "AUTO"
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=sr)
+
+        if start_time > 0:
+            container.seek(int(start_time * av.time_base), any_frame=False, backward=True)
+
+        pending = []
+        pending_len = 0
+        emitted = 0
+        skip_samples = None  # samples before start_time, known once the first frame arrives
+
+        def decoded_frames():
+            try:
+                for packet in container.demux(stream):
+                    yield from packet.decode()
+            except av.error.FFmpegError as e:
+                if emitted == 0 and pending_len == 0:
+                    raise RuntimeError(f"Failed to decode audio from {media_path}: {e}")
+                # Damaged tail - keep what was decoded so far
+                print(f"  Warning: decoding stopped early: {e}")
+            # None flushes the resampler
+            yield None
+
+        for frame in decoded_frames():
+            if frame is not None and skip_samples is None:
+                frame_time = float(frame.pts * frame.time_base) if frame.pts is not None else start_time
+                skip_samples = max(0, int(round((start_time - frame_time) * sr)))
+
+            for out_frame in resampler.resample(frame):
+                samples = out_frame.to_ndarray().reshape(-1)
+                if skip_samples:
+                    dropped = min(skip_samples, len(samples))
+                    samples = samples[dropped:]
+                    skip_samples -= dropped
+                if len(samples) == 0:
+                    continue
+
+                pending.append(samples)
+                pending_len += len(samples)
+
+                while pending_len >= block_size:
+                    block = np.concatenate(pending)
+                    out, rest = block[:block_size], block[block_size:]
+                    pending = [rest] if len(rest) else []
+                    pending_len = len(rest)
+
+                    if max_samples is not None and emitted + len(out) >= max_samples:
+                        yield out[:max_samples - emitted], start_time + emitted / sr
+                        return
+
+                    yield out, start_time + emitted / sr
+                    emitted += len(out)
+
+        if pending_len:
+            block = np.concatenate(pending)
+            if max_samples is not None:
+                block = block[:max_samples - emitted]
+            if len(block):
+                yield block, start_time + emitted / sr
+
+
+def decode_audio_range(media_path, start_time, duration, sr):
+    """
+    Decode a single range of audio into one array.
+
+    Returns:
+        float32 array of samples, or None if nothing could be decoded
+    """
+    start_time = max(0, start_time)
+    try:
+        blocks = [block for block, _ in decode_audio_blocks(media_path, sr, start_time, duration)]
+    except RuntimeError:
+        return None
+
+    if not blocks:
+        return None
+    return np.concatenate(blocks)
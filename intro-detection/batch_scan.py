@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Scan a whole directory for an intro with a pool of worker processes.
+
+Replaces running audio-scan.py once per file: the interpreter, librosa and
+the intro template are loaded once, episodes are scanned in parallel and the
+main process is the only one writing to the database; results finishing
+together are saved in one transaction, committed before waiting for more.
+
+Progress is appended to a JSON-lines file, so an interrupted run can be
+restarted and continues with the files that were not finished yet. A file
+is only written to the log once its row is committed. Files without a match
+are only skipped by a run with the same snippets, threshold and features.
+
+The time spent per stage (decode, features, correlation, ...) is summed over
+all files and reported at the end; --stats also writes one JSON record per
+file and --profile writes a profile of every scan.
+
+With --audio-cache the decoded audio is kept on local disk (see audio_cache),
+so scanning the directory again, e.g. with another snippet, a different
+threshold or --force, reads it from there instead of decoding it again.
+
+With --outro, every episode whose intro matched is also searched for the
+outro snippet in its last minutes, and the detected outro length is saved
+per episode instead of the fixed --outro-length. --outro-only searches only
+the outro, of the files already in the database that have no outro length
+yet (all of them with --force), and leaves their intros as they are.
+
+Usage:
+    python3 batch_scan.py <directory> <intro.wav> [<intro2.wav> ...] [--workers N] [--timeout SEC] [--force]
+                          [--outro credits.wav] [--audio-cache] [--tmdb-offline] [--stats stats.jsonl] [--profile DIR]
+    python3 batch_scan.py <directory> --outro credits.wav --outro-only [--force]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import audio_cache
+import instrumentation
+import storage
+import template_cache
+import tmdb_lookup
+from movie_hash import HASH_CACHE_FILE, HashCache, hash_files
+from search_priors import SeriesPriors
+
+VIDEO_EXTENSIONS = {".mkv", ".mp4", ".avi", ".m4v", ".mov", ".wmv", ".mpg", ".mpeg", ".ts", ".webm"}
+DEFAULT_TIMEOUT = 900  # seconds per file
+PROGRESS_FILE = "batch_scan_progress.jsonl"
+
+
+def load_scanner():
+    """Import audio-scan.py, whose file name is not a valid module name."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio-scan.py")
+    spec = importlib.util.spec_from_file_location("audio_scan", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+scanner = load_scanner()
+
+# Per-worker state, set by init_worker
+_templates = None
+_outro_templates = None
+_options = None
+
+
+def find_videos(directory):
+    """Return all video files below directory, sorted by path."""
+    videos = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS:
+                videos.append(os.path.join(root, name))
+    return sorted(videos)
+
+
+def scan_settings(args):
+    """
+    Settings a scan outcome depends on, stored with every progress record.
+
+    Snippets are identified by their contents, so a corrected snippet under
+    the same name counts as a different setting.
+    """
+    return {
+        "intros": sorted(template_cache.template_key(path, {}) for path in args.audio_snippet),
+        "correlation_threshold": args.correlation_threshold,
+        "features": args.features,
+    }
+
+
+def load_progress(progress_path, settings):
+    """
+    Load finished files from the progress log.
+
+    A match is final, a miss only for a run with the same settings: another
+    snippet, a lower threshold or other features may find the intro.
+
+    Returns:
+        dict of path -> (file size, mtime) of files that were completed
+    """
+    done = {}
+    if not os.path.exists(progress_path):
+        return done
+
+    with open(progress_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Partially written last line of an interrupted run
+                continue
+            status = record.get("status")
+            if status == "match" or (status == "no_match" and record.get("settings") == settings):
+                done[record["path"]] = (record["file_size"], record["mtime"])
+    return done
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("scan timed out")
+
+
+def init_worker(templates, outro_templates, options):
+    global _templates, _outro_templates, _options
+    _templates = templates
+    _outro_templates = outro_templates
+    _options = options
+    if options["audio_cache_size"]:
+        scanner.enable_audio_cache(options["audio_cache_size"])
+
+
+def _new_result(path, movie_hash, file_size, window=None):
+    return {
+        "path": path,
+        "movie_hash": movie_hash,
+        "file_size": file_size,
+        "mtime": os.path.getmtime(path),
+        "start_time": None,
+        "score": None,
+        "intro": None,
+        "window": window,
+        "media_duration": 0.0,
+        "outro_length": None,
+    }
+
+
+def _run_scan(result, search):
+    """
+    Run search(result) in a worker process, under the timeout and with the
+    scanner output hidden, filling in the status, timings and stats.
+    """
+    path = result["path"]
+    profile_path = None
+    if _options["profile"]:
+        profile_path = os.path.join(_options["profile"], os.path.basename(path) + ".prof")
+
+    started = time.time()
+    instrumentation.start(path)
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.alarm(_options["timeout"])
+    try:
+        with instrumentation.stage("probe"):
+            result["media_duration"] = scanner.probe_duration(path) or 0.0
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(sys.stdout if _options["verbose"] else devnull), \
+                instrumentation.profiled(profile_path):
+            result["status"] = "match" if search(result) else "no_match"
+    except TimeoutError:
+        result["status"] = "timeout"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    finally:
+        signal.alarm(0)
+
+    result["elapsed"] = time.time() - started
+    result["stats"] = instrumentation.finish()
+    return result
+
+
+def _find_outro(result):
+    """
+    Search the outro snippets at the end of the file of result.
+
+    Returns:
+        (outro_length, best score) tuple; outro_length is None if not found
+    """
+    outro_length, score, _ = scanner.find_outro_in_video(
+        result["path"], _options["outros"],
+        correlation_threshold=_options["correlation_threshold"],
+        templates=_outro_templates,
+        search_duration=_options["outro_search"],
+        media_duration=result["media_duration"] or None,
+        features=_options["features"]
+    )
+    return outro_length, None if score is None else float(score)
+
+
+def scan_file(path, movie_hash, file_size, window=None):
+    """
+    Scan one file in a worker process, searching window first if given.
+
+    Returns:
+        dict with the outcome, timings and the match (if any)
+    """
+    def search(result):
+        start_time, score, intro_path = scanner.find_intro_in_video(
+            path, _options["intros"], movie_hash, file_size,
+            correlation_threshold=_options["correlation_threshold"],
+            templates=_templates,
+            save=False,
+            search_window=window,
+            features=_options["features"]
+        )
+        matched = start_time is not None and score >= _options["correlation_threshold"]
+        if matched and _options["outros"]:
+            result["outro_length"], _ = _find_outro(result)
+        result["start_time"] = start_time
+        result["intro"] = intro_path
+        # No refined candidate: there is no score to report
+        result["score"] = None if start_time is None else float(score)
+        return matched
+
+    return _run_scan(_new_result(path, movie_hash, file_size, window), search)
+
+
+def scan_outro(path, movie_hash, file_size):
+    """
+    Search only the outro of a file already in the database (--outro-only).
+
+    Returns:
+        dict like scan_file(); status "match" if the outro was found
+    """
+    def search(result):
+        result["outro_length"], result["score"] = _find_outro(result)
+        return result["outro_length"] is not None
+
+    return _run_scan(_new_result(path, movie_hash, file_size), search)
+
+
+def handle_result(result, number, total, args, durations, priors, counts):
+    """Save, count and report the result of one worker (runs in the main process only)."""
+    # Database and TMDB time of the save below is added to the worker's record
+    instrumentation.resume(result["stats"])
+    counts[result["status"]] += 1
+    name = os.path.basename(result["path"])
+    matched = result["status"] == "match"
+
+    prior_note = ""
+    if result["window"] is not None and result["status"] in ("match", "no_match"):
+        hit = priors.record(result["window"], result["start_time"], matched)
+        prior_note = ", prior hit" if hit else ", prior missed"
+
+    if matched and args.outro_only:
+        with instrumentation.stage("database"):
+            scanner.get_database().set_outro_length(name, result["movie_hash"], result["outro_length"])
+        print(f"[{number}/{total}] ✓ {name}: outro last {scanner.format_timestamp(result['outro_length'])} "
+              f"(correlation: {result['score']:.4f}, {result['elapsed']:.1f}s)")
+    elif matched:
+        end_time = result["start_time"] + durations[result["intro"]]
+        outro_length = args.outro_length
+        outro_note = ""
+        if result["outro_length"] is not None:
+            outro_length = result["outro_length"]
+            outro_note = f", outro: last {scanner.format_timestamp(outro_length)}"
+        elif args.outro:
+            outro_note = ", outro not found"
+        scanner.save_intro_timestamps(result["path"], result["start_time"], end_time, result["score"],
+                                      result["movie_hash"], result["file_size"], outro_length)
+        priors.add(os.path.basename(result["path"]), result["start_time"])
+        intro_note = f", {os.path.basename(result['intro'])}" if len(durations) > 1 else ""
+        print(f"[{number}/{total}] ✓ {name}: {scanner.format_timestamp(result['start_time'])} "
+              f"(correlation: {result['score']:.4f}{intro_note}{prior_note}{outro_note}, {result['elapsed']:.1f}s)")
+    elif result["status"] == "no_match":
+        best = "" if result["score"] is None else f"best correlation: {result['score']:.4f}, "
+        missed = "outro not found" if args.outro_only else "no match"
+        print(f"[{number}/{total}] ✗ {name}: {missed} ({best}{result['elapsed']:.1f}s{prior_note})")
+    elif result["status"] == "timeout":
+        print(f"[{number}/{total}] ✗ {name}: timed out after {args.timeout}s")
+    else:
+        print(f"[{number}/{total}] ✗ {name}: error: {result['error']}")
+
+    result["stats"] = instrumentation.finish()
+    if args.verbose:
+        print(f"    Timing: {instrumentation.format_record(result['stats'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan all videos in a directory for an intro snippet")
+    parser.add_argument("directory", help="Directory to scan (recursively)")
+    parser.add_argument("audio_snippet", nargs="*",
+                        help="Path to audio snippet (intro); several snippets are matched in one pass")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT,
+                        help=f"Give up on a file after this many seconds (default: {DEFAULT_TIMEOUT})")
+    parser.add_argument("--correlation-threshold", type=float, default=scanner.CORRELATION_THRESHOLD,
+                        help=f"Correlation threshold 0-1 (default: {scanner.CORRELATION_THRESHOLD})")
+    parser.add_argument("--outro-length", type=float, default=0,
+                        help="Length of outro in seconds (default: 0, disabled); with --outro, used if the outro is not found")
+    parser.add_argument("--outro", nargs="+",
+                        help="Outro (credits) snippet searched at the end of every matched episode for its outro length")
+    parser.add_argument("--outro-only", action="store_true",
+                        help="Only search the --outro snippet in files already in the database and store their "
+                             "outro length, keeping their intros")
+    parser.add_argument("--outro-search", type=float, default=scanner.OUTRO_SEARCH_DURATION,
+                        help=f"Seconds at the end of a video searched for the outro (default: {scanner.OUTRO_SEARCH_DURATION})")
+    parser.add_argument("--features", choices=sorted(scanner.FEATURE_PROFILES), default=scanner.DEFAULT_FEATURES,
+                        help=f"Feature backend ({scanner.describe_feature_profiles()}) "
+                             f"(default: {scanner.DEFAULT_FEATURES})")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-process files even if already known; a match overwrites the stored intro")
+    parser.add_argument("--audio-cache", action="store_true",
+                        help="Keep the decoded audio on local disk, so scanning the files again does not decode them again")
+    parser.add_argument("--audio-cache-size", type=float, default=audio_cache.AUDIO_CACHE_MAX_SIZE / 1024 ** 3,
+                        help=f"Size limit of the audio cache in GiB "
+                             f"(default: {audio_cache.AUDIO_CACHE_MAX_SIZE // 1024 ** 3})")
+    parser.add_argument("--progress", default=PROGRESS_FILE,
+                        help=f"Progress log used to resume interrupted runs (default: {PROGRESS_FILE})")
+    parser.add_argument("--no-prior", action="store_true",
+                        help="Always scan from the start instead of searching the usual intro offset of the series first")
+    parser.add_argument("--tmdb-offline", action="store_true",
+                        help="Only use cached TMDB ids; unknown titles are left for tmdb_lookup.py --update-db")
+    parser.add_argument("--stats", help="Append a JSON record with the time spent per stage of every file to this file")
+    parser.add_argument("--profile", help="Write a profile of every scan (cProfile) into this directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the scanner output of every file")
+    args = parser.parse_args()
+    if args.outro_only and not args.outro:
+        parser.error("--outro-only needs the outro snippet (--outro)")
+    if not args.outro_only and not args.audio_snippet:
+        parser.error("the intro snippet (audio_snippet) is required")
+
+    if args.tmdb_offline:
+        tmdb_lookup.configure(offline=True)
+
+    videos = find_videos(args.directory)
+    print(f"Found {len(videos)} video files in {args.directory}")
+
+    settings = scan_settings(args)
+    # --outro-only results are not logged, files with an outro length are skipped instead
+    done = {} if args.force or args.outro_only else load_progress(args.progress, settings)
+
+    # Skip known files before any decoding happens: by name without touching
+    # the file, by progress log with a stat, by hash (mostly cached) last.
+    # --outro-only turns it around and only scans known files, by default
+    # those without an outro length
+    database = scanner.get_database()
+    database.batch_size = storage.COMMIT_BATCH_SIZE
+    known_names, known_hashes = scanner.load_known()
+    outro_names, outro_hashes = set(), set()
+    if args.outro_only and not args.force:
+        with instrumentation.stage("database"):
+            outro_names, outro_hashes = database.load_outros()
+    candidates = []
+    skipped = 0
+    for path in videos:
+        skip_names = outro_names if args.outro_only else known_names
+        if not args.force and os.path.basename(path) in skip_names:
+            skipped += 1
+            continue
+
+        stat = os.stat(path)
+        if done.get(path) == (stat.st_size, stat.st_mtime):
+            skipped += 1
+            continue
+        candidates.append(path)
+
+    hash_cache = HashCache(os.path.join(os.path.dirname(os.path.abspath(scanner.db_path)), HASH_CACHE_FILE))
+    hashes = hash_files(candidates, hash_cache)
+    hash_cache.close()
+
+    # With --force known files are scanned again; a match overwrites their
+    # row, anything else leaves it as it is
+    pending = []
+    for path in candidates:
+        if path not in hashes:
+            # Unreadable, already reported by hash_files
+            continue
+        movie_hash, file_size = hashes[path]
+        known = os.path.basename(path) in known_names or movie_hash in known_hashes
+        if args.outro_only:
+            if not known or movie_hash in outro_hashes:
+                skipped += 1
+                continue
+        elif known and not args.force:
+            skipped += 1
+            continue
+        pending.append((path, movie_hash, file_size))
+
+    if args.outro_only:
+        print(f"Skipping {skipped} files not in the database or with an outro length, scanning {len(pending)}")
+    else:
+        print(f"Skipping {skipped} known files, scanning {len(pending)}")
+    if not pending:
+        return
+
+    templates = [scanner.load_intro_template(path, args.features) for path in args.audio_snippet]
+    durations = dict(zip(args.audio_snippet, (template[2] for template in templates)))
+    outro_templates = [scanner.load_intro_template(path, args.features) for path in args.outro or []]
+    options = {
+        "intros": args.audio_snippet,
+        "outros": args.outro,
+        "outro_search": args.outro_search,
+        "timeout": args.timeout,
+        "correlation_threshold": args.correlation_threshold,
+        "features": args.features,
+        "verbose": args.verbose,
+        "profile": args.profile,
+        "audio_cache_size": int(args.audio_cache_size * 1024 ** 3) if args.audio_cache else None,
+    }
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+
+    priors = SeriesPriors.from_database(database)
+
+    counts = {"match": 0, "no_match": 0, "timeout": 0, "error": 0}
+    timings = instrumentation.Aggregate()
+    media_seconds = 0.0
+    wall_started = time.time()
+
+    with open(args.progress, "a") as progress, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                initargs=(templates, outro_templates, options)) as pool:
+        # Submit lazily so files scanned later profit from the priors of earlier matches
+        queue = list(reversed(pending))
+        running = set()
+        number = 0
+
+        # Results whose rows are not committed yet; logged as done once they are
+        uncommitted = []
+
+        def write_progress():
+            database.commit()
+            for record in uncommitted:
+                progress.write(json.dumps(record) + "\n")
+            progress.flush()
+            uncommitted.clear()
+
+        try:
+            while queue or running:
+                while queue and len(running) < 2 * args.workers:
+                    path, movie_hash, file_size = queue.pop()
+                    if args.outro_only:
+                        running.add(pool.submit(scan_outro, path, movie_hash, file_size))
+                        continue
+                    window = None if args.no_prior else priors.window(path)
+                    running.add(pool.submit(scan_file, path, movie_hash, file_size, window))
+
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    number += 1
+                    result = future.result()
+                    handle_result(result, number, len(pending), args, durations, priors, counts)
+                    media_seconds += result["media_duration"]
+
+                    stats = result.pop("stats")
+                    stats["status"] = result["status"]
+                    timings.add(stats)
+                    if args.stats:
+                        instrumentation.write_record(args.stats, stats)
+
+                    if not args.outro_only:
+                        result["settings"] = settings
+                        uncommitted.append(result)
+
+                # Never hold the write lock while waiting for the next scan
+                write_progress()
+        finally:
+            write_progress()
+
+    wall_seconds = time.time() - wall_started
+    print(f"\n{'='*60}")
+    print(f"Scanned {len(pending)} files in {wall_seconds:.1f}s with {args.workers} workers")
+    found = "Outros found" if args.outro_only else "Matches"
+    print(f"  {found}: {counts['match']}, no match: {counts['no_match']}, "
+          f"timeouts: {counts['timeout']}, errors: {counts['error']}")
+    print(f"  Media scanned: {media_seconds / 3600:.2f}h")
+    if wall_seconds > 0:
+        print(f"  Throughput: {media_seconds / wall_seconds:.1f} media-hours per wall-clock hour")
+    print(f"  {priors.summary()}")
+    for line in timings.report():
+        print(f"  {line}")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
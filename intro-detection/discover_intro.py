@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Find the intro of a season without an intro snippet.
+
+Only the first minutes of every episode are decoded, into STFT chroma. Each
+frame gets a fingerprint: the dominant pitch classes of a few frames spread
+over FINGERPRINT_SPAN, packed into one integer. Counting in how many episodes
+each fingerprint occurs takes one sort of all fingerprints, so the cost grows
+linearly with the number of episodes instead of with the number of pairs.
+
+Frames whose fingerprint occurs in most episodes are recurring audio; the
+longest stretch of them in an episode is its intro candidate. The candidate
+of median length becomes the template, every episode is aligned to it by
+normalized cross-correlation, and the matches are saved to the database like
+scanned ones. With --export-template the template is also written as a WAV
+file, to be used as intro snippet for batch_scan.py on later episodes.
+
+Usage:
+    python3 discover_intro.py <directory> [--minutes 10] [--min-episodes 0.5] [--workers N]
+                              [--export-template intro.wav] [--dry-run] [--force] [--tmdb-offline]
+"""
+
+import argparse
+import os
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import storage
+import tmdb_lookup
+from audio_decoder import decode_audio_blocks, decode_audio_range
+from batch_scan import find_videos, scanner
+from features import FEATURE_BACKENDS
+from matcher import EPSILON, interpolate_peak, normalized_cross_correlation
+from movie_hash import HASH_CACHE_FILE, HashCache, hash_files
+
+DISCOVERY_MINUTES = 10  # minutes decoded from the start of every episode
+DISCOVERY_BACKEND = FEATURE_BACKENDS["stft"]
+DISCOVERY_HOP_LENGTH = 2048  # samples between frames (~93 ms)
+FINGERPRINT_OFFSETS = (0, 8, 16, 24, 32)  # frames whose dominant pitch class forms a fingerprint
+FINGERPRINT_SPAN = FINGERPRINT_OFFSETS[-1]
+TONAL_MEDIAN = 0.5  # frames whose median chroma bin reaches this are too flat for a fingerprint
+MIN_EPISODE_FRACTION = 0.5  # a fingerprint recurs if it occurs in this fraction of the episodes
+RECURRENCE_WINDOW = 3.0  # seconds over which the fraction of recurring frames is averaged
+RECURRENCE_MIN_DENSITY = 0.3  # average fraction of recurring frames within an intro
+MIN_INTRO_DURATION = 10  # seconds; shorter recurring stretches are jingles or logos
+BOUNDARY_MARGIN = 5.0  # seconds around the recurring stretch searched for the exact intro boundaries
+FRAME_AGREEMENT = 0.8  # median chroma similarity of aligned frames within the intro
+
+
+def frames_per_second():
+    return DISCOVERY_BACKEND.sample_rate / DISCOVERY_HOP_LENGTH
+
+
+def decode_features(video_path, duration):
+    """
+    Decode the first duration seconds of a video into discovery features.
+
+    Returns:
+        (video_path, features) tuple, features of shape (12, n) or None if the
+        audio could not be decoded
+    """
+    stream = DISCOVERY_BACKEND.stream(DISCOVERY_HOP_LENGTH)
+    frames = []
+    try:
+        for block, _ in decode_audio_blocks(video_path, DISCOVERY_BACKEND.sample_rate, 0.0, duration):
+            frames.append(stream.push(block))
+    except RuntimeError as e:
+        print(f"  Warning: {e}")
+        return video_path, None
+    frames.append(stream.flush())
+    return video_path, np.concatenate(frames, axis=1).astype(np.float32)
+
+
+def fingerprints(features):
+    """
+    Fingerprint every frame that has FINGERPRINT_SPAN frames after it.
+
+    Returns:
+        int64 array, one fingerprint per frame; -1 where one of the frames
+        involved has no clear dominant pitch class (silence, noise)
+    """
+    n = features.shape[1] - FINGERPRINT_SPAN
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    dominant = features.argmax(axis=0).astype(np.int64)
+    tonal = (features.max(axis=0) > 0) & (np.median(features, axis=0) < TONAL_MEDIAN)
+
+    keys = np.zeros(n, dtype=np.int64)
+    valid = np.ones(n, dtype=bool)
+    for i, offset in enumerate(FINGERPRINT_OFFSETS):
+        keys |= dominant[offset:offset + n] << (4 * i)
+        valid &= tonal[offset:offset + n]
+    keys[~valid] = -1
+    return keys
+
+
+def recurring_frames(episode_keys, min_episodes):
+    """
+    Mark the frames whose fingerprint occurs in at least min_episodes episodes.
+
+    Args:
+        episode_keys: List of fingerprint arrays, one per episode
+
+    Returns:
+        List of boolean arrays, one per episode
+    """
+    # Each episode counts once per fingerprint, however often it repeats there
+    distinct = [np.unique(keys[keys >= 0]) for keys in episode_keys]
+    known, counts = np.unique(np.concatenate(distinct), return_counts=True)
+    recurring = known[counts >= min_episodes]
+
+    return [(keys >= 0) & np.isin(keys, recurring) for keys in episode_keys]
+
+
+def recurring_segment(mask):
+    """
+    Find the longest stretch of recurring audio in one episode.
+
+    Returns:
+        (start_frame, end_frame, density) of the stretch, or None if there is
+        none of at least MIN_INTRO_DURATION
+    """
+    fps = frames_per_second()
+    window = max(1, int(RECURRENCE_WINDOW * fps))
+    density = np.convolve(mask.astype(float), np.ones(window) / window, mode="same")
+    dense = np.concatenate(([False], density >= RECURRENCE_MIN_DENSITY, [False]))
+    edges = np.flatnonzero(np.diff(dense.astype(np.int8)))
+
+    best = None
+    for start, end in zip(edges[::2], edges[1::2]):
+        hits = np.flatnonzero(mask[start:end])
+        if not len(hits):
+            continue
+        # The fingerprint of a frame covers the FINGERPRINT_SPAN frames after it
+        first, last = start + hits[0], start + hits[-1] + FINGERPRINT_SPAN + 1
+        if best is None or last - first > best[1] - best[0]:
+            best = (first, last, float(mask[first:last].mean()))
+
+    if best is None or (best[1] - best[0]) / fps < MIN_INTRO_DURATION:
+        return None
+    return best
+
+
+def discover_intro(features, min_fraction=MIN_EPISODE_FRACTION, correlation_threshold=scanner.CORRELATION_THRESHOLD):
+    """
+    Find the intro shared by the episodes and locate it in each of them.
+
+    Args:
+        features: dict of video path -> discovery features
+        min_fraction: Fraction of the episodes a fingerprint must occur in
+
+    Returns:
+        dict with "reference" (path the template was cut from), "start" and
+        "end" (template position in the reference, in seconds) and "matches"
+        (path -> (start time, correlation score) of every episode at or above
+        the threshold), or None if no recurring audio was found
+    """
+    paths = list(features)
+    min_episodes = max(2, int(np.ceil(min_fraction * len(paths))))
+    masks = recurring_frames([fingerprints(features[path]) for path in paths], min_episodes)
+
+    segments = {}
+    for path, mask in zip(paths, masks):
+        segment = recurring_segment(mask)
+        if segment is not None:
+            segments[path] = segment
+    print(f"Recurring audio found in {len(segments)} of {len(paths)} episodes")
+    if not segments:
+        return None
+
+    # An episode whose stretch ran into a similar scene is an outlier in length
+    ranked = sorted(segments, key=lambda path: (segments[path][1] - segments[path][0], segments[path][2]))
+    reference = ranked[len(ranked) // 2]
+    first, last, _ = segments[reference]
+    template = features[reference][:, first:last]
+
+    offsets = {}
+    scores = {}
+    for path in paths:
+        curve = normalized_cross_correlation(template, features[path])
+        if not len(curve):
+            continue
+        best = int(np.argmax(curve))
+        if curve[best] >= correlation_threshold:
+            offsets[path] = interpolate_peak(curve, best) - first
+            scores[path] = float(curve[best])
+
+    first, last = refine_boundaries(features, reference, first, last, offsets)
+
+    fps = frames_per_second()
+    matches = {path: ((first + offset) / fps, scores[path]) for path, offset in offsets.items()}
+    return {"reference": reference, "start": first / fps, "end": last / fps, "matches": matches}
+
+
+def refine_boundaries(features, reference, first, last, offsets):
+    """
+    Move the template boundaries to where the aligned episodes stop agreeing.
+
+    The recurring stretch is only accurate to a fingerprint; here every frame
+    around the boundaries of the reference is compared with the frame at the
+    same position in the other matched episodes.
+
+    Args:
+        offsets: dict of path -> frame offset of the episode relative to the reference
+
+    Returns:
+        (first, last) frames of the intro in the reference
+    """
+    others = [path for path in offsets if path != reference]
+    if not others:
+        return first, last
+
+    margin = int(BOUNDARY_MARGIN * frames_per_second())
+    reference_features = features[reference]
+    lo = max(0, first - margin)
+    hi = min(reference_features.shape[1], last + margin)
+
+    similarities = []
+    for path in others:
+        positions = np.arange(lo, hi) + int(round(offsets[path]))
+        valid = (positions >= 0) & (positions < features[path].shape[1])
+        ours = reference_features[:, lo:hi][:, valid]
+        theirs = features[path][:, positions[valid]]
+        similarity = np.zeros(hi - lo)
+        norms = np.linalg.norm(ours, axis=0) * np.linalg.norm(theirs, axis=0)
+        similarity[valid] = (ours * theirs).sum(axis=0) / np.maximum(norms, EPSILON)
+        similarities.append(similarity)
+    agreeing = np.median(similarities, axis=0) >= FRAME_AGREEMENT
+    # A single disagreeing frame (a noisy one) does not end the intro
+    agreeing[1:-1] |= agreeing[:-2] & agreeing[2:]
+
+    # Grow from the middle of the template while the episodes agree
+    start = end = (first + last) // 2 - lo
+    if not agreeing[start]:
+        return first, last
+    while start > 0 and agreeing[start - 1]:
+        start -= 1
+    while end < len(agreeing) and agreeing[end]:
+        end += 1
+    return lo + start, lo + end
+
+
+def export_template(video_path, start_time, end_time, output_path, sr=scanner.SAMPLE_RATE):
+    """Write the audio between start_time and end_time of a video as 16-bit mono WAV file."""
+    audio = decode_audio_range(video_path, start_time, end_time - start_time, sr)
+    if audio is None:
+        raise RuntimeError(f"Could not decode the template from {video_path}")
+
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(output_path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(pcm.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the intro shared by the episodes in a directory, without a snippet")
+    parser.add_argument("directory", help="Directory with the episodes of a season (searched recursively)")
+    parser.add_argument("--minutes", type=float, default=DISCOVERY_MINUTES,
+                        help=f"Minutes decoded from the start of every episode (default: {DISCOVERY_MINUTES})")
+    parser.add_argument("--min-episodes", type=float, default=MIN_EPISODE_FRACTION,
+                        help=f"Fraction of the episodes the intro must occur in (default: {MIN_EPISODE_FRACTION})")
+    parser.add_argument("--correlation-threshold", type=float, default=scanner.CORRELATION_THRESHOLD,
+                        help=f"Correlation with the template an episode needs to be saved "
+                             f"(default: {scanner.CORRELATION_THRESHOLD})")
+    parser.add_argument("--outro-length", type=float, default=0,
+                        help="Length of outro in seconds (default: 0, disabled)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of decoding processes (default: number of CPUs)")
+    parser.add_argument("--export-template", metavar="WAV",
+                        help="Write the discovered intro to this WAV file, for use as intro snippet")
+    parser.add_argument("--tmdb-offline", action="store_true",
+                        help="Only use cached TMDB ids; unknown titles are left for tmdb_lookup.py --update-db")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the intros, do not save them")
+    parser.add_argument("--force", action="store_true", help="Overwrite episodes that are already in the database")
+    args = parser.parse_args()
+
+    if args.tmdb_offline:
+        tmdb_lookup.configure(offline=True)
+
+    videos = find_videos(args.directory)
+    print(f"Found {len(videos)} video files in {args.directory}")
+    if len(videos) < 2:
+        print("✗ Discovery needs at least two episodes")
+        return
+
+    started = time.time()
+    features = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for path, episode_features in pool.map(decode_features, videos, [args.minutes * 60] * len(videos)):
+            if episode_features is not None:
+                features[path] = episode_features
+    print(f"Decoded the first {args.minutes:g} minutes of {len(features)} episodes in {time.time() - started:.1f}s")
+
+    result = discover_intro(features, args.min_episodes, args.correlation_threshold)
+    if result is None:
+        print("✗ No recurring intro found")
+        return
+
+    intro_duration = result["end"] - result["start"]
+    print(f"Intro template: {scanner.format_timestamp(result['start'])} - {scanner.format_timestamp(result['end'])} "
+          f"of {os.path.basename(result['reference'])} ({intro_duration:.1f}s)")
+    for path in videos:
+        if path in result["matches"]:
+            start_time, score = result["matches"][path]
+            print(f"  ✓ {os.path.basename(path)}: {scanner.format_timestamp(start_time)} (correlation: {score:.4f})")
+        else:
+            print(f"  ✗ {os.path.basename(path)}: no match")
+
+    if args.export_template:
+        export_template(result["reference"], result["start"], result["end"], args.export_template)
+        print(f"✓ Intro template written to {args.export_template}")
+
+    if args.dry_run:
+        return
+
+    database = scanner.get_database()
+    database.batch_size = storage.COMMIT_BATCH_SIZE
+    known_names, known_hashes = scanner.load_known()
+
+    hash_cache = HashCache(os.path.join(os.path.dirname(os.path.abspath(scanner.db_path)), HASH_CACHE_FILE))
+    hashes = hash_files(list(result["matches"]), hash_cache)
+    hash_cache.close()
+
+    saved = skipped = 0
+    for path, (start_time, score) in result["matches"].items():
+        if path not in hashes:
+            continue
+        movie_hash, file_size = hashes[path]
+        if not args.force and (os.path.basename(path) in known_names or movie_hash in known_hashes):
+            skipped += 1
+            continue
+        scanner.save_intro_timestamps(path, start_time, start_time + intro_duration, score, movie_hash, file_size,
+                                      args.outro_length)
+        saved += 1
+    database.commit()
+
+    print(f"\n✓ Saved {saved} intros, skipped {skipped} known files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Feature extraction for the intro scanner.
+
+Several feature backends are available, trading accuracy for speed; see
+FEATURE_BACKENDS. Relative cost of the whole-file screening pass, measured on
+5 minutes of audio at a 4096 sample hop (CQT = 1.0):
+
+    cqt      1.0   chroma from a constant-Q transform at 22050 Hz (reference)
+    lowrate  0.5   the same chroma from audio decoded at 11025 Hz
+    onset    0.25  band-wise onset strength (spectral flux) envelopes at 11025 Hz
+    stft     0.13  chroma from a short-time Fourier transform
+
+Besides the one-shot feature functions used for the intro snippet, this module
+provides FeatureStream, which turns a stream of PCM blocks into feature frames
+exactly once. Each block is analysed together with enough audio context on
+both sides that the filters see the same signal they would see in a single
+pass over the whole file, so frames are identical to a one-shot computation
+and no frame is ever computed twice.
+"""
+
+import numpy as np
+import librosa
+
+FEATURE_CONTEXT = 2.0  # seconds of audio on each side of a block (longest CQT filter is ~1.6 s)
+FEATURE_BLOCK_DURATION = 20.0  # seconds of audio converted to features per step
+
+STFT_N_FFT = 2048  # FFT size of the stft backend
+ONSET_N_FFT = 1024  # FFT size of the onset backend (same window length at its lower rate)
+ONSET_MELS = 64  # mel bands the onset envelopes are computed from
+ONSET_BANDS = 8  # onset envelopes (feature rows), each aggregating ONSET_MELS / ONSET_BANDS mel bands
+ONSET_POOL = 4  # onset envelopes are computed at hop / ONSET_POOL and max-pooled per hop
+ONSET_AMIN = 1e-3  # mel power floor, keeps codec noise in quiet passages out of the flux
+
+
+def chroma_features(audio_data, sr, hop_length):
+    """
+    Compute per-frame normalized chromagram (12 pitch classes).
+
+    Tuning is fixed at 0 instead of being estimated per call, so features of
+    the intro snippet and of arbitrary blocks of a video are directly comparable.
+    """
+    chroma = librosa.feature.chroma_cqt(
+        y=audio_data,
+        sr=sr,
+        hop_length=hop_length,
+        tuning=0.0
+    )
+
+    # Normalize each frame
+    return librosa.util.normalize(chroma, axis=0)
+
+
+def chroma_stft_features(audio_data, sr, hop_length):
+    """
+    Compute per-frame normalized chromagram from a short-time Fourier transform.
+
+    Much cheaper than the constant-Q chroma, but with a coarser pitch
+    resolution in the low octaves.
+    """
+    chroma = librosa.feature.chroma_stft(
+        y=audio_data,
+        sr=sr,
+        hop_length=hop_length,
+        n_fft=STFT_N_FFT,
+        tuning=0.0
+    )
+    return librosa.util.normalize(chroma, axis=0)
+
+
+def onset_features(audio_data, sr, hop_length):
+    """
+    Compute band-wise onset strength envelopes (ONSET_BANDS x n).
+
+    Follows rhythm and loudness changes instead of pitch, so it also works on
+    intros without a clear melody, but it is less selective than chroma.
+    Each frame is the maximum over ONSET_POOL finer frames, so an onset is
+    not lost when it falls between two frames of a coarse hop.
+    """
+    fine_hop = hop_length // ONSET_POOL
+    mel = librosa.feature.melspectrogram(
+        y=audio_data,
+        sr=sr,
+        n_fft=ONSET_N_FFT,
+        hop_length=fine_hop,
+        n_mels=ONSET_MELS
+    )
+    # Fixed floor instead of top_db clipping: top_db depends on the loudest
+    # frame and would make frames depend on the block they were computed in
+    log_mel = librosa.power_to_db(mel, amin=ONSET_AMIN, top_db=None)
+    onsets = librosa.onset.onset_strength_multi(
+        S=log_mel,
+        sr=sr,
+        n_fft=ONSET_N_FFT,
+        hop_length=fine_hop,
+        channels=np.linspace(0, ONSET_MELS, ONSET_BANDS + 1).astype(int)
+    )
+
+    # Same frame count as the other backends (1 + len // hop); onsets are >= 0
+    n_frames = 1 + len(audio_data) // hop_length
+    pooled = np.zeros((onsets.shape[0], n_frames * ONSET_POOL), dtype=onsets.dtype)
+    n = min(onsets.shape[1], pooled.shape[1])
+    pooled[:, :n] = onsets[:, :n]
+    return pooled.reshape(onsets.shape[0], n_frames, ONSET_POOL).max(axis=2)
+
+
+class FeatureBackend:
+    """
+    A feature extractor the scanner can run on.
+
+    Args:
+        name: Name used on the command line and in the template cache key
+        sample_rate: Rate the audio is decoded at for this backend
+        n_features: Number of feature rows per frame
+        context: Seconds of audio a frame depends on beyond its own hop
+        compute: Function (audio_data, sr, hop_length) -> features (n_features x n)
+        cost: Relative cost of the screening pass (cqt = 1.0)
+        description: One-line description for the command line help
+    """
+
+    def __init__(self, name, sample_rate, n_features, context, compute, cost, description):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.n_features = n_features
+        self.context = context
+        self.compute = compute
+        self.cost = cost
+        self.description = description
+
+    def extract(self, audio_data, hop_length):
+        """One-shot features of audio_data sampled at self.sample_rate."""
+        return self.compute(audio_data, self.sample_rate, hop_length)
+
+    def stream(self, hop_length):
+        """New FeatureStream computing this backend's features."""
+        return FeatureStream(self.sample_rate, hop_length, compute=self.compute,
+                             n_features=self.n_features, context=self.context)
+
+
+FEATURE_BACKENDS = {
+    "cqt": FeatureBackend("cqt", 22050, 12, FEATURE_CONTEXT, chroma_features, 1.0,
+                          "constant-Q chroma (reference quality, slowest)"),
+    "lowrate": FeatureBackend("lowrate", 11025, 12, FEATURE_CONTEXT, chroma_features, 0.5,
+                              "constant-Q chroma of audio decoded at 11025 Hz"),
+    "stft": FeatureBackend("stft", 22050, 12, 0.1, chroma_stft_features, 0.13,
+                           "STFT chroma (fastest, coarser pitch resolution)"),
+    # Onset frames also depend on the previous spectrogram frames
+    "onset": FeatureBackend("onset", 11025, ONSET_BANDS, 0.5, onset_features, 0.25,
+                            "band-wise onset envelopes (for intros without a clear melody, least selective)"),
+}
+
+
+class FeatureStream:
+    """
+    Incremental feature extraction of an audio stream.
+
+    Push PCM blocks in order with push(); every call returns the feature frames
+    that became computable, call flush() after the last block for the rest.
+    Frame i is centred on sample i * hop_length of the stream, as with
+    librosa's default centred framing.
+    """
+
+    def __init__(self, sr, hop_length, block_duration=FEATURE_BLOCK_DURATION, context=FEATURE_CONTEXT,
+                 compute=chroma_features, n_features=12):
+        self.sr = sr
+        self.hop_length = hop_length
+        self.compute = compute
+        self.n_features = n_features
+        # Context is kept a whole number of hops so block boundaries stay frame-aligned
+        self.context = hop_length * int(np.ceil(context * sr / hop_length))
+        self.block_frames = max(1, int(block_duration * sr / hop_length))
+
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.audio_start = 0  # absolute sample index of self.audio[0]
+        self.total_samples = 0
+        self.next_frame = 0  # first frame not handed out yet
+
+    def push(self, samples):
+        """Append PCM samples and return the newly available feature frames (n_features x n)."""
+        self.audio = np.concatenate((self.audio, np.asarray(samples, dtype=np.float32)))
+        self.total_samples += len(samples)
+
+        # Frame f needs audio up to f * hop + context
+        end_frame = (self.total_samples - self.context) // self.hop_length + 1
+        if end_frame - self.next_frame < self.block_frames:
+            return np.zeros((self.n_features, 0), dtype=np.float32)
+        return self._compute(end_frame, (end_frame - 1) * self.hop_length + self.context)
+
+    def flush(self):
+        """Return all remaining feature frames at the end of the stream."""
+        end_frame = self.total_samples // self.hop_length + 1
+        if end_frame <= self.next_frame or self.total_samples == 0:
+            return np.zeros((self.n_features, 0), dtype=np.float32)
+        return self._compute(end_frame, self.total_samples)
+
+    def _compute(self, end_frame, segment_end):
+        segment_start = max(0, self.next_frame * self.hop_length - self.context)
+        segment = self.audio[segment_start - self.audio_start:segment_end - self.audio_start]
+
+        features = self.compute(segment, self.sr, self.hop_length)
+
+        first = self.next_frame - segment_start // self.hop_length
+        frames = features[:, first:first + end_frame - self.next_frame]
+        self.next_frame = end_frame
+
+        # Drop audio that no future frame can reach
+        keep_from = max(0, self.next_frame * self.hop_length - self.context)
+        if keep_from > self.audio_start:
+            self.audio = self.audio[keep_from - self.audio_start:]
+            self.audio_start = keep_from
+
+        return frames
+
+
+class FeatureRingBuffer:
+    """
+    Rolling buffer of feature frames addressed by absolute frame index.
+    """
+
+    def __init__(self, n_features, capacity):
+        self.capacity = int(capacity)
+        self.data = np.zeros((n_features, self.capacity), dtype=np.float32)
+        self.total_written = 0
+
+    @property
+    def first_frame(self):
+        """Absolute index of the oldest frame still held in the buffer."""
+        return max(0, self.total_written - self.capacity)
+
+    def append(self, frames):
+        """Append frames (n_features x n), overwriting the oldest ones once full."""
+        if frames.shape[1] >= self.capacity:
+            self.total_written += frames.shape[1] - self.capacity
+            frames = frames[:, -self.capacity:]
+
+        n = frames.shape[1]
+        pos = self.total_written % self.capacity
+        first = min(n, self.capacity - pos)
+        self.data[:, pos:pos + first] = frames[:, :first]
+        self.data[:, :n - first] = frames[:, first:]
+        self.total_written += n
+
+    def read(self, start_frame, end_frame):
+        """
+        Return a copy of the frames in [start_frame, end_frame).
+
+        Raises:
+            IndexError: if part of the range was already overwritten or not yet written
+        """
+        if start_frame < self.first_frame or end_frame > self.total_written or start_frame > end_frame:
+            raise IndexError(
+                f"Frames {start_frame}-{end_frame} not in buffer "
+                f"({self.first_frame}-{self.total_written})"
+            )
+
+        start = start_frame % self.capacity
+        length = end_frame - start_frame
+        if start + length <= self.capacity:
+            return self.data[:, start:start + length].copy()
+        return np.concatenate((self.data[:, start:], self.data[:, :start + length - self.capacity]), axis=1)
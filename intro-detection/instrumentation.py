@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Stage timers and counters for the intro scanner.
+
+The scanner's hot paths report into the statistics of the file currently
+being scanned: stage() times a block of code, timed() times every step of an
+iterator (e.g. the decoder, whose work happens inside next()), count() adds
+to a counter. Without an active file all of these do nothing but run the
+code, so library callers pay nothing.
+
+Stage times are exclusive: a stage opened inside another is counted only
+as the inner stage, the outer one is charged the rest of its time. Whatever
+is left of a file's elapsed time is reported as "other".
+
+Stages used by the scanner:
+    hash, probe, decode, features, correlation, refinement, template, database, tmdb
+"""
+
+import contextlib
+import json
+import time
+from collections import defaultdict
+
+RECORD_FORMAT_VERSION = 1
+
+_current = None  # FileStats of the file being scanned
+
+
+class FileStats:
+    """
+    Timings and counters of one scanned file.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.seconds = defaultdict(float)  # stage -> seconds
+        self.calls = defaultdict(int)  # stage -> number of timed blocks
+        self.counters = defaultdict(int)
+        self.elapsed = 0.0
+        self.started = time.perf_counter()
+        self.open_stages = []  # [name, started, seconds of inner stages] of the stages being timed
+
+    @classmethod
+    def from_record(cls, record):
+        """Continue the statistics of a record, e.g. one returned by a worker process."""
+        stats = cls(record["path"])
+        for stage, values in record["stages"].items():
+            if stage == "other":
+                continue
+            stats.seconds[stage] = values["seconds"]
+            stats.calls[stage] = values["calls"]
+        stats.counters.update(record["counters"])
+        stats.elapsed = record["elapsed"]
+        return stats
+
+    def to_record(self):
+        """JSON-serializable record of the statistics so far."""
+        elapsed = self.elapsed + time.perf_counter() - self.started
+        stages = {stage: {"seconds": seconds, "calls": self.calls[stage]} for stage, seconds in self.seconds.items()}
+        stages["other"] = {"seconds": max(0.0, elapsed - sum(self.seconds.values())), "calls": 0}
+        return {
+            "version": RECORD_FORMAT_VERSION,
+            "path": self.path,
+            "elapsed": elapsed,
+            "stages": stages,
+            "counters": dict(self.counters),
+        }
+
+
+def start(path):
+    """Start collecting statistics for path; returns the new FileStats."""
+    global _current
+    _current = FileStats(path)
+    return _current
+
+
+def resume(record):
+    """Continue collecting into a record from an earlier start()/finish()."""
+    global _current
+    _current = FileStats.from_record(record)
+    return _current
+
+
+def finish():
+    """
+    Stop collecting for the current file.
+
+    Returns:
+        Record dict (see FileStats.to_record), or None if no file was active
+    """
+    global _current
+    if _current is None:
+        return None
+    record = _current.to_record()
+    _current = None
+    return record
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the enclosed block as stage name of the current file, excluding stages opened inside it."""
+    stats = _current
+    if stats is None:
+        yield
+        return
+
+    entry = [name, time.perf_counter(), 0.0]
+    stats.open_stages.append(entry)
+    try:
+        yield
+    finally:
+        stats.open_stages.remove(entry)
+        seconds = time.perf_counter() - entry[1]
+        stats.seconds[name] += seconds - entry[2]
+        stats.calls[name] += 1
+        # The enclosing stage, if any, is not charged for this time
+        if stats.open_stages:
+            stats.open_stages[-1][2] += seconds
+
+
+def timed(iterable, name):
+    """Yield from iterable, timing the production of every item as stage name."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(name, value=1):
+    """Add value to counter name of the current file."""
+    if _current is not None:
+        _current.counters[name] += value
+
+
+def format_record(record):
+    """One-line summary of a record: elapsed time and the stages that took it."""
+    stages = sorted(record["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+    parts = [f"{stage} {values['seconds']:.2f}s" for stage, values in stages if values["seconds"] >= 0.005]
+    return f"{record['elapsed']:.2f}s ({', '.join(parts)})"
+
+
+def write_record(path, record):
+    """Append a record to a JSON-lines file."""
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+class Aggregate:
+    """
+    Sums the records of a batch run into one report.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.elapsed = 0.0
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.slowest = []  # (elapsed, path), longest first
+
+    def add(self, record):
+        self.files += 1
+        self.elapsed += record["elapsed"]
+        for stage, values in record["stages"].items():
+            self.seconds[stage] += values["seconds"]
+            self.calls[stage] += values["calls"]
+        for name, value in record["counters"].items():
+            self.counters[name] += value
+        self.slowest.append((record["elapsed"], record["path"]))
+        self.slowest.sort(reverse=True)
+        del self.slowest[5:]
+
+    def report(self):
+        """Human-readable report lines."""
+        if self.files == 0:
+            return ["No timing records"]
+
+        lines = [f"Time per stage over {self.files} files ({self.elapsed:.1f}s of scan time):"]
+        for stage, seconds in sorted(self.seconds.items(), key=lambda item: item[1], reverse=True):
+            share = 100.0 * seconds / self.elapsed if self.elapsed else 0.0
+            calls = f", {self.calls[stage]} calls" if self.calls[stage] else ""
+            lines.append(f"  {stage:<12}{seconds:>9.1f}s {share:>5.1f}%  ({seconds / self.files:.2f}s per file{calls})")
+        if self.counters:
+            lines.append("Counters:")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"  {name:<24}{value:>12g}")
+        lines.append("Slowest files:")
+        for elapsed, path in self.slowest:
+            lines.append(f"  {elapsed:>7.1f}s  {path}")
+        return lines
+
+
+@contextlib.contextmanager
+def profiled(output_path):
+    """
+    Profile the enclosed block and write the result to output_path.
+
+    A path ending in .html uses pyinstrument if it is installed (a statistical
+    profiler with a readable call tree); anything else uses cProfile and
+    writes pstats data, which e.g. snakeviz or `python -m pstats` can read.
+    """
+    if output_path is None:
+        yield
+        return
+
+    if output_path.endswith(".html"):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("Warning: pyinstrument is not installed, using cProfile")
+            output_path = output_path[:-len(".html")] + ".prof"
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with open(output_path, "w") as f:
+                    f.write(profiler.output_html())
+            return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_path)
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Persistent landmark fingerprint index of a video library.
+
+Scanning for a new intro snippet decodes and correlates every file again.
+The index is built once per file instead: the first INDEX_HEAD_DURATION and
+the last INDEX_TAIL_DURATION seconds are decoded, the strongest peaks of the
+spectrogram are picked and every peak is paired with a few later ones. A pair
+(frequency, frequency, time difference) hashes into a 24-bit landmark, stored
+with its file and time in SQLite.
+
+A snippet is matched against the whole library by looking up its own
+landmarks: every hit votes for the offset between the snippet and the file,
+and a file containing the snippet collects many votes at the same offset.
+Only the best offset of those files is decoded again (a few seconds around
+it) and verified with compute_correlation, so no file is read in full.
+
+Usage:
+    python3 landmark_index.py build <directory> [--workers N]
+    python3 landmark_index.py query <snippet.wav> [--outro] [--save] [--force] [--no-verify]
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import librosa
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+import storage
+from audio_decoder import decode_audio_range, probe_duration
+from batch_scan import find_videos, scanner
+from matcher import interpolate_peak
+from movie_hash import HASH_CACHE_FILE, HashCache, hash_files
+
+LANDMARK_INDEX_FILE = "landmark_index.db"  # relative to the database directory
+INDEX_HEAD_DURATION = 600  # seconds indexed from the start of every file
+INDEX_TAIL_DURATION = scanner.OUTRO_SEARCH_DURATION  # seconds indexed at the end (outros)
+LANDMARK_SAMPLE_RATE = 11025  # Hz
+LANDMARK_N_FFT = 1024
+LANDMARK_HOP_LENGTH = 256  # samples between spectrogram frames (~23 ms)
+PEAK_NEIGHBOURHOOD = (15, 15)  # (bins, frames) a peak must be the maximum of
+PEAK_FLOOR_DB = -60  # peaks quieter than this (dB full scale) are ignored
+PEAKS_PER_SECOND = 20  # strongest peaks kept per second of audio
+FAN_OUT = 5  # later peaks each peak is paired with
+PAIR_MAX_FRAMES = 63  # largest time difference of a pair (6 bits, ~1.5 s)
+PAIR_MAX_BINS = 64  # largest frequency difference of a pair
+VOTE_BIN = 4  # frames of offset counted as the same vote (~93 ms)
+MIN_VOTES = 15  # votes a file needs at one offset to be verified
+VERIFY_MARGIN = 2.0  # seconds decoded on each side of the voted position
+QUERY_CHUNK = 500  # landmarks looked up per query
+OFFSET_BIAS = 1 << 31  # keeps negative offset bins positive within a vote key
+
+
+def landmark_seconds(frames):
+    """Seconds spanned by a number of landmark frames."""
+    return frames * LANDMARK_HOP_LENGTH / LANDMARK_SAMPLE_RATE
+
+
+def spectral_peaks(audio):
+    """
+    Pick the strongest local maxima of the spectrogram.
+
+    Returns:
+        (frames, bins) arrays of the peaks, ordered by frame
+    """
+    spectrum = np.abs(librosa.stft(audio, n_fft=LANDMARK_N_FFT, hop_length=LANDMARK_HOP_LENGTH))
+    # The top bin does not fit the 9 bits of a landmark frequency
+    level = 20 * np.log10(np.maximum(spectrum[:LANDMARK_N_FFT // 2], 1e-10))
+
+    peaks = (level == maximum_filter(level, size=PEAK_NEIGHBOURHOOD)) & (level > PEAK_FLOOR_DB)
+    bins, frames = np.nonzero(peaks)
+    strength = level[bins, frames]
+
+    # Keep the strongest PEAKS_PER_SECOND of every second
+    second = (landmark_seconds(frames)).astype(np.int64)
+    order = np.lexsort((-strength, second))
+    grouped = second[order]
+    rank = np.arange(len(order)) - np.searchsorted(grouped, grouped)
+    kept = np.sort(order[rank < PEAKS_PER_SECOND])
+    kept = kept[np.lexsort((bins[kept], frames[kept]))]
+    return frames[kept], bins[kept]
+
+
+def landmarks(audio, frame_offset=0):
+    """
+    Hash pairs of spectral peaks.
+
+    Args:
+        audio: Mono PCM at LANDMARK_SAMPLE_RATE
+        frame_offset: Frame number of the first sample (for the end of a file)
+
+    Returns:
+        (hashes, frames) int64 arrays, the frame being that of the earlier peak
+    """
+    frames, bins = spectral_peaks(audio)
+    n = len(frames)
+    hashes, anchors = [], []
+    paired = np.zeros(n, dtype=np.int64)
+
+    # Peaks are ordered by frame: the partners of peak i follow it directly
+    distance = 1
+    while distance < n:
+        first, second = np.arange(n - distance), np.arange(distance, n)
+        dt = frames[second] - frames[first]
+        if dt.min(initial=PAIR_MAX_FRAMES + 1) > PAIR_MAX_FRAMES:
+            break
+        valid = (dt >= 1) & (dt <= PAIR_MAX_FRAMES) & (np.abs(bins[second] - bins[first]) <= PAIR_MAX_BINS) \
+            & (paired[first] < FAN_OUT)
+        first, second, dt = first[valid], second[valid], dt[valid]
+        paired[first] += 1
+        hashes.append((bins[first].astype(np.int64) << 15) | (bins[second].astype(np.int64) << 6) | dt)
+        anchors.append(frames[first].astype(np.int64) + frame_offset)
+        distance += 1
+
+    if not hashes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(hashes), np.concatenate(anchors)
+
+
+def file_landmarks(video_path):
+    """
+    Decode the indexed parts of a video and compute their landmarks.
+
+    Returns:
+        (video_path, duration, hashes, frames) tuple; hashes is None if the
+        audio could not be decoded
+    """
+    duration = probe_duration(video_path)
+    head = INDEX_HEAD_DURATION
+    regions = [(0.0, head)]
+    if duration and duration > head + INDEX_TAIL_DURATION:
+        regions.append((duration - INDEX_TAIL_DURATION, INDEX_TAIL_DURATION))
+    elif duration:
+        regions = [(0.0, duration)]
+
+    hashes, frames = [], []
+    for start, length in regions:
+        audio = decode_audio_range(video_path, start, length, LANDMARK_SAMPLE_RATE)
+        if audio is None:
+            continue
+        frame_offset = int(round(start * LANDMARK_SAMPLE_RATE / LANDMARK_HOP_LENGTH))
+        region_hashes, region_frames = landmarks(audio, frame_offset)
+        hashes.append(region_hashes)
+        frames.append(region_frames)
+
+    if not hashes:
+        return video_path, duration, None, None
+    return video_path, duration, np.concatenate(hashes), np.concatenate(frames)
+
+
+class LandmarkIndex:
+    """
+    SQLite store of the landmarks of a library.
+
+    Landmarks are kept in a WITHOUT ROWID table keyed by (hash, file, frame),
+    so the table is its own index and a lookup reads one B-tree range.
+    """
+
+    def __init__(self, index_path=LANDMARK_INDEX_FILE):
+        self.conn = sqlite3.connect(index_path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                movie_hash TEXT,
+                file_size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                duration REAL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS landmarks (
+                hash INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                frame INTEGER NOT NULL,
+                PRIMARY KEY (hash, file_id, frame)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def indexed_files(self):
+        """dict of path -> (file size, mtime) of all indexed files."""
+        return {path: (size, mtime) for path, size, mtime in
+                self.conn.execute("SELECT path, file_size, mtime FROM files")}
+
+    def add_file(self, path, movie_hash, file_size, mtime, duration, hashes, frames):
+        """Replace the landmarks of a file in one transaction."""
+        with self.conn:
+            self._delete(path)
+            file_id = self.conn.execute(
+                "INSERT INTO files (path, movie_hash, file_size, mtime, duration) VALUES (?, ?, ?, ?, ?)",
+                (path, movie_hash, file_size, mtime, duration)
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO landmarks (hash, file_id, frame) VALUES (?, ?, ?)",
+                zip(hashes.tolist(), [file_id] * len(hashes), frames.tolist())
+            )
+
+    def remove_file(self, path):
+        with self.conn:
+            self._delete(path)
+
+    def _delete(self, path):
+        row = self.conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if row:
+            self.conn.execute("DELETE FROM landmarks WHERE file_id = ?", row)
+            self.conn.execute("DELETE FROM files WHERE id = ?", row)
+
+    def file(self, file_id):
+        """(path, movie_hash, file_size, duration) of an indexed file."""
+        return self.conn.execute("SELECT path, movie_hash, file_size, duration FROM files WHERE id = ?",
+                                 (file_id,)).fetchone()
+
+    def vote(self, hashes, frames):
+        """
+        Vote for the offset of a snippet in every file sharing its landmarks.
+
+        Args:
+            hashes, frames: Landmarks of the snippet
+
+        Returns:
+            List of (file_id, offset frame, votes), best offset per file,
+            ordered by votes
+        """
+        order = np.argsort(hashes, kind="stable")
+        hashes, frames = hashes[order], frames[order]
+        distinct = np.unique(hashes).tolist()
+
+        rows = []
+        for start in range(0, len(distinct), QUERY_CHUNK):
+            chunk = distinct[start:start + QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(self.conn.execute(
+                f"SELECT hash, file_id, frame FROM landmarks WHERE hash IN ({placeholders})", chunk
+            ))
+        if not rows:
+            return []
+        hit_hashes, file_ids, hit_frames = (np.array(column, dtype=np.int64) for column in zip(*rows))
+
+        # Pair every hit with every snippet landmark of the same hash
+        first = np.searchsorted(hashes, hit_hashes, side="left")
+        count = np.searchsorted(hashes, hit_hashes, side="right") - first
+        hit = np.repeat(np.arange(len(hit_hashes)), count)
+        snippet = np.repeat(first - np.cumsum(count) + count, count) + np.arange(count.sum())
+        offsets = hit_frames[hit] - frames[snippet]
+
+        # Votes per (file, offset bin), plus those of the next bin for offsets on a bin edge
+        keys = (file_ids[hit] << 32) | (offsets // VOTE_BIN + OFFSET_BIAS)
+        bins, votes = np.unique(keys, return_counts=True)
+        following = np.minimum(np.searchsorted(bins, bins + 1), len(bins) - 1)
+        votes = votes + np.where(bins[following] == bins + 1, votes[following], 0)
+
+        # Best bin per file
+        order = np.lexsort((-votes, bins >> 32))
+        bins, votes = bins[order], votes[order]
+        first_of_file = np.concatenate(([True], (bins[1:] >> 32) != (bins[:-1] >> 32)))
+        best = [(int(key >> 32), int((key & 0xFFFFFFFF) - OFFSET_BIAS) * VOTE_BIN, int(total))
+                for key, total in zip(bins[first_of_file], votes[first_of_file])]
+        return sorted(best, key=lambda candidate: -candidate[2])
+
+    def stats(self):
+        """(files, landmarks) in the index."""
+        files = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        count = self.conn.execute("SELECT COUNT(*) FROM landmarks").fetchone()[0]
+        return files, count
+
+    def close(self):
+        self.conn.close()
+
+
+def verify(video_path, intro_features, intro_duration, position):
+    """
+    Correlate the snippet with the audio around a voted position.
+
+    Returns:
+        (start time, correlation score) of the best match near position
+    """
+    window_start = max(0.0, position - VERIFY_MARGIN)
+    audio = decode_audio_range(video_path, window_start, intro_duration + 2 * VERIFY_MARGIN, scanner.SAMPLE_RATE)
+    if audio is None:
+        return None, 0.0
+
+    scores = scanner.compute_correlation(intro_features, scanner.extract_audio_features(audio))
+    if not len(scores):
+        return None, 0.0
+    best = int(np.argmax(scores))
+    start_time = window_start + interpolate_peak(scores, best) * scanner.HOP_LENGTH / scanner.SAMPLE_RATE
+    return start_time, float(scores[best])
+
+
+def _verify_task(task):
+    return verify(*task)
+
+
+def index_path():
+    return os.path.join(os.path.dirname(os.path.abspath(scanner.db_path)), LANDMARK_INDEX_FILE)
+
+
+def build(args):
+    index = LandmarkIndex(args.index)
+    indexed = index.indexed_files()
+
+    videos = [os.path.abspath(path) for path in find_videos(args.directory)]
+    present = set(videos)
+    root = os.path.abspath(args.directory) + os.sep
+    for path in indexed:
+        if path.startswith(root) and path not in present:
+            index.remove_file(path)
+
+    pending = []
+    for path in videos:
+        stat = os.stat(path)
+        if indexed.get(path) != (stat.st_size, stat.st_mtime):
+            pending.append((path, stat))
+    print(f"Found {len(videos)} video files, indexing {len(pending)}")
+    if not pending:
+        return
+
+    hash_cache = HashCache(os.path.join(os.path.dirname(os.path.abspath(scanner.db_path)), HASH_CACHE_FILE))
+    hashes = hash_files([path for path, _ in pending], hash_cache)
+    hash_cache.close()
+
+    stats = dict(pending)
+    started = time.time()
+    media_seconds = 0.0
+    total = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for number, (path, duration, file_hashes, frames) in enumerate(
+                pool.map(file_landmarks, [path for path, _ in pending]), 1):
+            name = os.path.basename(path)
+            if file_hashes is None:
+                print(f"[{number}/{len(pending)}] ✗ {name}: could not decode")
+                continue
+            movie_hash, file_size = hashes.get(path, (None, stats[path].st_size))
+            index.add_file(path, movie_hash, file_size, stats[path].st_mtime, duration, file_hashes, frames)
+            media_seconds += min(duration or INDEX_HEAD_DURATION, INDEX_HEAD_DURATION + INDEX_TAIL_DURATION)
+            total += len(file_hashes)
+            print(f"[{number}/{len(pending)}] ✓ {name}: {len(file_hashes)} landmarks")
+
+    elapsed = time.time() - started
+    files, landmark_count = index.stats()
+    index.close()
+    print(f"\nIndexed {total} landmarks in {elapsed:.1f}s ({media_seconds / elapsed:.0f} media-seconds per second)")
+    print(f"Index: {files} files, {landmark_count} landmarks")
+
+
+def query(args):
+    index = LandmarkIndex(args.index)
+    started = time.time()
+    snippet = scanner.load_audio_from_file(args.snippet, LANDMARK_SAMPLE_RATE)
+    snippet_hashes, snippet_frames = landmarks(snippet)
+    candidates = [candidate for candidate in index.vote(snippet_hashes, snippet_frames) if candidate[2] >= args.min_votes]
+    print(f"{len(snippet_hashes)} snippet landmarks, {len(candidates)} candidate files "
+          f"({time.time() - started:.2f}s)")
+
+    files = {file_id: index.file(file_id) for file_id, _, _ in candidates}
+    index.close()
+    candidates = [candidate for candidate in candidates if os.path.exists(files[candidate[0]][0])]
+
+    intro_duration = None
+    if args.no_verify:
+        results = [(landmark_seconds(offset), None) for _, offset, _ in candidates]
+    else:
+        intro_features, _, intro_duration = scanner.load_intro_template(args.snippet)
+        tasks = [(files[file_id][0], intro_features, intro_duration, landmark_seconds(offset))
+                 for file_id, offset, _ in candidates]
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(_verify_task, tasks))
+
+    matches = []
+    for (file_id, _, votes), (start_time, score) in zip(candidates, results):
+        path, movie_hash, file_size, duration = files[file_id]
+        name = os.path.basename(path)
+        if score is not None and (start_time is None or score < args.correlation_threshold):
+            print(f"  ✗ {name}: {votes} votes, not confirmed (correlation: {score:.4f})")
+            continue
+        note = "" if score is None else f", correlation: {score:.4f}"
+        if args.outro and duration:
+            print(f"  ✓ {name}: outro at {scanner.format_timestamp(start_time)}, "
+                  f"last {scanner.format_timestamp(duration - start_time)} ({votes} votes{note})")
+        else:
+            print(f"  ✓ {name}: {scanner.format_timestamp(start_time)} ({votes} votes{note})")
+        matches.append((path, movie_hash, file_size, duration, start_time, score))
+    print(f"\n{len(matches)} matches in {time.time() - started:.1f}s")
+
+    if args.save:
+        save_matches(matches, intro_duration, args)
+
+
+def save_matches(matches, intro_duration, args):
+    """Save verified matches: intros as new rows, outros as outro length of the existing rows."""
+    database = scanner.get_database()
+    database.batch_size = storage.COMMIT_BATCH_SIZE
+    known_names, known_hashes = scanner.load_known()
+
+    saved = skipped = 0
+    for path, movie_hash, file_size, duration, start_time, score in matches:
+        name = os.path.basename(path)
+        known = name in known_names or movie_hash in known_hashes
+        if args.outro:
+            if not known or not duration:
+                skipped += 1
+                continue
+            database.set_outro_length(name, movie_hash, duration - start_time)
+        else:
+            if known and not args.force:
+                skipped += 1
+                continue
+            scanner.save_intro_timestamps(path, start_time, start_time + intro_duration, score, movie_hash, file_size)
+        saved += 1
+    database.commit()
+    print(f"✓ Saved {saved} matches, skipped {skipped}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Landmark fingerprint index of a video library")
+    parser.add_argument("--index", default=None,
+                        help=f"Index file (default: {LANDMARK_INDEX_FILE} next to the database)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of decoding processes (default: number of CPUs)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Index new and changed files below a directory")
+    build_parser.add_argument("directory", help="Directory to index (recursively)")
+
+    query_parser = commands.add_parser("query", help="Find a snippet in all indexed files")
+    query_parser.add_argument("snippet", help="Path to audio snippet (intro, or outro with --outro)")
+    query_parser.add_argument("--outro", action="store_true",
+                              help="The snippet is an outro: report (and save) the outro length")
+    query_parser.add_argument("--min-votes", type=int, default=MIN_VOTES,
+                              help=f"Votes a file needs at one offset to be a candidate (default: {MIN_VOTES})")
+    query_parser.add_argument("--correlation-threshold", type=float, default=scanner.CORRELATION_THRESHOLD,
+                              help=f"Correlation threshold 0-1 of the verification (default: {scanner.CORRELATION_THRESHOLD})")
+    query_parser.add_argument("--no-verify", action="store_true",
+                              help="Report the voted positions without decoding anything")
+    query_parser.add_argument("--save", action="store_true", help="Save the verified matches to the database")
+    query_parser.add_argument("--force", action="store_true",
+                              help="With --save, overwrite intros of files already in the database")
+    args = parser.parse_args()
+
+    args.index = args.index or index_path()
+    if args.command == "build":
+        build(args)
+    else:
+        if args.save and args.no_verify:
+            parser.error("--save needs verified matches, drop --no-verify")
+        query(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Frame-aligned normalized cross-correlation of feature matrices.
+
+The template (n_features x T) is slid over a feature matrix
+(n_features x N) one frame at a time. For every lag k the score is the
+Pearson correlation between the template and the window features[:, k:k+T],
+using the mean and variance of that window, not of the whole matrix.
+
+All lags are computed in one call: the numerator comes from an FFT
+correlation of every feature row with the corresponding template row, the
+window statistics from cumulative sums, so the cost is O(N log N) regardless
+of the template length.
+"""
+
+import numpy as np
+from scipy.fft import irfft, next_fast_len, rfft
+from scipy.ndimage import maximum_filter1d
+from scipy.signal import fftconvolve
+
+EPSILON = 1e-8
+
+
+def normalized_cross_correlation(template, features):
+    """
+    Compute the per-lag normalized cross-correlation curve.
+
+    Args:
+        template: Feature matrix of the snippet, shape (n_features, T)
+        features: Feature matrix to search, shape (n_features, N), N >= T
+
+    Returns:
+        Array of N - T + 1 scores in [-1, 1]; index k is the correlation of
+        the template with features[:, k:k+T]. Empty if N < T.
+    """
+    template = np.asarray(template, dtype=np.float64)
+    features = np.asarray(features, dtype=np.float64)
+
+    template_frames = template.shape[1]
+    if features.shape[1] < template_frames or template_frames == 0:
+        return np.zeros(0)
+
+    # Zero-mean template: the window mean then drops out of the numerator
+    template_zm = template - template.mean()
+
+    # sum_i sum_t features[i, k + t] * template_zm[i, t] for every lag k
+    numerator = fftconvolve(features, template_zm[:, ::-1], mode="valid", axes=1).sum(axis=0)
+
+    cumulative = _cumulative_sums(features)
+    return _normalize(numerator, template_zm, cumulative)
+
+
+def normalized_cross_correlation_batch(templates, features):
+    """
+    Correlate several templates with one feature matrix in a single FFT pass.
+
+    The feature matrix is transformed once; the templates, which may differ in
+    length, are zero-padded to a common length and stacked, so adding a
+    template costs one spectrum product instead of a full correlation.
+
+    Args:
+        templates: List of feature matrices, shapes (n_features, T_k)
+        features: Feature matrix to search, shape (n_features, N)
+
+    Returns:
+        Array of shape (len(templates), N - max(T_k) + 1); row k is the score
+        curve of template k for every lag at which all templates fit.
+    """
+    templates = [np.asarray(template, dtype=np.float64) for template in templates]
+    features = np.asarray(features, dtype=np.float64)
+
+    max_frames = max(template.shape[1] for template in templates)
+    total_frames = features.shape[1]
+    n_lags = total_frames - max_frames + 1
+    if n_lags <= 0 or max_frames == 0:
+        return np.zeros((len(templates), 0))
+
+    template_zms = [template - template.mean() for template in templates]
+
+    # Reversed, zero-padded templates stacked into (K, n_features, max_frames)
+    stacked = np.zeros((len(templates), features.shape[0], max_frames))
+    for k, template_zm in enumerate(template_zms):
+        stacked[k, :, :template_zm.shape[1]] = template_zm[:, ::-1]
+
+    nfft = next_fast_len(total_frames + max_frames - 1)
+    spectrum = rfft(features, nfft, axis=1)
+    full = irfft((rfft(stacked, nfft, axis=2) * spectrum).sum(axis=1), nfft, axis=1)
+
+    cumulative = _cumulative_sums(features)
+    scores = np.zeros((len(templates), n_lags))
+    for k, template_zm in enumerate(template_zms):
+        frames = template_zm.shape[1]
+        # Convolution index frames - 1 + lag holds the correlation at lag
+        numerator = full[k, frames - 1:frames - 1 + n_lags]
+        scores[k] = _normalize(numerator, template_zm, cumulative)[:n_lags]
+    return scores
+
+
+def _cumulative_sums(features):
+    """Prefix sums of the column sums and column sums of squares."""
+    return (
+        np.concatenate(([0.0], np.cumsum(features.sum(axis=0)))),
+        np.concatenate(([0.0], np.cumsum((features ** 2).sum(axis=0)))),
+    )
+
+
+def _normalize(numerator, template_zm, cumulative):
+    """Turn correlation numerators into Pearson scores using per-window statistics."""
+    column_sum, column_sq_sum = cumulative
+    template_frames = template_zm.shape[1]
+    n = template_zm.size
+    n_lags = len(numerator)
+
+    # Windowed sum and sum of squares over all feature rows
+    window_sum = column_sum[template_frames:template_frames + n_lags] - column_sum[:n_lags]
+    window_sq_sum = column_sq_sum[template_frames:template_frames + n_lags] - column_sq_sum[:n_lags]
+    window_energy = np.maximum(window_sq_sum - window_sum ** 2 / n, 0.0)
+
+    denominator = np.sqrt(window_energy * np.sum(template_zm ** 2))
+    return np.where(denominator > EPSILON, numerator / np.maximum(denominator, EPSILON), 0.0)
+
+
+def interpolate_peak(scores, index):
+    """
+    Refine an integer peak position by fitting a parabola through the peak
+    and its two neighbours.
+
+    Returns:
+        Fractional peak position (index plus an offset in [-0.5, 0.5])
+    """
+    if index <= 0 or index >= len(scores) - 1:
+        return float(index)
+
+    left, centre, right = scores[index - 1], scores[index], scores[index + 1]
+    curvature = left - 2 * centre + right
+    if curvature >= 0:
+        return float(index)
+    return index + float(np.clip(0.5 * (left - right) / curvature, -0.5, 0.5))
+
+
+def find_peaks(scores, start, end, neighbourhood):
+    """
+    Find local maxima of scores within [start, end).
+
+    A lag is a peak if no lag within +/- neighbourhood has a higher score;
+    plateaus report their first lag only.
+
+    Returns:
+        Array of peak indices in ascending order
+    """
+    start = max(0, start)
+    end = min(len(scores), end)
+    if end <= start:
+        return np.zeros(0, dtype=int)
+
+    lo = max(0, start - neighbourhood)
+    hi = min(len(scores), end + neighbourhood)
+    local_max = maximum_filter1d(scores[lo:hi], size=2 * neighbourhood + 1, mode="constant", cval=-np.inf)
+
+    candidates = np.arange(start, end)
+    is_peak = scores[start:end] >= local_max[start - lo:end - lo]
+    # Drop plateau duplicates: keep a lag only if the previous one is lower
+    previous = np.concatenate(([-np.inf], scores[start:end - 1])) if start == 0 else scores[start - 1:end - 1]
+    is_peak &= scores[start:end] > previous
+    return candidates[is_peak]
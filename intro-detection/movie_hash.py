@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+OpenSubtitles movie hashes, computed in bulk and cached.
+
+The hash is the file size plus the sum of the little-endian 64-bit words of
+the first and the last 64 KiB of the file, modulo 2**64. Each block is read
+with a single call and summed with NumPy's wrapping uint64 arithmetic.
+
+HashCache remembers hashes by path, size and mtime in a small SQLite file, so
+walking a library again only reads files that were added or changed;
+hash_files() hashes the rest concurrently in a thread pool (the work is
+almost entirely I/O, which releases the GIL).
+"""
+
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+HASH_BLOCK_SIZE = 65536  # bytes read from the start and from the end of the file
+HASH_WORKERS = 8  # concurrent reads; mostly waiting on the disk or NFS server
+HASH_CACHE_FILE = "hash_cache.db"  # relative to the database directory
+
+
+def _block_sum(block):
+    """Wrapping sum of the complete little-endian 64-bit words in block."""
+    words = np.frombuffer(block, dtype="<u8", count=len(block) // 8)
+    return int(words.sum(dtype=np.uint64))
+
+
+def opensubtitles_hash(path):
+    """
+    Calculate the OpenSubtitles hash of a file.
+
+    Returns:
+        Tuple of (16-character hex hash, file size in bytes)
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Video file not found: {path}")
+
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Path is not a file: {path}")
+
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        head = f.read(HASH_BLOCK_SIZE)
+        f.seek(max(0, file_size - HASH_BLOCK_SIZE))
+        tail = f.read(HASH_BLOCK_SIZE)
+
+    file_hash = (file_size + _block_sum(head) + _block_sum(tail)) & 0xFFFFFFFFFFFFFFFF
+    return "%016x" % file_hash, file_size
+
+
+class HashCache:
+    """
+    Persistent map of (path, size, mtime) to movie hash.
+
+    Only used from one thread; hash_files() does the lookups and stores
+    around its worker pool.
+    """
+
+    def __init__(self, cache_path=HASH_CACHE_FILE):
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                file_size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                movie_hash TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def lookup(self, path, file_size, mtime):
+        """Return the cached hash of path, or None if unknown or the file changed."""
+        row = self.conn.execute(
+            "SELECT movie_hash FROM file_hashes WHERE path = ? AND file_size = ? AND mtime = ?",
+            (path, file_size, mtime)
+        ).fetchone()
+        return row[0] if row else None
+
+    def store_many(self, entries):
+        """Store (path, file_size, mtime, movie_hash) tuples in one transaction."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO file_hashes (path, file_size, mtime, movie_hash) VALUES (?, ?, ?, ?)",
+            entries
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def hash_files(paths, cache=None, workers=HASH_WORKERS):
+    """
+    Hash many files, reading only those not in the cache.
+
+    Args:
+        paths: Video file paths
+        cache: Optional HashCache; new hashes are added to it
+        workers: Number of files read concurrently
+
+    Returns:
+        dict of path -> (hash, file size); files that could not be read are
+        missing, with a warning printed
+    """
+    hashes = {}
+    misses = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            print(f"  Warning: Could not stat {path}: {e}")
+            continue
+
+        movie_hash = cache.lookup(os.path.abspath(path), stat.st_size, stat.st_mtime) if cache else None
+        if movie_hash is not None:
+            hashes[path] = (movie_hash, stat.st_size)
+        else:
+            misses.append((path, stat))
+
+    def hash_one(item):
+        path, stat = item
+        try:
+            return path, stat, opensubtitles_hash(path)
+        except OSError as e:
+            print(f"  Warning: Could not hash {path}: {e}")
+            return path, stat, None
+
+    new_entries = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for path, stat, result in pool.map(hash_one, misses):
+            if result is None:
+                continue
+            hashes[path] = result
+            new_entries.append((os.path.abspath(path), stat.st_size, stat.st_mtime, result[0]))
+
+    if cache and new_entries:
+        cache.store_many(new_entries)
+    return hashes
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Series-aware search windows for the intro scanner.
+
+Episodes of a series almost always have their intro within a few seconds of
+the same offset. SeriesPriors collects the known intro start times from the
+database, grouped by the show title parsed from the file name (and by TMDB
+series id where one is known), and turns them into a time window that is
+searched before falling back to a scan of the whole video.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+import tmdb_lookup
+
+PRIOR_MIN_EPISODES = 2  # known episodes needed before a prior is used
+PRIOR_MARGIN = 10  # seconds added on both sides of the observed start times
+PRIOR_PERCENTILES = (10, 90)  # ignore outliers such as mis-detections or specials
+
+
+def series_title(file_name):
+    """Normalized show/movie title of a file, used to group episodes."""
+    return tmdb_lookup.parse_filename(file_name)["title"].lower()
+
+
+def tmdb_series_id(tmdb_id):
+    """Series part of a stored TMDB id ("<id>:<season>:<episode>" for episodes)."""
+    if not tmdb_id:
+        return None
+    return str(tmdb_id).split(":")[0]
+
+
+class SeriesPriors:
+    """
+    Known intro start times grouped by series.
+    """
+
+    def __init__(self):
+        self.starts_by_title = defaultdict(dict)  # title -> {file_name: start_time}
+        self.starts_by_series = defaultdict(dict)  # TMDB series id -> {file_name: start_time}
+        self.series_by_title = defaultdict(set)  # title -> TMDB series ids
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_database(cls, database):
+        """Build priors from all rows of a storage.IntroDatabase."""
+        priors = cls()
+        for file_name, start_time, tmdb_id in database.intro_starts():
+            priors.add(file_name, start_time, tmdb_id)
+        return priors
+
+    def add(self, file_name, start_time, tmdb_id=None):
+        """Record the intro start time of one file."""
+        title = series_title(file_name)
+        self.starts_by_title[title][file_name] = float(start_time)
+
+        series_id = tmdb_series_id(tmdb_id)
+        if series_id:
+            self.starts_by_series[series_id][file_name] = float(start_time)
+            self.series_by_title[title].add(series_id)
+
+    def window(self, video_path):
+        """
+        Return the (earliest, latest) intro start time to search first, or None
+        if too few episodes of the same series are known.
+        """
+        title = series_title(video_path)
+        starts = dict(self.starts_by_title.get(title, {}))
+        # Files named differently but resolved to the same TMDB series
+        for series_id in self.series_by_title.get(title, ()):
+            starts.update(self.starts_by_series[series_id])
+
+        if len(starts) < PRIOR_MIN_EPISODES:
+            return None
+
+        low, high = np.percentile(list(starts.values()), PRIOR_PERCENTILES)
+        return max(0.0, low - PRIOR_MARGIN), high + PRIOR_MARGIN
+
+    def record(self, window, start_time, matched):
+        """
+        Count whether a scan that used window found its match inside it.
+
+        Returns:
+            True on a hit
+        """
+        hit = matched and window[0] <= start_time <= window[1]
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    def summary(self):
+        """Human-readable hit rate of the priors used so far."""
+        used = self.hits + self.misses
+        if used == 0:
+            return "Series priors: not used"
+        return f"Series priors: used for {used} files, hit {self.hits} ({100.0 * self.hits / used:.0f}%)"
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+SQLite storage of detected intros.
+
+IntroDatabase owns the connection to intro_timestamps.db:
+
+- The schema is versioned with PRAGMA user_version and brought up to date by
+  MIGRATIONS when the database is opened, so old databases keep working.
+- The database runs in WAL mode with a busy timeout: readers never block the
+  writer, and concurrent writers (several scanners, the TMDB backfill) wait
+  for each other instead of failing with "database is locked".
+- Rows are upserted on the movie hash (or the file name for rows without a
+  hash), so saving a file twice updates its row instead of adding another.
+- Triggers set change_seq of every inserted or changed row to a new highest
+  number, which the incremental export of the VLC cache reads changes by.
+- Writes are grouped into transactions of batch_size rows; commit() (or
+  close()) writes the rest. Transactions are kept short so other writers are
+  never held up for long: a writer commits before it waits for anything else
+  (a scan, an HTTP request), as the open transaction holds the write lock.
+"""
+
+import sqlite3
+import time
+
+DB_PATH = "intro_timestamps.db"
+BUSY_TIMEOUT = 60  # seconds a writer waits for another writer's transaction
+COMMIT_BATCH_SIZE = 50  # rows per transaction for bulk writers
+COMMIT_INTERVAL = 5.0  # seconds after which a partial batch is committed anyway
+
+
+def _create_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS intro_timestamps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_name TEXT NOT NULL,
+            movie_hash TEXT,
+            file_size INTEGER,
+            start_time REAL NOT NULL,
+            end_time REAL NOT NULL,
+            correlation_score REAL NOT NULL,
+            tmdb_id TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _add_outro_length(conn):
+    # Always written by the scanner but missing from the original schema
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(intro_timestamps)")}
+    if "outro_length" not in columns:
+        conn.execute("ALTER TABLE intro_timestamps ADD COLUMN outro_length REAL DEFAULT 0")
+
+
+def _add_unique_indexes(conn):
+    # Keep the newest row of every file before the keys become unique, with
+    # the TMDB id of an older row if it has none
+    conn.execute("""
+        UPDATE intro_timestamps SET tmdb_id = (
+            SELECT MAX(older.tmdb_id) FROM intro_timestamps older
+            WHERE older.movie_hash = intro_timestamps.movie_hash
+               OR (intro_timestamps.movie_hash IS NULL AND older.movie_hash IS NULL
+                   AND older.file_name = intro_timestamps.file_name)
+        )
+        WHERE tmdb_id IS NULL
+    """)
+    removed = conn.execute("""
+        DELETE FROM intro_timestamps
+        WHERE movie_hash IS NOT NULL AND id NOT IN (
+            SELECT MAX(id) FROM intro_timestamps WHERE movie_hash IS NOT NULL GROUP BY movie_hash
+        )
+    """).rowcount
+    removed += conn.execute("""
+        DELETE FROM intro_timestamps
+        WHERE movie_hash IS NULL AND id NOT IN (
+            SELECT MAX(id) FROM intro_timestamps WHERE movie_hash IS NULL GROUP BY file_name
+        )
+    """).rowcount
+    if removed:
+        print(f"Database migration: removed {removed} duplicate rows (kept the newest of each file)")
+
+    conn.execute("DROP INDEX IF EXISTS idx_intro_timestamps_movie_hash")
+    conn.execute("CREATE UNIQUE INDEX idx_intro_timestamps_movie_hash ON intro_timestamps (movie_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_intro_timestamps_file_name ON intro_timestamps (file_name)")
+    conn.execute("""
+        CREATE UNIQUE INDEX idx_intro_timestamps_unhashed_file_name
+        ON intro_timestamps (file_name) WHERE movie_hash IS NULL
+    """)
+
+
+def _add_change_counter(conn):
+    # Number of the last change of a row, increasing with every write of an
+    # exported column. Writers are serialized, so unlike the timestamp (taken
+    # when the statement runs, not at commit) it also orders changes by commit
+    conn.execute("ALTER TABLE intro_timestamps ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+    conn.execute("UPDATE intro_timestamps SET change_seq = id")
+    conn.execute("CREATE INDEX idx_intro_timestamps_change_seq ON intro_timestamps (change_seq)")
+    for name, event in (("insert", "INSERT"),
+                        ("update", "UPDATE OF file_name, movie_hash, file_size, start_time, end_time, outro_length")):
+        conn.execute(f"""
+            CREATE TRIGGER intro_timestamps_change_{name} AFTER {event} ON intro_timestamps
+            BEGIN
+                UPDATE intro_timestamps SET change_seq = (SELECT MAX(change_seq) FROM intro_timestamps) + 1
+                WHERE id = NEW.id;
+            END
+        """)
+
+
+# Schema version N is reached by applying MIGRATIONS[N - 1]
+MIGRATIONS = [
+    _create_table,
+    _add_outro_length,
+    _add_unique_indexes,
+    _add_change_counter,
+]
+
+_UPSERT_COLUMNS = "file_name, movie_hash, file_size, start_time, end_time, correlation_score, outro_length, tmdb_id"
+_UPSERT_UPDATE = """
+    file_name = excluded.file_name,
+    movie_hash = excluded.movie_hash,
+    file_size = excluded.file_size,
+    start_time = excluded.start_time,
+    end_time = excluded.end_time,
+    correlation_score = excluded.correlation_score,
+    outro_length = excluded.outro_length,
+    tmdb_id = COALESCE(excluded.tmdb_id, intro_timestamps.tmdb_id),
+    timestamp = CURRENT_TIMESTAMP
+"""
+UPSERT_BY_HASH = f"""
+    INSERT INTO intro_timestamps ({_UPSERT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (movie_hash) DO UPDATE SET {_UPSERT_UPDATE}
+"""
+UPSERT_BY_NAME = f"""
+    INSERT INTO intro_timestamps ({_UPSERT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (file_name) WHERE movie_hash IS NULL DO UPDATE SET {_UPSERT_UPDATE}
+"""
+
+
+class IntroDatabase:
+    """
+    Connection to the intro database.
+
+    Args:
+        path: Database file
+        batch_size: Rows written per transaction; 1 commits every write
+    """
+
+    def __init__(self, path=DB_PATH, batch_size=1):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = 0  # writes in the open transaction
+        self.transaction_started = None
+
+        # Transactions are managed explicitly (BEGIN IMMEDIATE ... COMMIT)
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        # Durable at every checkpoint; a power cut may lose the last commits, never corrupts
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.migrate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def migrate(self):
+        """Apply all migrations newer than the database's schema version."""
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return
+
+        # The write lock keeps two processes from migrating at the same time
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            for number in range(version + 1, len(MIGRATIONS) + 1):
+                MIGRATIONS[number - 1](self.conn)
+                self.conn.execute(f"PRAGMA user_version = {number}")
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _write(self, sql, parameters=()):
+        """Run a write inside the batch transaction, committing when the batch is full."""
+        if self.pending == 0:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.transaction_started = time.monotonic()
+        cursor = self.conn.execute(sql, parameters)
+        self.pending += 1
+
+        if self.pending >= self.batch_size:
+            self.commit()
+        else:
+            self.commit_if_due()
+        return cursor
+
+    def commit_if_due(self):
+        """Commit the open batch if it has been open for COMMIT_INTERVAL seconds."""
+        if self.pending and time.monotonic() - self.transaction_started >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        """Commit the open batch, if any."""
+        if self.pending:
+            self.conn.execute("COMMIT")
+            self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def save(self, file_name, movie_hash, file_size, start_time, end_time, correlation_score, outro_length=0, tmdb_id=None):
+        """Insert or update the row of a file, keyed by its hash (or its name if it has none)."""
+        self._write(
+            UPSERT_BY_HASH if movie_hash else UPSERT_BY_NAME,
+            (file_name, movie_hash, file_size, start_time, end_time, correlation_score, outro_length, tmdb_id)
+        )
+
+    def set_outro_length(self, file_name, movie_hash, outro_length):
+        """Set the outro length of the rows of a file, by name or hash."""
+        self._write("UPDATE intro_timestamps SET outro_length = ?, timestamp = CURRENT_TIMESTAMP "
+                    "WHERE file_name = ? or movie_hash = ?", (outro_length, file_name, movie_hash))
+
+    def set_tmdb_id(self, row_id, tmdb_id):
+        self._write("UPDATE intro_timestamps SET tmdb_id = ? WHERE id = ?", (tmdb_id, row_id))
+
+    def is_known(self, file_name, movie_hash):
+        """Check whether a file is in the database, by name or hash."""
+        row = self.conn.execute(
+            "SELECT 1 FROM intro_timestamps WHERE file_name = ? or movie_hash = ? LIMIT 1",
+            (file_name, movie_hash)
+        ).fetchone()
+        return row is not None
+
+    def load_known(self):
+        """
+        Load the names and hashes of all files in one query.
+
+        Returns:
+            (set of file names, set of movie hashes) tuple
+        """
+        rows = self.conn.execute("SELECT file_name, movie_hash FROM intro_timestamps").fetchall()
+        return {name for name, _ in rows}, {movie_hash for _, movie_hash in rows if movie_hash}
+
+    def load_outros(self):
+        """
+        Load the names and hashes of all files with an outro length.
+
+        Returns:
+            (set of file names, set of movie hashes) tuple
+        """
+        rows = self.conn.execute("SELECT file_name, movie_hash FROM intro_timestamps WHERE outro_length > 0").fetchall()
+        return {name for name, _ in rows}, {movie_hash for _, movie_hash in rows if movie_hash}
+
+    def intro_starts(self):
+        """All (file_name, start_time, tmdb_id) rows, e.g. for search priors."""
+        return self.conn.execute("SELECT file_name, start_time, tmdb_id FROM intro_timestamps").fetchall()
+
+    def rows_without_tmdb_id(self):
+        """All (id, file_name) rows that have no TMDB id yet."""
+        return self.conn.execute("SELECT id, file_name FROM intro_timestamps WHERE tmdb_id IS NULL").fetchall()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+On-disk cache for intro template features.
+
+Every scan of a season used to load the same intro WAV with librosa and run
+the CQT on it again. Entries are stored as .npz files keyed by a hash of the
+snippet's bytes plus the analysis parameters (sample rate, hop lengths,
+feature type), so a changed snippet or changed settings never hit a stale
+entry. The directory is kept below a size limit by evicting the least
+recently used entries; a hit refreshes the entry's mtime.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+TEMPLATE_CACHE_DIR = "template_cache"  # relative to the database directory
+TEMPLATE_CACHE_MAX_SIZE = 256 * 1024 * 1024  # bytes
+CACHE_FORMAT_VERSION = 1
+
+
+def template_key(audio_path, params):
+    """
+    Build the cache key for an audio file and a set of analysis parameters.
+
+    Returns:
+        Hex digest of the file contents and the sorted parameters
+    """
+    digest = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    digest.update(repr(("v", CACHE_FORMAT_VERSION)).encode())
+    for name in sorted(params):
+        digest.update(repr((name, params[name])).encode())
+    return digest.hexdigest()
+
+
+def load_entry(cache_dir, key):
+    """
+    Load a cached entry and mark it as recently used.
+
+    Returns:
+        dict of arrays, or None on a miss or an unreadable entry
+    """
+    path = os.path.join(cache_dir, f"{key}.npz")
+    try:
+        with np.load(path) as data:
+            entry = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return entry
+
+
+def store_entry(cache_dir, key, arrays, max_size=TEMPLATE_CACHE_MAX_SIZE):
+    """
+    Write an entry atomically and evict old entries beyond max_size bytes.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, os.path.join(cache_dir, f"{key}.npz"))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    evict(cache_dir, max_size)
+
+
+def evict(cache_dir, max_size=TEMPLATE_CACHE_MAX_SIZE, suffix=".npz"):
+    """
+    Remove least recently used entries until the cache fits into max_size bytes.
+
+    Also used by the audio cache (see audio_cache.py); entries are the files
+    ending in suffix, used in the order of their mtimes.
+
+    Returns:
+        Number of removed entries
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def get_or_compute(audio_path, params, compute, cache_dir=TEMPLATE_CACHE_DIR, max_size=TEMPLATE_CACHE_MAX_SIZE):
+    """
+    Return the cached features for audio_path, computing and storing them on a miss.
+
+    Args:
+        audio_path: Path to the template audio file
+        params: dict of analysis parameters that affect the features
+        compute: Callable returning a dict of arrays, only called on a miss
+        cache_dir: Cache directory (None disables the cache)
+        max_size: Size limit of the cache directory in bytes
+
+    Returns:
+        (arrays, hit) tuple
+    """
+    if cache_dir is None:
+        return compute(), False
+
+    key = template_key(audio_path, params)
+    entry = load_entry(cache_dir, key)
+    if entry is not None:
+        return entry, True
+
+    arrays = compute()
+    try:
+        store_entry(cache_dir, key, arrays, max_size)
+    except OSError as e:
+        print(f"  Warning: Could not write template cache: {e}")
+    return arrays, False
@@ -1,13 +1,49 @@
 #!/usr/bin/env python3
+"""
+TMDB id lookup for media files.
+
+TMDBResolver searches TMDB once per parsed (title, type, year) and remembers
+the answer, found or not, in memory and in a small SQLite cache next to the
+database, so every further episode of a season resolves without a request.
+Requests share one pooled requests.Session.
+
+In offline mode (TMDB_OFFLINE=1, --tmdb-offline of the scanners, or no
+TMDB_API_TOKEN) only the cache is consulted; files it cannot resolve are
+saved without an id and picked up later by `tmdb_lookup.py --update-db`.
+
+`tmdb_lookup.py --update-db` backfills all rows without an id: rows are
+grouped by title, titles are looked up concurrently under a token-bucket rate
+limit with retries, and the ids are written in batched transactions.
+
+TMDB_API_BASE overrides the API location, e.g. to run against a local stub.
+"""
 import argparse
 import os
 import re
 import sqlite3
 import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+import storage
 
-TMDB_API_BASE = "https://api.themoviedb.org/3"
+TMDB_API_BASE = os.environ.get("TMDB_API_BASE", "https://api.themoviedb.org/3")
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "intro_timestamps.db")
+TMDB_CACHE_PATH = os.path.join(os.path.dirname(DB_PATH), "tmdb_cache.db")
+CACHE_TTL = 30 * 24 * 3600  # seconds a found id is trusted
+NEGATIVE_CACHE_TTL = 24 * 3600  # seconds before a title without a match is searched again
+HTTP_POOL_SIZE = 8  # pooled connections to the API
+HTTP_TIMEOUT = 10  # seconds per request
+RATE_LIMIT = 20.0  # requests per second (a full bucket adds a burst of as many); TMDB allows about 50 per IP
+MAX_RETRIES = 4  # retries of a failed request (rate limited, server error, network)
+RETRY_BACKOFF = 1.0  # seconds before the first retry, doubled for every further one
+BACKFILL_WORKERS = 8  # concurrent lookups of --update-db
 
 def get_auth_header():
     token = os.environ.get("TMDB_API_TOKEN")
@@ -84,118 +120,408 @@ def clean_title(title):
     title = title.strip(' -')
     return title
 
-def search_tv_show(headers, title):
+def search_tv_show(headers, title, session=requests, api_base=TMDB_API_BASE):
     """Search for a TV show and return matches."""
-    url = f"{TMDB_API_BASE}/search/tv"
+    url = f"{api_base}/search/tv"
     params = {"query": title}
-    response = requests.get(url, params=params, headers=headers)
+    response = session.get(url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
     response.raise_for_status()
     return response.json().get("results", [])
 
-def search_movie(headers, title, year=None):
+def search_movie(headers, title, year=None, session=requests, api_base=TMDB_API_BASE):
     """Search for a movie and return matches."""
-    url = f"{TMDB_API_BASE}/search/movie"
+    url = f"{api_base}/search/movie"
     params = {"query": title}
     if year:
         params["year"] = year
-    response = requests.get(url, params=params, headers=headers)
+    response = session.get(url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
     response.raise_for_status()
     return response.json().get("results", [])
 
-def search_multi(headers, title):
+def search_multi(headers, title, session=requests, api_base=TMDB_API_BASE):
     """Search across all types."""
-    url = f"{TMDB_API_BASE}/search/multi"
+    url = f"{api_base}/search/multi"
     params = {"query": title}
-    response = requests.get(url, params=params, headers=headers)
+    response = session.get(url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
     response.raise_for_status()
     return response.json().get("results", [])
 
+def title_key(parsed):
+    """Cache key of a parsed file name: (title, type, year); episodes of a show share it."""
+    return parsed["title"].casefold(), parsed["type"], parsed.get("year") or 0
+
+def episode_id(show_id, parsed):
+    """Full TMDB id of a file: the show id, plus season and episode for TV episodes."""
+    if show_id is None:
+        return None
+    if 'season' in parsed and 'episode' in parsed:
+        return f'{show_id}:{parsed["season"]}:{parsed["episode"]}'
+    return show_id
+
+def retry_delay(error, attempt):
+    """
+    Seconds to wait before retrying a failed request, or None if retrying is pointless.
+
+    Network errors, rate limiting (429, honouring Retry-After) and server
+    errors are retried with exponential backoff; other HTTP errors are not.
+    """
+    response = getattr(error, "response", None)
+    backoff = RETRY_BACKOFF * 2 ** attempt
+    if response is None:
+        return backoff
+    if response.status_code == 429:
+        try:
+            return max(backoff, float(response.headers.get("Retry-After", 0)))
+        except ValueError:
+            return backoff
+    if response.status_code >= 500:
+        return backoff
+    return None
+
+class RateLimiter:
+    """
+    Token bucket shared by threads: on average at most rate acquisitions per
+    second, in bursts of up to burst.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class TitleCache:
+    """
+    Persistent map of title key to TMDB id (None for titles without a match).
+
+    Entries expire after CACHE_TTL, or NEGATIVE_CACHE_TTL if nothing was found.
+    """
+
+    def __init__(self, cache_path=TMDB_CACHE_PATH):
+        self.conn = sqlite3.connect(cache_path, timeout=storage.BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tmdb_ids (
+                title TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                tmdb_id TEXT,
+                fetched REAL NOT NULL,
+                PRIMARY KEY (title, media_type, year)
+            )
+        """)
+        self.conn.commit()
+
+    def lookup(self, key):
+        """
+        Returns:
+            (found, tmdb_id) tuple; found is False if the key is unknown or expired
+        """
+        row = self.conn.execute(
+            "SELECT tmdb_id, fetched FROM tmdb_ids WHERE title = ? AND media_type = ? AND year = ?", key
+        ).fetchone()
+        if row is None:
+            return False, None
+        tmdb_id, fetched = row
+        ttl = CACHE_TTL if tmdb_id is not None else NEGATIVE_CACHE_TTL
+        if time.time() - fetched > ttl:
+            return False, None
+        return True, tmdb_id
+
+    def store(self, key, tmdb_id):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO tmdb_ids (title, media_type, year, tmdb_id, fetched) VALUES (?, ?, ?, ?, ?)",
+            (*key, tmdb_id, time.time())
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class TMDBResolver:
+    """
+    Resolves file names to TMDB ids with one search per title.
+
+    Safe to share between threads.
+
+    Args:
+        cache_path: SQLite title cache, or None to only memoize in memory
+        offline: Never send requests; unresolved files are deferred
+        api_base: TMDB API location
+        limiter: Optional RateLimiter every request waits for
+    """
+
+    def __init__(self, cache_path=TMDB_CACHE_PATH, offline=False, api_base=TMDB_API_BASE, limiter=None):
+        self.api_base = api_base
+        self.offline = offline
+        self.limiter = limiter
+        self.cache = TitleCache(cache_path) if cache_path else None
+        self.memo = {}  # title key -> TMDB id or None
+        self.lock = threading.Lock()
+        self.session = None
+        self.headers = None
+        self.counts = Counter()  # cache_hits, requests, retries, deferred
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+        instrumentation.count(f"tmdb_{name}")
+
+    def _connect(self):
+        """Set up the pooled session; switches to offline mode without an API token."""
+        token = os.environ.get("TMDB_API_TOKEN")
+        if not token:
+            print("Warning: TMDB_API_TOKEN is not set, TMDB lookups are deferred (run tmdb_lookup.py --update-db later)")
+            self.offline = True
+            return
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def cached(self, key):
+        """(found, tmdb_id) of a title key from the memo or the cache."""
+        with self.lock:
+            if key in self.memo:
+                return True, self.memo[key]
+            if self.cache is None:
+                return False, None
+            found, show_id = self.cache.lookup(key)
+            if found:
+                self.memo[key] = show_id
+            return found, show_id
+
+    def _search_once(self, parsed):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        self._count("requests")
+        if parsed["type"] == "tv":
+            results = search_tv_show(self.headers, parsed["title"], self.session, self.api_base)
+        elif parsed["type"] == "movie":
+            results = search_movie(self.headers, parsed["title"], parsed.get("year"), self.session, self.api_base)
+        else:
+            # Unknown type, try multi-search
+            results = search_multi(self.headers, parsed["title"], self.session, self.api_base)
+        return str(results[0]["id"]) if results else None
+
+    def search(self, parsed):
+        """
+        Search TMDB for a parsed file name, retrying transient errors.
+
+        Returns:
+            TMDB id of the best match as a string, or None
+
+        Raises:
+            requests.RequestException on network or API errors that persist
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return self._search_once(parsed)
+            except requests.RequestException as e:
+                delay = retry_delay(e, attempt)
+                if delay is None or attempt == MAX_RETRIES:
+                    raise
+                self._count("retries")
+                time.sleep(delay)
+
+    def needs_request(self, filepath):
+        """Whether resolving filepath may send a request (the title is not cached and lookups are not deferred)."""
+        if self.offline:
+            return False
+        found, _ = self.cached(title_key(parse_filename(filepath)))
+        return not found
+
+    def resolve_title(self, parsed):
+        """
+        Find the TMDB id of a parsed title (the show, for TV episodes).
+
+        Returns:
+            TMDB id, or None if there is no match or the lookup was deferred
+            (offline mode)
+
+        Raises:
+            requests.RequestException on network or API errors; nothing is cached then
+        """
+        key = title_key(parsed)
+        found, show_id = self.cached(key)
+        if found:
+            self._count("cache_hits")
+            return show_id
+
+        if self.session is None and not self.offline:
+            with self.lock:
+                if self.session is None and not self.offline:
+                    self._connect()
+        if self.offline:
+            self._count("deferred")
+            return None
+
+        show_id = self.search(parsed)
+        with self.lock:
+            self.memo[key] = show_id
+            if self.cache is not None:
+                self.cache.store(key, show_id)
+        return show_id
+
+    def resolve(self, filepath):
+        """
+        Find the TMDB id of a file.
+
+        Returns:
+            TMDB id ("<show>:<season>:<episode>" for TV episodes), or None if
+            there is no match or the lookup was deferred (offline mode)
+
+        Raises:
+            requests.RequestException on network or API errors; nothing is cached then
+        """
+        parsed = parse_filename(filepath)
+        return episode_id(self.resolve_title(parsed), parsed)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+_resolver = None
+
+def configure(offline=False, cache_path=TMDB_CACHE_PATH, limiter=None):
+    """Replace the resolver used by find_tmdb_id."""
+    global _resolver
+    if _resolver is not None:
+        _resolver.close()
+    _resolver = TMDBResolver(cache_path, offline=offline, limiter=limiter)
+    return _resolver
+
+def get_resolver():
+    """The resolver used by find_tmdb_id; offline if TMDB_OFFLINE=1 is set."""
+    if _resolver is None:
+        configure(offline=os.environ.get("TMDB_OFFLINE") == "1")
+    return _resolver
+
 def find_tmdb_id(filepath):
-    """Find the TMDB ID for a given file."""
-    headers = get_auth_header()
-    parsed = parse_filename(filepath)
-
-    print(f"Parsed: {parsed}")
-    best = None
-    tmdb_id = None
-    if parsed["type"] == "tv":
-        results = search_tv_show(headers, parsed["title"])
-        if results:
-            best = results[0]
-    elif parsed["type"] == "movie":
-        results = search_movie(headers, parsed["title"], parsed.get("year"))
-        if results:
-            best = results[0]
-    else:
-        # Unknown type, try multi-search
-        results = search_multi(headers, parsed["title"])
-        if results:
-            best = results[0]
-    if best:
-        tmdb_id = best['id']
-        if 'season' in parsed and 'episode' in parsed:
-            tmdb_id = f'{tmdb_id}:{parsed["season"]}:{parsed["episode"]}'
+    """
+    Find the TMDB ID for a given file.
+
+    Network errors are reported and treated like a deferred lookup, so the
+    caller can save its result without an id.
+    """
+    print(f"Parsed: {parse_filename(filepath)}")
+    try:
+        tmdb_id = get_resolver().resolve(filepath)
+    except requests.RequestException as e:
+        print(f"Warning: TMDB lookup failed: {e}")
+        return None
     print(f"TMDB ID: {tmdb_id}")
     return tmdb_id
 
-def update_database():
-    """Update all rows in intro_timestamps.db with TMDB IDs."""
+def update_database(workers=BACKFILL_WORKERS, rate=RATE_LIMIT):
+    """
+    Backfill the TMDB ids of all rows in intro_timestamps.db that have none.
+
+    Rows are grouped by parsed title and every title is looked up once, by a
+    pool of workers sharing a token bucket of rate requests per second. The
+    ids of a title are written in one transaction.
+    """
     if not os.path.exists(DB_PATH):
         print(f"Error: Database not found at {DB_PATH}")
         sys.exit(1)
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    database = storage.IntroDatabase(DB_PATH, batch_size=storage.COMMIT_BATCH_SIZE)
 
     # Get all rows that don't have a tmdb_id yet
-    cursor.execute("SELECT id, file_name FROM intro_timestamps WHERE tmdb_id IS NULL")
-    rows = cursor.fetchall()
+    rows = database.rows_without_tmdb_id()
 
     if not rows:
         print("No rows without tmdb_id found.")
+        database.close()
         return
 
-    print(f"Processing {len(rows)} rows...")
-    updated = 0
-    failed = 0
-
+    groups = defaultdict(list)  # title key -> [(row id, parsed file name)]
     for row_id, file_name in rows:
-        print(f"\nLooking up: {file_name}")
-        try:
-            result = find_tmdb_id(file_name)
-            if result:
-                cursor.execute(
-                    "UPDATE intro_timestamps SET tmdb_id = ? WHERE id = ?",
-                    (result, row_id)
-                )
-                conn.commit()
-                print(f"  -> Found TMDB id: {result})")
-                updated += 1
-            else:
-                print("  -> No match found")
-                failed += 1
-        except Exception as e:
-            print(f"  -> Error: {e}")
-            failed += 1
-
-    conn.close()
-    print(f"\nDone. Updated: {updated}, Failed: {failed}")
+        parsed = parse_filename(file_name)
+        groups[title_key(parsed)].append((row_id, parsed))
+
+    print(f"Processing {len(rows)} rows ({len(groups)} titles, {workers} workers, {rate:g} requests/s)...")
+    get_auth_header()  # exits without a token
+    # Look up even if TMDB_OFFLINE is set, deferring is what got the rows here
+    resolver = configure(offline=False, limiter=RateLimiter(rate) if rate > 0 else None)
+    report = Counter()
+    started = time.time()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(resolver.resolve_title, group[0][1]): key for key, group in groups.items()}
+            for number, future in enumerate(as_completed(futures), 1):
+                group = groups[futures[future]]
+                title = group[0][1]["title"]
+                progress = f"[{number}/{len(groups)}] {title} ({len(group)} rows)"
+                try:
+                    show_id = future.result()
+                except requests.RequestException as e:
+                    print(f"{progress}: error: {e}")
+                    report["failed_titles"] += 1
+                    report["failed_rows"] += len(group)
+                    continue
+
+                if show_id is None:
+                    print(f"{progress}: no match")
+                    report["unmatched_titles"] += 1
+                    report["unmatched_rows"] += len(group)
+                    continue
+
+                for row_id, parsed in group:
+                    database.set_tmdb_id(row_id, episode_id(show_id, parsed))
+                # Never hold the write lock while waiting for the next lookup
+                database.commit()
+                print(f"{progress}: {show_id}")
+                report["matched_titles"] += 1
+                report["updated_rows"] += len(group)
+    finally:
+        database.close()
+
+    elapsed = time.time() - started
+    print(f"\nDone in {elapsed:.1f}s. Updated: {report['updated_rows']} rows ({report['matched_titles']} titles), "
+          f"no match: {report['unmatched_rows']} rows ({report['unmatched_titles']} titles), "
+          f"failed: {report['failed_rows']} rows ({report['failed_titles']} titles)")
+    print(f"  Requests: {resolver.counts['requests']}, cache hits: {resolver.counts['cache_hits']}, "
+          f"retries: {resolver.counts['retries']}")
 
 def main():
     parser = argparse.ArgumentParser(description="Look up TMDB IDs for media files")
     parser.add_argument("filename", nargs="?", help="Path to the media file")
     parser.add_argument("--update-db", action="store_true",
                         help="Update all rows in intro_timestamps.db with TMDB IDs")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS,
+                        help=f"Concurrent lookups of --update-db (default: {BACKFILL_WORKERS})")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT,
+                        help=f"Maximum TMDB requests per second, 0 for no limit (default: {RATE_LIMIT:g})")
     args = parser.parse_args()
 
     if args.update_db:
-        update_database()
+        update_database(args.workers, args.rate)
         return
 
     if not args.filename:
         parser.print_help()
         sys.exit(1)
 
+    get_auth_header()  # exits without a token
     result = find_tmdb_id(args.filename)
 
     if result:
@@ -0,0 +1,118 @@
+"""
+Incremental export of the VLC cache: merged changes, dropped deletions and
+the delta file between generations.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "intro-detection"))
+sys.path.insert(0, os.path.join(REPO_DIR, "vlc-plugin"))
+
+import export_db_cache  # noqa: E402
+import storage  # noqa: E402
+
+
+@pytest.fixture
+def paths(tmp_path):
+    db_path = str(tmp_path / "intro_timestamps.db")
+    with storage.IntroDatabase(db_path) as database:
+        database.save("a.mkv", "aaaa", 100, 10.0, 40.0, 0.9)
+        database.save("b.mkv", "bbbb", 200, 20.0, 50.0, 0.9)
+        database.save("c.mkv", None, None, 30.0, 60.0, 0.9)
+    return db_path, str(tmp_path / "intro_timestamps_cache.json")
+
+
+def entries(output_path):
+    with open(output_path, encoding="utf-8") as f:
+        f.readline()
+        lines = [json.loads(line.rstrip(",\n")) for line in f if line.startswith("{")]
+    return sorted(lines, key=lambda entry: entry["f"])
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_full_export_writes_every_row(paths):
+    db_path, output_path = paths
+
+    assert export_db_cache.export_database_to_json(db_path, output_path)
+
+    assert entries(output_path) == [
+        {"f": "a.mkv", "h": "aaaa", "z": 100, "s": 10.0, "e": 40.0, "o": 0.0},
+        {"f": "b.mkv", "h": "bbbb", "z": 200, "s": 20.0, "e": 50.0, "o": 0.0},
+        {"f": "c.mkv", "s": 30.0, "e": 60.0, "o": 0.0},
+    ]
+    assert read(export_db_cache.stamp_path(output_path)) == "1\n"
+    assert not os.path.exists(export_db_cache.delta_path(output_path))
+    assert read(export_db_cache.tsv_path(output_path)).splitlines()[1:] == [
+        "h\taaaa\t10.0\t40.0\t0.0",
+        "h\tbbbb\t20.0\t50.0\t0.0",
+        "f\ta.mkv\t10.0\t40.0\t0.0",
+        "f\tb.mkv\t20.0\t50.0\t0.0",
+        "f\tc.mkv\t30.0\t60.0\t0.0",
+        "s\t100",
+        "s\t200",
+    ]
+
+
+def test_incremental_export_merges_changes_and_drops_deleted_rows(paths):
+    db_path, output_path = paths
+    export_db_cache.export_database_to_json(db_path, output_path)
+
+    with storage.IntroDatabase(db_path) as database:
+        database.set_outro_length("a.mkv", "aaaa", 90.0)
+        database.save("d.mkv", "dddd", 300, 5.0, 25.0, 0.9)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM intro_timestamps WHERE file_name = 'b.mkv'")
+
+    assert export_db_cache.export_database_to_json(db_path, output_path)
+
+    assert [(entry["f"], entry["o"]) for entry in entries(output_path)] == [
+        ("a.mkv", 90.0), ("c.mkv", 0.0), ("d.mkv", 0.0)
+    ]
+    assert read(export_db_cache.stamp_path(output_path)) == "2\n"
+    assert read(export_db_cache.delta_path(output_path)).splitlines() == [
+        "#intro-delta\t1\t1\t2\tsizes",
+        "h\taaaa\t10.0\t40.0\t90.0",
+        "h\tdddd\t5.0\t25.0\t0.0",
+        "f\ta.mkv\t10.0\t40.0\t90.0",
+        "f\td.mkv\t5.0\t25.0\t0.0",
+        "s\t100",
+        "s\t300",
+        "-f\tb.mkv",
+        "-h\tbbbb",
+    ]
+
+
+def test_unchanged_database_is_not_exported_again(paths):
+    db_path, output_path = paths
+    export_db_cache.export_database_to_json(db_path, output_path)
+    before = read(output_path)
+
+    assert export_db_cache.export_database_to_json(db_path, output_path)
+
+    assert read(output_path) == before
+    assert read(export_db_cache.stamp_path(output_path)) == "1\n"
+
+
+def test_exports_with_a_timestamp_watermark_are_rebuilt(paths):
+    db_path, output_path = paths
+    export_db_cache.export_database_to_json(db_path, output_path)
+    text = read(output_path)
+    header, rest = text.split("\n", 1)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(header.replace('"watermark":3', '"watermark":"2024-01-01 00:00:00"') + "\n" + rest)
+
+    assert export_db_cache.read_export(output_path) == (None, None)
+    assert export_db_cache.export_database_to_json(db_path, output_path)
+    assert export_db_cache.read_export(output_path)[0] == 3
+    # A full export has no delta against the previous generation
+    assert not os.path.exists(export_db_cache.delta_path(output_path))
@@ -0,0 +1,46 @@
+"""
+Stage timers of the scanner statistics: nested stages are counted once.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intro-detection"))
+
+import instrumentation  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_nested_stages_are_counted_once(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(instrumentation.time, "perf_counter", clock)
+
+    instrumentation.start("episode.mkv")
+    with instrumentation.stage("database"):
+        clock.now += 1.0
+        with instrumentation.stage("tmdb"):
+            clock.now += 3.0
+        clock.now += 0.5
+    clock.now += 0.25
+    record = instrumentation.finish()
+
+    stages = record["stages"]
+    assert stages["database"] == {"seconds": 1.5, "calls": 1}
+    assert stages["tmdb"] == {"seconds": 3.0, "calls": 1}
+    assert stages["other"]["seconds"] == 0.25
+    assert record["elapsed"] == 4.75
+
+
+def test_stages_without_an_active_file_only_run_the_code():
+    assert instrumentation.finish() is None
+    with instrumentation.stage("database"):
+        ran = True
+    assert ran
+    assert instrumentation.finish() is None
@@ -0,0 +1,95 @@
+"""
+Normalized cross-correlation of feature matrices: peak position, sub-frame
+offset and peak picking.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intro-detection"))
+
+from matcher import (find_peaks, interpolate_peak, normalized_cross_correlation,  # noqa: E402
+                     normalized_cross_correlation_batch)
+
+
+def random_features(frames, seed=0):
+    return np.random.default_rng(seed).random((12, frames))
+
+
+def test_template_is_found_at_its_offset():
+    features = random_features(400)
+    template = features[:, 137:187]
+
+    scores = normalized_cross_correlation(template, features)
+
+    assert len(scores) == 400 - 50 + 1
+    assert int(np.argmax(scores)) == 137
+    assert abs(scores[137] - 1.0) < 1e-9
+    assert np.all(scores <= 1.0 + 1e-9)
+
+
+def test_score_ignores_gain_and_level():
+    features = random_features(300)
+    template = features[:, 40:100]
+    scaled = 3.0 * features + 0.5
+
+    scores = normalized_cross_correlation(template, scaled)
+
+    assert int(np.argmax(scores)) == 40
+    assert abs(scores[40] - 1.0) < 1e-9
+
+
+def test_matches_a_direct_pearson_correlation():
+    features = random_features(120, seed=1)
+    template = random_features(30, seed=2)
+
+    scores = normalized_cross_correlation(template, features)
+
+    for lag in (0, 17, 90):
+        window = features[:, lag:lag + 30]
+        expected = np.corrcoef(template.ravel(), window.ravel())[0, 1]
+        assert abs(scores[lag] - expected) < 1e-9
+
+
+def test_short_features_give_no_scores():
+    assert len(normalized_cross_correlation(random_features(20), random_features(10))) == 0
+
+
+def test_batch_scores_match_single_templates():
+    features = random_features(500, seed=3)
+    templates = [features[:, 50:90], features[:, 300:360]]
+
+    scores = normalized_cross_correlation_batch(templates, features)
+
+    assert scores.shape == (2, 500 - 60 + 1)
+    for template, row in zip(templates, scores):
+        single = normalized_cross_correlation(template, features)
+        assert np.allclose(row, single[:scores.shape[1]])
+    assert int(np.argmax(scores[0])) == 50
+    assert int(np.argmax(scores[1])) == 300
+
+
+def test_interpolated_peak_lies_between_frames():
+    # Samples of a parabola with its vertex at 10.3
+    lags = np.arange(20)
+    scores = 1.0 - 0.01 * (lags - 10.3) ** 2
+
+    assert abs(interpolate_peak(scores, 10) - 10.3) < 1e-9
+    # Peaks on the edge have no neighbours to fit
+    assert interpolate_peak(scores, 0) == 0.0
+    assert interpolate_peak(scores, 19) == 19.0
+
+
+def test_peaks_are_local_maxima_of_their_neighbourhood():
+    scores = np.zeros(30)
+    scores[3] = 0.1  # within the neighbourhood of the peak at 5, so the flat start is no peak
+    scores[5] = 0.9
+    scores[7] = 0.5  # within the neighbourhood of the higher peak at 5
+    scores[15] = 0.6
+    scores[16] = 0.6  # plateau, reported once
+    scores[25] = 0.7
+
+    assert list(find_peaks(scores, 0, 30, 3)) == [5, 15, 25]
+    assert list(find_peaks(scores, 10, 20, 3)) == [15]
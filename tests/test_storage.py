@@ -0,0 +1,105 @@
+"""
+IntroDatabase: schema migration of old databases, upserts and the change
+counter read by the incremental export.
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intro-detection"))
+
+import storage  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "intro_timestamps.db")
+
+
+def rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(
+            "SELECT file_name, movie_hash, start_time, outro_length, tmdb_id FROM intro_timestamps ORDER BY id"
+        ).fetchall()
+
+
+def change_seqs(path):
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT file_name, change_seq FROM intro_timestamps"))
+
+
+def test_old_databases_are_migrated_and_deduplicated(db_path):
+    # The original schema: no outro_length, no unique keys, no schema version
+    with sqlite3.connect(db_path) as conn:
+        storage._create_table(conn)
+        conn.executemany(
+            "INSERT INTO intro_timestamps (file_name, movie_hash, file_size, start_time, end_time, "
+            "correlation_score, tmdb_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                ("a.mkv", "aaaa", 100, 10.0, 40.0, 0.9, "1234:1:1"),
+                ("b.mkv", None, None, 5.0, 35.0, 0.9, None),
+                ("a renamed.mkv", "aaaa", 100, 11.0, 41.0, 0.95, None),
+                ("b.mkv", None, None, 6.0, 36.0, 0.9, None),
+            ],
+        )
+
+    with storage.IntroDatabase(db_path) as database:
+        version = database.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    assert version == len(storage.MIGRATIONS)
+    # The newest row of each file is kept, with the TMDB id of an older one
+    assert rows(db_path) == [
+        ("a renamed.mkv", "aaaa", 11.0, 0, "1234:1:1"),
+        ("b.mkv", None, 6.0, 0, None),
+    ]
+
+
+def test_saving_a_file_twice_updates_its_row(db_path):
+    with storage.IntroDatabase(db_path) as database:
+        database.save("a.mkv", "aaaa", 100, 10.0, 40.0, 0.9, tmdb_id="1234:1:1")
+        database.save("a renamed.mkv", "aaaa", 100, 12.0, 42.0, 0.95)
+        database.save("b.mkv", None, None, 5.0, 35.0, 0.9)
+        database.save("b.mkv", None, None, 7.0, 37.0, 0.9, outro_length=60.0)
+        # Same name with a hash is another file than the unhashed one
+        database.save("b.mkv", "bbbb", 200, 8.0, 38.0, 0.9)
+
+    assert rows(db_path) == [
+        ("a renamed.mkv", "aaaa", 12.0, 0, "1234:1:1"),
+        ("b.mkv", None, 7.0, 60.0, None),
+        ("b.mkv", "bbbb", 8.0, 0, None),
+    ]
+
+
+def test_writes_are_batched_until_commit(db_path):
+    with storage.IntroDatabase(db_path, batch_size=3) as database:
+        database.save("a.mkv", "aaaa", 100, 10.0, 40.0, 0.9)
+        database.save("b.mkv", "bbbb", 100, 10.0, 40.0, 0.9)
+        assert database.pending == 2
+        assert rows(db_path) == []
+
+        database.commit()
+        assert database.pending == 0
+        assert len(rows(db_path)) == 2
+
+
+def test_changes_get_a_new_highest_change_seq(db_path):
+    with storage.IntroDatabase(db_path) as database:
+        database.save("a.mkv", "aaaa", 100, 10.0, 40.0, 0.9)
+        database.save("b.mkv", "bbbb", 100, 10.0, 40.0, 0.9)
+        first = change_seqs(db_path)
+
+        database.set_outro_length("a.mkv", "aaaa", 90.0)
+        second = change_seqs(db_path)
+
+        # TMDB ids are not exported and do not count as a change
+        row_id = database.conn.execute("SELECT id FROM intro_timestamps WHERE file_name = 'b.mkv'").fetchone()[0]
+        database.set_tmdb_id(row_id, "42")
+        third = change_seqs(db_path)
+
+    assert first["a.mkv"] < first["b.mkv"]
+    assert second["a.mkv"] > first["b.mkv"]
+    assert second["b.mkv"] == first["b.mkv"]
+    assert third == second
@@ -0,0 +1,38 @@
+"""
+Least recently used eviction of the on-disk caches (template and audio cache).
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intro-detection"))
+
+import audio_cache  # noqa: E402
+import template_cache  # noqa: E402
+
+
+def write(directory, name, size, mtime):
+    path = directory / name
+    path.write_bytes(b"\0" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_oldest_entries_are_evicted_first(tmp_path):
+    write(tmp_path, "old.npz", 100, 1000)
+    write(tmp_path, "used.npz", 100, 3000)
+    write(tmp_path, "new.npz", 100, 2000)
+
+    assert template_cache.evict(str(tmp_path), 250) == 1
+    assert sorted(os.listdir(tmp_path)) == ["new.npz", "used.npz"]
+    assert template_cache.evict(str(tmp_path), 250) == 0
+
+
+def test_only_entries_with_the_suffix_count(tmp_path):
+    write(tmp_path, "a" + audio_cache.ENTRY_SUFFIX, 100, 1000)
+    write(tmp_path, "b" + audio_cache.ENTRY_SUFFIX, 100, 2000)
+    write(tmp_path, "template.npz", 1000, 500)
+    write(tmp_path, "partial.tmp", 1000, 500)
+
+    assert template_cache.evict(str(tmp_path), 150, audio_cache.ENTRY_SUFFIX) == 1
+    assert sorted(os.listdir(tmp_path)) == ["b" + audio_cache.ENTRY_SUFFIX, "partial.tmp", "template.npz"]
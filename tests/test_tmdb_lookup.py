@@ -0,0 +1,231 @@
+"""
+TMDBResolver against a local stub of the TMDB API (TMDB_API_BASE).
+
+Covers the title cache (TTL, negative caching), offline deferral and the
+retry/backoff of failed requests without talking to the real API.
+"""
+
+import http.server
+import json
+import os
+import sqlite3
+import sys
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intro-detection"))
+
+import tmdb_lookup  # noqa: E402
+
+EPISODE = "/media/Some Show/Some Show S01E02.mkv"
+NEXT_EPISODE = "/media/Some Show/Some Show S01E03.mkv"
+MOVIE = "/media/Some Movie (1999).mkv"
+
+
+class StubTMDB(http.server.BaseHTTPRequestHandler):
+    """Answers with the queued responses of the server, then with its default."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.server.requests.append((url.path, parse_qs(url.query), self.headers.get("Authorization")))
+        status, headers, body = self.server.responses.pop(0) if self.server.responses else self.server.default
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def found(tmdb_id):
+    return 200, {}, {"results": [{"id": tmdb_id}]}
+
+
+NOT_FOUND = (200, {}, {"results": []})
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubTMDB)
+    server.requests = []
+    server.responses = []
+    server.default = NOT_FOUND
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/3"
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def resolver_factory(server, tmp_path, monkeypatch):
+    """Build resolvers against the stub, sharing one title cache file."""
+    monkeypatch.setenv("TMDB_API_TOKEN", "test-token")
+    monkeypatch.setattr(tmdb_lookup, "RETRY_BACKOFF", 0.0)
+    cache_path = str(tmp_path / "tmdb_cache.db")
+    resolvers = []
+
+    def make(offline=False):
+        resolver = tmdb_lookup.TMDBResolver(cache_path, offline=offline, api_base=server.url)
+        resolvers.append(resolver)
+        return resolver
+
+    make.cache_path = cache_path
+    yield make
+    for resolver in resolvers:
+        resolver.close()
+
+
+def age_cache(cache_path, seconds):
+    """Pretend all cache entries were fetched seconds earlier."""
+    with sqlite3.connect(cache_path) as conn:
+        conn.execute("UPDATE tmdb_ids SET fetched = fetched - ?", (seconds,))
+
+
+def test_episodes_of_a_show_share_one_search(server, resolver_factory):
+    server.responses.append(found(1234))
+    resolver = resolver_factory()
+
+    assert resolver.resolve(EPISODE) == "1234:1:2"
+    assert resolver.resolve(NEXT_EPISODE) == "1234:1:3"
+
+    assert len(server.requests) == 1
+    path, query, authorization = server.requests[0]
+    assert path == "/3/search/tv"
+    assert query == {"query": ["Some Show"]}
+    assert authorization == "Bearer test-token"
+    assert resolver.counts["requests"] == 1
+    assert resolver.counts["cache_hits"] == 1
+
+
+def test_movie_search_passes_the_year(server, resolver_factory):
+    server.responses.append(found(42))
+
+    assert resolver_factory().resolve(MOVIE) == "42"
+    path, query, _ = server.requests[0]
+    assert path == "/3/search/movie"
+    assert query == {"query": ["Some Movie"], "year": ["1999"]}
+
+
+def test_found_ids_are_cached_until_the_ttl(server, resolver_factory):
+    server.responses.append(found(1234))
+    resolver_factory().resolve(EPISODE)
+
+    # A new resolver (a later run) reads the persistent cache
+    assert resolver_factory().resolve(EPISODE) == "1234:1:2"
+    assert len(server.requests) == 1
+
+    # Older than the negative TTL still counts for a found id
+    age_cache(resolver_factory.cache_path, tmdb_lookup.NEGATIVE_CACHE_TTL + 60)
+    assert resolver_factory().resolve(EPISODE) == "1234:1:2"
+    assert len(server.requests) == 1
+
+    server.responses.append(found(5678))
+    age_cache(resolver_factory.cache_path, tmdb_lookup.CACHE_TTL)
+    assert resolver_factory().resolve(EPISODE) == "5678:1:2"
+    assert len(server.requests) == 2
+
+
+def test_missing_titles_are_cached_until_the_negative_ttl(server, resolver_factory):
+    resolver = resolver_factory()
+    assert resolver.resolve(EPISODE) is None
+    assert resolver.resolve(NEXT_EPISODE) is None
+    assert resolver_factory().resolve(EPISODE) is None
+    assert len(server.requests) == 1
+
+    server.responses.append(found(1234))
+    age_cache(resolver_factory.cache_path, tmdb_lookup.NEGATIVE_CACHE_TTL + 60)
+    assert resolver_factory().resolve(EPISODE) == "1234:1:2"
+    assert len(server.requests) == 2
+
+
+def test_offline_lookups_are_deferred(server, resolver_factory):
+    offline = resolver_factory(offline=True)
+    assert offline.resolve(EPISODE) is None
+    assert offline.counts["deferred"] == 1
+    assert server.requests == []
+
+    # Deferring caches nothing: an online lookup searches, after which the
+    # title also resolves offline
+    server.responses.append(found(1234))
+    assert resolver_factory().resolve(EPISODE) == "1234:1:2"
+    assert resolver_factory(offline=True).resolve(NEXT_EPISODE) == "1234:1:3"
+    assert len(server.requests) == 1
+
+
+def test_needs_request_only_for_uncached_titles(server, resolver_factory):
+    resolver = resolver_factory()
+    assert resolver.needs_request(EPISODE)
+
+    server.responses.append(found(1234))
+    resolver.resolve(EPISODE)
+    assert not resolver.needs_request(NEXT_EPISODE)
+    assert resolver.needs_request(MOVIE)
+    assert not resolver_factory(offline=True).needs_request(MOVIE)
+    assert len(server.requests) == 1
+
+
+def test_missing_token_defers_lookups(server, resolver_factory, monkeypatch):
+    monkeypatch.delenv("TMDB_API_TOKEN")
+    resolver = resolver_factory()
+
+    assert resolver.resolve(EPISODE) is None
+    assert resolver.offline
+    assert resolver.counts["deferred"] == 1
+    assert server.requests == []
+
+
+def test_rate_limits_and_server_errors_are_retried(server, resolver_factory):
+    server.responses += [(429, {"Retry-After": "0"}, {}), (503, {}, {}), found(1234)]
+    resolver = resolver_factory()
+
+    assert resolver.resolve(EPISODE) == "1234:1:2"
+    assert len(server.requests) == 3
+    assert resolver.counts["retries"] == 2
+
+
+def test_retries_give_up_after_max_retries(server, resolver_factory, monkeypatch):
+    monkeypatch.setattr(tmdb_lookup, "MAX_RETRIES", 2)
+    server.default = (500, {}, {})
+    resolver = resolver_factory()
+
+    with pytest.raises(requests.HTTPError):
+        resolver.resolve(EPISODE)
+    assert len(server.requests) == 3
+    assert resolver.counts["retries"] == 2
+
+
+def test_client_errors_are_neither_retried_nor_cached(server, resolver_factory):
+    server.responses.append((401, {}, {"status_message": "Invalid API key"}))
+    resolver = resolver_factory()
+
+    with pytest.raises(requests.HTTPError):
+        resolver.resolve(EPISODE)
+    assert len(server.requests) == 1
+    assert resolver.counts["retries"] == 0
+
+    server.responses.append(found(1234))
+    assert resolver.resolve(EPISODE) == "1234:1:2"
+    assert len(server.requests) == 2
+
+
+def test_retry_delay_honours_retry_after():
+    response = requests.Response()
+    response.status_code = 429
+    response.headers["Retry-After"] = "7"
+    error = requests.HTTPError(response=response)
+
+    assert tmdb_lookup.retry_delay(error, 0) == 7.0
+    assert tmdb_lookup.retry_delay(error, 4) == tmdb_lookup.RETRY_BACKOFF * 16
+    response.status_code = 404
+    assert tmdb_lookup.retry_delay(error, 0) is None
+    assert tmdb_lookup.retry_delay(requests.ConnectionError(), 1) == tmdb_lookup.RETRY_BACKOFF * 2
@@ -4,88 +4,382 @@ Export intro_timestamps.db to a simple JSON cache file.
 Run this script whenever you update the database.
 
 Usage:
-    python3 export_db_cache.py [database_path] [output_path]
+    python3 export_db_cache.py [database_path] [output_path] [--full] [--shards]
 
 Defaults:
     database_path: ../intro_timestamps.db
     output_path: intro_timestamps_cache.json
+
+Format (version 3): every row once, one entry per line, with short keys
+
+    {"version":3,"watermark":1234,"entries":[
+    {"f":"file name","h":"movie hash","z":file size,"s":start,"e":end,"o":outro length},
+    ...
+    ]}
+
+"h" and "z" are missing for files without a hash. Braces inside strings are written
+as \\u007b / \\u007d, so every entry is an innermost {...} for the Lua parser.
+
+Next to the JSON file a line-oriented index is written, which the plugin
+loads with a single pattern match per line (intro_timestamps_cache.tsv):
+
+    #intro-cache<TAB>1<TAB>watermark
+    h<TAB>movie hash<TAB>start<TAB>end<TAB>outro length     (sorted by hash)
+    f<TAB>file name<TAB>start<TAB>end<TAB>outro length      (sorted by name)
+    s<TAB>file size                                         (sorted by size)
+
+The s lines list the sizes of all hashed files, so the plugin only hashes a
+video if some entry has its size. The header ends in <TAB>sizes if the list
+is complete (every hashed entry has a size); otherwise the plugin ignores it.
+
+With --shards it is split into 256 files instead (intro_timestamps_cache.d/
+with an index file and 00.tsv ... ff.tsv): hash lines go to the shard of the
+first two hex digits of the hash, file name lines to the shard of a simple
+hash of the name (see filename_shard), size lines to the shard of the size
+modulo 256. The plugin then only reads the shard a
+lookup needs, so opening a video costs the same for any library size. Only
+shards whose content changed are rewritten.
+
+The export is incremental: the watermark is the highest change counter
+(change_seq, see storage.py) of the exported rows, only rows changed after it
+are read and merged into the existing file, and entries of deleted rows are
+dropped. Unlike a timestamp, the counter also catches rows whose transaction
+commits after an export that ran while it was open. With --full (or if the
+existing file does not match the database, or the database has no change
+counter yet) the file is rebuilt from scratch. The file is
+written to a temporary file next to it and renamed, so VLC never reads a
+half-written cache.
+
+Every export that changes the cache increments the generation number in
+intro_timestamps_cache.stamp, which is written last; the plugin checks it to
+reload the cache while VLC is running. An incremental export also writes the
+changes since the previous generation (intro_timestamps_cache.delta):
+
+    #intro-delta<TAB>1<TAB>from generation<TAB>to generation[<TAB>sizes]
+    h, f and s lines as in the index                      (added or changed)
+    -h<TAB>movie hash, -f<TAB>file name                   (removed)
+
+The plugin applies it if it has the "from" generation loaded, and otherwise
+reloads the whole cache.
 """
 
-import sqlite3
+import argparse
 import json
-import sys
+import os
+import re
+import sqlite3
+import tempfile
+import time
 from pathlib import Path
 
+FORMAT_VERSION = 3
+TSV_FORMAT_VERSION = 1
+SHARD_COUNT = 256
+# File name (a JSON string) and hash at the start of an exported line
+ENTRY_KEY = re.compile(r'\{"f":("(?:[^"\\]|\\.)*")(?:,"h":"([^"]*)")?')
+SIZES_FLAG = "sizes"  # last header field of an index with a complete size list
+
+
+def encode_entry(row):
+    """One database row as a line of JSON."""
+    file_name, movie_hash, file_size, start_time, end_time, outro_length = row
+
+    # Handle binary data
+    if isinstance(movie_hash, bytes):
+        movie_hash = movie_hash.decode('utf-8')
+
+    entry = {'f': file_name}
+    if movie_hash:
+        entry['h'] = movie_hash
+        if file_size:
+            entry['z'] = int(file_size)
+    entry['s'] = round(float(start_time), 3)
+    entry['e'] = round(float(end_time), 3)
+    entry['o'] = round(float(outro_length), 3) if outro_length is not None else 0.0
+
+    text = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+    # The only braces left are the ones around the entry
+    return '{' + text[1:-1].replace('{', '\\u007b').replace('}', '\\u007d') + '}'
+
+
+def entry_key(row):
+    """Rows are unique by hash, or by file name if they have none (see storage.py)."""
+    file_name, movie_hash = row[0], row[1]
+    return ('h', movie_hash) if movie_hash else ('f', file_name)
+
+
+def read_export(output_path):
+    """
+    Read an existing export of the current format version.
+
+    Returns:
+        (watermark, dict of entry key -> line) tuple, or (None, None) if there
+        is no usable export
+    """
+    try:
+        with open(output_path, encoding='utf-8') as f:
+            header = json.loads(f.readline()[:-len(',"entries":[\n')] + '}')
+            lines = {}
+            for line in f:
+                line = line.rstrip('\n')
+                if line == ']}':
+                    break
+                line = line.rstrip(',')
+                match = ENTRY_KEY.match(line)
+                movie_hash = match.group(2)
+                file_name = None if movie_hash else json.loads(match.group(1))
+                lines[entry_key((file_name, movie_hash))] = line
+    except (OSError, ValueError, AttributeError):
+        return None, None
+
+    # Exports from before the change counter have a timestamp watermark
+    if header.get('version') != FORMAT_VERSION or not isinstance(header.get('watermark'), int):
+        return None, None
+    return header['watermark'], lines
+
+
+def write_atomically(output_path, text):
+    """Write text to a temporary file next to output_path and rename it over it."""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(output_path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def tsv_path(output_path):
+    return os.path.splitext(output_path)[0] + '.tsv'
+
+
+def shard_dir(output_path):
+    return os.path.splitext(output_path)[0] + '.d'
+
+
+def filename_shard(file_name):
+    """
+    Shard of a file name, as two hex digits: a polynomial hash of its UTF-8
+    bytes, small enough to be exact in Lua's doubles (same as the plugin).
+    """
+    value = 0
+    for byte in file_name.encode('utf-8'):
+        value = (value * 31 + byte) % 65536
+    return '%02x' % (value % SHARD_COUNT)
+
 
-def export_database_to_json(db_path, output_path):
+def tsv_lines(lines):
+    """
+    Lookup lines of the exported entries.
+
+    Returns:
+        (lines, sizes_complete) tuple: lines is a list of (shard, line) tuples,
+        hash lines sorted by hash, then file name lines sorted by name, then
+        size lines sorted by size
+    """
+    entries = [json.loads(line) for line in lines.values()]
+
+    def tsv_line(kind, key, entry):
+        return f"{kind}\t{key}\t{entry['s']!r}\t{entry['e']!r}\t{entry['o']!r}\n"
+
+    result = [(entry['h'][:2].lower(), tsv_line('h', entry['h'], entry))
+              for entry in sorted((e for e in entries if 'h' in e), key=lambda e: e['h'])]
+    # Names with tabs or line breaks cannot be written; those files are still found by hash
+    result += [(filename_shard(entry['f']), tsv_line('f', entry['f'], entry))
+               for entry in sorted((e for e in entries if not any(c in e['f'] for c in '\t\r\n')),
+                                   key=lambda e: e['f'])]
+
+    hashed = [e for e in entries if 'h' in e]
+    sizes = sorted({e['z'] for e in hashed if 'z' in e})
+    result += [('%02x' % (size % SHARD_COUNT), f"s\t{size}\n") for size in sizes]
+    return result, all('z' in e for e in hashed)
+
+
+def export_tsv(output_path, lines, watermark, shards=False):
+    """
+    Write the line-oriented index of the entries, as one file or as shards;
+    removes the other layout.
+
+    Returns:
+        True if the size lines are complete
+    """
+    header = f"#intro-cache\t{TSV_FORMAT_VERSION}"
+    lookup_lines, sizes_complete = tsv_lines(lines)
+    flag = f"\t{SIZES_FLAG}" if sizes_complete else ""
+    directory = shard_dir(output_path)
+
+    if not shards:
+        write_atomically(tsv_path(output_path), f"{header}\t{'' if watermark is None else watermark}{flag}\n" + ''.join(line for _, line in lookup_lines))
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+            os.rmdir(directory)
+        return sizes_complete
+
+    os.makedirs(directory, exist_ok=True)
+    by_shard = {}
+    for shard, line in lookup_lines:
+        by_shard.setdefault(shard, []).append(line)
+
+    for number in range(SHARD_COUNT):
+        shard = '%02x' % number
+        path = os.path.join(directory, shard + '.tsv')
+        if shard not in by_shard:
+            if os.path.exists(path):
+                os.unlink(path)
+            continue
+
+        text = header + '\n' + ''.join(by_shard[shard])
+        try:
+            with open(path, encoding='utf-8') as f:
+                if f.read() == text:
+                    continue
+        except OSError:
+            pass
+        write_atomically(path, text)
+
+    # The index marks the shards as complete, so it is written last
+    write_atomically(os.path.join(directory, 'index'), f"{header}\t{'' if watermark is None else watermark}\t{len(lookup_lines)}{flag}\n")
+    if os.path.exists(tsv_path(output_path)):
+        os.unlink(tsv_path(output_path))
+    return sizes_complete
+
+
+def stamp_path(output_path):
+    return os.path.splitext(output_path)[0] + '.stamp'
+
+
+def delta_path(output_path):
+    return os.path.splitext(output_path)[0] + '.delta'
+
+
+def read_generation(output_path):
+    """Generation of the existing export, 0 if it has no stamp."""
+    try:
+        with open(stamp_path(output_path), encoding='utf-8') as f:
+            return int(f.readline())
+    except (OSError, ValueError):
+        return 0
+
+
+def export_delta(output_path, old_lines, new_lines, generation, sizes_complete):
+    """
+    Write the changes between two exports as a delta from generation - 1 to
+    generation, or remove a stale delta if old_lines is None (full export).
+    """
+    if old_lines is None:
+        if os.path.exists(delta_path(output_path)):
+            os.unlink(delta_path(output_path))
+        return
+
+    changed = {key for key, line in new_lines.items() if old_lines.get(key) != line}
+    removed = old_lines.keys() - new_lines.keys()
+    added, _ = tsv_lines({key: new_lines[key] for key in changed})
+    old, _ = tsv_lines({key: old_lines[key] for key in changed | removed if key in old_lines})
+
+    # Lookup keys of the old entries that the new lines do not overwrite
+    added_keys = {tuple(line.split('\t', 2)[:2]) for _, line in added}
+    removals = sorted({tuple(line.split('\t', 2)[:2]) for _, line in old if not line.startswith('s\t')} - added_keys)
+
+    flag = f"\t{SIZES_FLAG}" if sizes_complete else ""
+    header = f"#intro-delta\t{TSV_FORMAT_VERSION}\t{generation - 1}\t{generation}{flag}\n"
+    write_atomically(delta_path(output_path), header + ''.join(line for _, line in added)
+                     + ''.join(f"-{kind}\t{key}\n" for kind, key in removals))
+
+
+def tsv_exists(output_path, shards):
+    if shards:
+        return os.path.exists(os.path.join(shard_dir(output_path), 'index'))
+    return os.path.exists(tsv_path(output_path))
+
+
+def export_database_to_json(db_path, output_path, full=False, shards=False):
     """Export database to JSON format that Lua can easily parse."""
 
     if not Path(db_path).exists():
         print(f"Error: Database not found at {db_path}")
         return False
 
+    started = time.perf_counter()
+    watermark, lines = (None, None) if full else read_export(output_path)
+    previous = lines
+
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
-    # Fetch all entries
-    cursor.execute("""
-        SELECT file_name, movie_hash, file_size, start_time, end_time, correlation_score, outro_length
-        FROM intro_timestamps
-        ORDER BY id DESC
-    """)
-
-    entries = []
-    hash_map = {}
-    filename_map = {}
-
-    for row in cursor.fetchall():
-        file_name, movie_hash, file_size, start_time, end_time, correlation_score, outro_length = row
-
-        # Handle binary data
-        if isinstance(movie_hash, bytes):
-            movie_hash = movie_hash.decode('utf-8')
-
-        entry = {
-            'file_name': file_name,
-            'movie_hash': movie_hash,
-            'file_size': file_size,
-            'start_time': float(start_time),
-            'end_time': float(end_time),
-            'correlation_score': float(correlation_score) if not isinstance(correlation_score, bytes) else 0.0,
-            'outro_length': float(outro_length) if outro_length is not None else 0.0
-        }
-
-        entries.append(entry)
-
-        # Build lookup maps
-        if movie_hash:
-            hash_map[movie_hash] = entry
-        if file_name:
-            filename_map[file_name] = entry
+    # Databases not opened by the scanners since the change counter was added
+    # are exported in full
+    has_counter = any(row[1] == 'change_seq' for row in cursor.execute("PRAGMA table_info(intro_timestamps)"))
+    if not has_counter:
+        lines = None
 
-    conn.close()
+    columns = f"file_name, movie_hash, file_size, start_time, end_time, outro_length, " \
+              f"{'change_seq' if has_counter else 'NULL'}"
+    merged = None
+    if lines is not None:
+        cursor.execute(f"SELECT {columns} FROM intro_timestamps WHERE change_seq > ? ORDER BY id", (watermark,))
+        changed = cursor.fetchall()
+        merged = dict(lines)
+        for row in changed:
+            merged[entry_key(row)] = encode_entry(row[:6])
+
+        # Drop the entries of rows deleted since the last export
+        cursor.execute("SELECT file_name, movie_hash FROM intro_timestamps")
+        keys = {entry_key(row) for row in cursor.fetchall()}
+        merged = {key: line for key, line in merged.items() if key in keys}
+        if len(merged) != len(keys):
+            # Rows missing from the export, e.g. it was edited; start over
+            merged = None
+        elif merged == lines and tsv_exists(output_path, shards):
+            conn.close()
+            elapsed = time.perf_counter() - started
+            print(f"✓ {output_path} is up to date ({len(lines)} entries, checked in {elapsed * 1000:.0f} ms)")
+            return True
 
-    # Create compact output format
-    output = {
-        'version': 1,
-        'entries': entries,
-        'by_hash': hash_map,
-        'by_file': filename_map
-    }
+    mode = "incremental"
+    if merged is None:
+        cursor.execute(f"SELECT {columns} FROM intro_timestamps ORDER BY id")
+        changed = cursor.fetchall()
+        merged = {entry_key(row): encode_entry(row[:6]) for row in changed}
+        mode = "full"
+        watermark = None
+        previous = None
+
+    conn.close()
 
-    # Write to file
-    with open(output_path, 'w') as f:
-        json.dump(output, f, indent=2)
+    new_watermark = max((row[6] for row in changed if row[6] is not None), default=watermark)
+    header = json.dumps({'version': FORMAT_VERSION, 'watermark': new_watermark}, separators=(',', ':'))
+    body = ',\n'.join(merged.values())
+    text = header[:-1] + ',"entries":[\n' + (body + '\n' if body else '') + ']}\n'
+    write_atomically(output_path, text)
+    sizes_complete = export_tsv(output_path, merged, new_watermark, shards)
+    generation = read_generation(output_path) + 1
+    export_delta(output_path, previous, merged, generation, sizes_complete)
+    # Written last: tells a running plugin that the files above are complete
+    write_atomically(stamp_path(output_path), f"{generation}\n")
 
-    print(f"✓ Exported {len(entries)} entries to {output_path}")
-    print(f"  By hash: {len(hash_map)} entries")
-    print(f"  By path: {len(filename_map)} entries")
+    elapsed = time.perf_counter() - started
+    size = len(text.encode('utf-8'))
+    index = shard_dir(output_path) + '/' if shards else tsv_path(output_path)
+    print(f"✓ Exported {len(merged)} entries to {output_path} and {index} ({mode}, {len(changed)} rows read)")
+    print(f"  Size: {size / 1024:.1f} KiB, time: {elapsed * 1000:.0f} ms")
 
     return True
 
 
 if __name__ == "__main__":
-    db_path = sys.argv[1] if len(sys.argv) > 1 else "../intro_timestamps.db"
-    output_path = sys.argv[2] if len(sys.argv) > 2 else "intro_timestamps_cache.json"
+    parser = argparse.ArgumentParser(description="Export intro_timestamps.db to the JSON cache of the VLC plugin")
+    parser.add_argument("db_path", nargs="?", default="../intro_timestamps.db", help="Database (default: ../intro_timestamps.db)")
+    parser.add_argument("output_path", nargs="?", default="intro_timestamps_cache.json",
+                        help="Cache file (default: intro_timestamps_cache.json)")
+    parser.add_argument("--full", action="store_true", help="Rebuild the cache instead of merging changed rows")
+    parser.add_argument("--shards", action="store_true",
+                        help="Split the line-oriented index into 256 shards the plugin loads on demand")
+    args = parser.parse_args()
 
-    export_database_to_json(db_path, output_path)
+    export_database_to_json(args.db_path, args.output_path, args.full, args.shards)
@@ -38,6 +38,15 @@ if [ -f "intro_timestamps_cache.json" ]; then
     echo "✓ Cache file copied"
 fi
 
+if [ -f "intro_timestamps_cache.tsv" ]; then
+    cp intro_timestamps_cache.tsv "$VLC_EXTENSIONS_DIR/"
+    echo "✓ Cache index copied"
+fi
+
+if [ -f "intro_timestamps_cache.stamp" ]; then
+    cp intro_timestamps_cache.stamp "$VLC_EXTENSIONS_DIR/"
+fi
+
 echo ""
 echo "✓ Installation complete!"
 echo ""
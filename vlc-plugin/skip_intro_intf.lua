@@ -4,55 +4,64 @@ Runs automatically in background - no manual activation needed!
 ]]--
 
 -- Configuration
-local CHECK_INTERVAL = 0.5
+local IDLE_INTERVAL = 2.0  -- seconds between checks while no skip point is coming up
+local FINE_INTERVAL = 0.02  -- seconds between checks right before a skip point
+local FINE_WINDOW = 0.3  -- seconds before a skip point from which checks are fine-grained
+local NO_INTRO_INTERVAL = 0.5  -- seconds between checks while the playing file has no intro data
+local SEEK_INTERVAL = 0.5  -- seconds between checks while the file has intro data, so a seek into the intro is noticed
+local ITEM_CHANGE_INTERVAL = 0.05  -- seconds between checks while the next item is about to start
+local ITEM_CHANGE_TIMEOUT = 5  -- seconds the next item is expected for after playlist.next() or the end of a file
+local RELOAD_STEP_INTERVAL = 0.1  -- seconds between the steps of a cache reload
+local SEEK_TOLERANCE = 1.0  -- seconds the position may deviate from the expected one without a seek
+local PLAYLIST_CACHE_TIME = 2.0  -- seconds a playlist position is reused for; the playlist may be edited meanwhile
+local PLAYING_STATE = 2  -- value of the input's "state" variable while playing
+local CACHE_NAME = "intro_timestamps_cache"  -- .d/ (shards), .tsv or .json, in that order
+local RELOAD_CHECK_INTERVAL = 5  -- seconds between checks of the cache stamp for a new export
+local RELOAD_BUDGET = 0.05  -- seconds of cache parsing per loop iteration while reloading
+local PARSE_CHUNK = 1000  -- entries parsed between two pauses of a reload
 local cache_data = nil
+local cache_base = nil  -- path of the loaded cache, without extension
+local cache_stamp = nil  -- generation of the loaded cache (see export_db_cache.py)
+local reload_job = nil  -- coroutine building a new cache while the loop keeps running
+local last_reload_check = 0
 local intro_data = nil
 local current_file = nil
 local skip_triggered = false
 local outro_triggered = false
-
--- Convert 8 bytes to 64-bit value (split into high/low 32-bit parts)
-function bytes_to_long_long(bytes)
-    if #bytes ~= 8 then
-        return 0, 0
-    end
-
-    local low = 0
-    local high = 0
-
-    -- Low 32 bits (bytes 1-4)
-    for i = 1, 4 do
-        local byte = string.byte(bytes, i)
-        low = low + byte * (256 ^ (i - 1))
+local last_position = nil  -- {pos =, clock =} of the previous check, for seek detection
+local playlist_position = nil  -- {index =, count =, checked =} of the current item, see get_playlist_position
+local item_change_until = nil  -- mdate until which another item is expected to start
+
+local HASH_BLOCK_SIZE = 65536  -- bytes hashed at the start and at the end of a file
+local hash_memo = {}  -- file path -> {size = , hash = }, kept for playlist revisits
+
+-- Sum the little-endian 64-bit words of a block, as separate sums of the low
+-- and the high 32 bits. Carries are left to the caller: a sum of 2^21 words
+-- of 32 bits is still exact in a double.
+function sum_block(block)
+    local byte = string.byte
+    local low, high = 0, 0
+    for i = 1, #block - 7, 8 do
+        local b1, b2, b3, b4, b5, b6, b7, b8 = byte(block, i, i + 7)
+        low = low + b1 + b2 * 256 + b3 * 65536 + b4 * 16777216
+        high = high + b5 + b6 * 256 + b7 * 65536 + b8 * 16777216
     end
-
-    -- High 32 bits (bytes 5-8)
-    for i = 5, 8 do
-        local byte = string.byte(bytes, i)
-        high = high + byte * (256 ^ (i - 5))
-    end
-
     return low, high
 end
 
--- Add two 64-bit numbers (split into low/high)
-function add64(low1, high1, low2, high2)
-    local low = low1 + low2
-    local high = high1 + high2
-
-    -- Handle carry from low to high
-    if low >= 4294967296 then
-        high = high + math.floor(low / 4294967296)
-        low = low % 4294967296
+-- Size of a file in bytes, or nil if it cannot be opened
+function get_file_size(filepath)
+    local file = io.open(filepath, "rb")
+    if not file then
+        return nil
     end
-
-    -- Keep high in range
-    high = high % 4294967296
-
-    return low, high
+    local size = file:seek("end")
+    file:close()
+    return size
 end
 
--- Calculate OpenSubtitles hash
+-- Calculate OpenSubtitles hash: the file size plus the 64-bit words of the
+-- first and the last 64 KiB, each block read with a single call
 function calculate_opensubtitles_hash(filepath)
     local file = io.open(filepath, "rb")
     if not file then
@@ -62,158 +71,283 @@ function calculate_opensubtitles_hash(filepath)
 
     local file_size = file:seek("end")
 
-    if file_size < 65536 * 2 then
+    if file_size < HASH_BLOCK_SIZE * 2 then
         file:close()
         vlc.msg.dbg("[Skip Intro] File too small for hash calculation")
         return nil
     end
 
-    -- Initialize hash with file size (split into low/high)
-    local hash_low = file_size % 4294967296
-    local hash_high = math.floor(file_size / 4294967296)
-
-    local chunk_size = 65536
-    local bytesize = 8
-
-    -- Read first 64KB
     file:seek("set", 0)
-    for i = 1, chunk_size / bytesize do
-        local bytes = file:read(bytesize)
-        if not bytes or #bytes < bytesize then
-            break
-        end
-        local low, high = bytes_to_long_long(bytes)
-        hash_low, hash_high = add64(hash_low, hash_high, low, high)
-    end
+    local head = file:read(HASH_BLOCK_SIZE)
+    file:seek("set", file_size - HASH_BLOCK_SIZE)
+    local tail = file:read(HASH_BLOCK_SIZE)
+    file:close()
 
-    -- Read last 64KB
-    file:seek("set", math.max(0, file_size - chunk_size))
-    for i = 1, chunk_size / bytesize do
-        local bytes = file:read(bytesize)
-        if not bytes or #bytes < bytesize then
-            break
-        end
-        local low, high = bytes_to_long_long(bytes)
-        hash_low, hash_high = add64(hash_low, hash_high, low, high)
+    if not head or not tail or #head < HASH_BLOCK_SIZE or #tail < HASH_BLOCK_SIZE then
+        vlc.msg.dbg("[Skip Intro] Short read while hashing")
+        return nil
     end
 
-    file:close()
+    local head_low, head_high = sum_block(head)
+    local tail_low, tail_high = sum_block(tail)
+    local low = file_size % 4294967296 + head_low + tail_low
+    local high = math.floor(file_size / 4294967296) + head_high + tail_high + math.floor(low / 4294967296)
 
     -- Format as hex (high 32 bits, then low 32 bits)
-    local hash_string = string.format("%08x%08x", hash_high, hash_low)
-    return hash_string
+    return string.format("%08x%08x", high % 4294967296, low % 4294967296)
+end
+
+-- Hash of a file, calculated once per path (and again only if its size changed)
+function get_file_hash(filepath, file_size)
+    local memo = hash_memo[filepath]
+    if memo and memo.size == file_size then
+        return memo.hash
+    end
+    local hash = calculate_opensubtitles_hash(filepath)
+    hash_memo[filepath] = {size = file_size, hash = hash}
+    return hash
 end
 
--- Simple JSON parser - parse by_file and by_hash sections
-function parse_json_cache(json_str)
+-- Undo the string escapes the exporter writes (quotes, backslashes, \u007b/\u007d for braces)
+function json_unescape(str)
+    str = string.gsub(str, '\\u(%x%x%x%x)', function(hex)
+        local code = tonumber(hex, 16)
+        if code < 128 then return string.char(code) end
+        return nil
+    end)
+    return (string.gsub(str, '\\(["\\/])', '%1'))
+end
+
+-- Read a field of a JSON object by its short (version 2 and 3) or long (version 1) key
+function json_field(obj, short_key, long_key, value_pattern)
+    return string.match(obj, '"' .. short_key .. '"%s*:%s*' .. value_pattern)
+        or string.match(obj, '"' .. long_key .. '"%s*:%s*' .. value_pattern)
+end
+
+-- Simple JSON parser: every entry is an innermost {...} object, in versions 2
+-- and 3 ("entries" only, short keys) as well as in version 1 (every entry
+-- three times in "entries", "by_hash" and "by_file", long keys)
+-- (pause, if given, is called every PARSE_CHUNK entries)
+function parse_json_cache(json_str, pause)
     if not json_str or #json_str < 10 then
         vlc.msg.warn("[Skip Intro] JSON string too short or empty")
-        return {by_file = {}, by_hash = {}}
+        return {by_file = {}, by_hash = {}, sizes = {}, sizes_complete = false}
     end
 
-    local cache = {by_file = {}, by_hash = {}}
-
-    -- Parse by_file section
-    local by_file_start = string.find(json_str, '"by_file"%s*:%s*{')
-    if by_file_start then
-        local brace_count = 1
-        local pos = by_file_start + string.len('"by_file":')
-        local section_start = string.find(json_str, '{', pos)
-        pos = section_start + 1
+    local cache = {by_file = {}, by_hash = {}, sizes = {}, sizes_complete = true}
+    local count = 0
 
-        -- Find the end of by_file section
-        local section_end = pos
-        while brace_count > 0 and pos <= #json_str do
-            local char = string.sub(json_str, pos, pos)
-            if char == '{' then brace_count = brace_count + 1
-            elseif char == '}' then brace_count = brace_count - 1
+    for obj in string.gmatch(json_str, '{[^{}]*}') do
+        count = count + 1
+        if pause and count % PARSE_CHUNK == 0 then
+            pause()
+        end
+        local start_time = tonumber(json_field(obj, "s", "start_time", '([%d%.eE+-]+)'))
+        local end_time = tonumber(json_field(obj, "e", "end_time", '([%d%.eE+-]+)'))
+
+        if start_time and end_time then
+            local entry = {
+                start_time = start_time,
+                end_time = end_time,
+                outro_length = tonumber(json_field(obj, "o", "outro_length", '([%d%.eE+-]+)')) or 0
+            }
+            local file_name = json_field(obj, "f", "file_name", '"(.-)"%s*[,}]')
+            local movie_hash = json_field(obj, "h", "movie_hash", '"(%x+)"')
+            if file_name then
+                cache.by_file[json_unescape(file_name)] = entry
+            end
+            if movie_hash then
+                cache.by_hash[movie_hash] = entry
+                local file_size = tonumber(json_field(obj, "z", "file_size", '(%d+)'))
+                if file_size then
+                    cache.sizes[file_size] = true
+                else
+                    cache.sizes_complete = false
+                end
             end
-            if brace_count > 0 then section_end = pos end
-            pos = pos + 1
         end
+    end
+
+    return cache
+end
+
+-- Parse lines of the line-oriented index (see export_db_cache.py) into cache
+-- (pause, if given, is called every PARSE_CHUNK entries)
+function parse_tsv_cache(content, cache, pause)
+    local count = 0
+    -- Every lookup line follows a line break (the header is the first line)
+    for kind, key, start_time, end_time, outro_length in string.gmatch(content,
+            "\n([hf])\t([^\t\n]+)\t([^\t\n]+)\t([^\t\n]+)\t([^\t\n]+)") do
+        local entry = {
+            start_time = tonumber(start_time),
+            end_time = tonumber(end_time),
+            outro_length = tonumber(outro_length) or 0
+        }
+        if kind == "h" then
+            cache.by_hash[key] = entry
+        else
+            cache.by_file[key] = entry
+        end
+        count = count + 1
+        if pause and count % PARSE_CHUNK == 0 then
+            pause()
+        end
+    end
+    for file_size in string.gmatch(content, "\ns\t(%d+)") do
+        cache.sizes[tonumber(file_size)] = true
+    end
+    return count
+end
+
+-- Whether the header line of an index says its size lines are complete
+function has_complete_sizes(content)
+    local header = string.match(content, "^[^\n]*")
+    return string.find(header, "\tsizes$") ~= nil
+end
 
-        local by_file_section = string.sub(json_str, section_start, section_end)
+function empty_cache()
+    -- sizes: file sizes of all hashed entries; only used if sizes_complete
+    return {by_file = {}, by_hash = {}, sizes = {}, sizes_complete = false, loaded_shards = {}}
+end
 
-        -- Parse entries in by_file
-        pos = 1
-        while true do
-            local key_start = string.find(by_file_section, '"([^"]+)"%s*:%s*{', pos)
-            if not key_start then break end
+-- Shard of a file name: a polynomial hash of its bytes, as two hex digits (same as the exporter)
+function filename_shard(filename)
+    local value = 0
+    for i = 1, #filename do
+        value = (value * 31 + string.byte(filename, i)) % 65536
+    end
+    return string.format("%02x", value % 256)
+end
 
-            local key = string.match(by_file_section, '"([^"]+)"%s*:%s*{', pos)
-            if not key then break end
+-- Read one shard of a sharded cache, the first time it is needed
+function load_shard(cache, shard)
+    if cache.loaded_shards[shard] then
+        return
+    end
+    cache.loaded_shards[shard] = true
 
-            local obj_start = string.find(by_file_section, '{', key_start)
-            local obj_region = string.sub(by_file_section, obj_start, obj_start + 500)
+    local file = io.open(cache.shard_dir .. "/" .. shard .. ".tsv", "r")
+    if file then
+        local count = parse_tsv_cache(file:read("*all"), cache)
+        file:close()
+        vlc.msg.dbg(string.format("[Skip Intro] Loaded shard %s: %d entries", shard, count))
+    end
+end
 
-            local start_time = tonumber(string.match(obj_region, '"start_time"%s*:%s*([%d%.]+)'))
-            local end_time = tonumber(string.match(obj_region, '"end_time"%s*:%s*([%d%.]+)'))
-            local outro_length = tonumber(string.match(obj_region, '"outro_length"%s*:%s*([%d%.]+)')) or 0
+function cache_lookup_file(cache, filename)
+    if cache.shard_dir then
+        load_shard(cache, filename_shard(filename))
+    end
+    return cache.by_file[filename]
+end
 
-            if key and start_time and end_time then
-                cache.by_file[key] = {
-                    start_time = start_time,
-                    end_time = end_time,
-                    outro_length = outro_length
-                }
-                vlc.msg.dbg("[Skip Intro] Parsed by_file: " .. key .. " -> " .. start_time .. "s - " .. end_time .. "s (outro: " .. outro_length .. "s)")
-            end
+function cache_lookup_hash(cache, hash)
+    if cache.shard_dir then
+        load_shard(cache, string.sub(hash, 1, 2))
+    end
+    return cache.by_hash[hash]
+end
 
-            pos = obj_start + 1
-        end
+-- Whether some hashed entry could have this file size; if not, hashing the
+-- file cannot find anything
+function cache_has_size(cache, file_size)
+    if not cache.sizes_complete then
+        return true
+    end
+    if cache.shard_dir then
+        load_shard(cache, string.format("%02x", file_size % 256))
     end
+    return cache.sizes[file_size] == true
+end
 
-    -- Parse by_hash section
-    local by_hash_start = string.find(json_str, '"by_hash"%s*:%s*{')
-    if by_hash_start then
-        local brace_count = 1
-        local pos = by_hash_start + string.len('"by_hash":')
-        local section_start = string.find(json_str, '{', pos)
-        pos = section_start + 1
-
-        -- Find the end of by_hash section
-        local section_end = pos
-        while brace_count > 0 and pos <= #json_str do
-            local char = string.sub(json_str, pos, pos)
-            if char == '{' then brace_count = brace_count + 1
-            elseif char == '}' then brace_count = brace_count - 1
-            end
-            if brace_count > 0 then section_end = pos end
-            pos = pos + 1
+-- File of the preferred layout present at base: ".d/index", ".tsv" or ".json", or nil
+function cache_layout(base)
+    for _, name in ipairs({".d/index", ".tsv", ".json"}) do
+        local file = io.open(base .. name, "r")
+        if file then
+            file:close()
+            return name
         end
+    end
+    return nil
+end
+
+-- Open the cache at base (path without extension), or return nil if there is none
+-- (pause is passed to the parsers)
+function open_cache(base, pause)
+    -- Sharded: nothing is read until a lookup needs a shard
+    local index = io.open(base .. ".d/index", "r")
+    if index then
+        local header = index:read("*l") or ""
+        index:close()
+        local cache = empty_cache()
+        cache.shard_dir = base .. ".d"
+        cache.layout = ".d/index"
+        cache.sizes_complete = has_complete_sizes(header)
+        vlc.msg.info("[Skip Intro] Using sharded cache: " .. cache.shard_dir)
+        return cache
+    end
 
-        local by_hash_section = string.sub(json_str, section_start, section_end)
+    for _, extension in ipairs({".tsv", ".json"}) do
+        local file = io.open(base .. extension, "r")
+        if file then
+            local content = file:read("*all")
+            file:close()
 
-        -- Parse entries in by_hash
-        pos = 1
-        while true do
-            local key_start = string.find(by_hash_section, '"([^"]+)"%s*:%s*{', pos)
-            if not key_start then break end
+            vlc.msg.dbg("[Skip Intro] Cache file size: " .. #content .. " bytes")
 
-            local key = string.match(by_hash_section, '"([^"]+)"%s*:%s*{', pos)
-            if not key then break end
+            local cache = empty_cache()
+            cache.layout = extension
+            if extension == ".tsv" then
+                parse_tsv_cache(content, cache, pause)
+                cache.sizes_complete = has_complete_sizes(content)
+            else
+                local parsed = parse_json_cache(content, pause)
+                cache.by_file = parsed.by_file
+                cache.by_hash = parsed.by_hash
+                cache.sizes = parsed.sizes
+                cache.sizes_complete = parsed.sizes_complete
+            end
 
-            local obj_start = string.find(by_hash_section, '{', key_start)
-            local obj_region = string.sub(by_hash_section, obj_start, obj_start + 500)
+            local file_count = 0
+            local hash_count = 0
+            for _ in pairs(cache.by_file) do file_count = file_count + 1 end
+            for _ in pairs(cache.by_hash) do hash_count = hash_count + 1 end
 
-            local start_time = tonumber(string.match(obj_region, '"start_time"%s*:%s*([%d%.]+)'))
-            local end_time = tonumber(string.match(obj_region, '"end_time"%s*:%s*([%d%.]+)'))
-            local outro_length = tonumber(string.match(obj_region, '"outro_length"%s*:%s*([%d%.]+)')) or 0
+            vlc.msg.info(string.format("[Skip Intro] Loaded %d by_file, %d by_hash from: %s",
+                file_count, hash_count, base .. extension))
+            return cache
+        end
+    end
+    return nil
+end
 
-            if key and start_time and end_time then
-                cache.by_hash[key] = {
-                    start_time = start_time,
-                    end_time = end_time,
-                    outro_length = outro_length
-                }
-                vlc.msg.dbg("[Skip Intro] Parsed by_hash: " .. key .. " -> " .. start_time .. "s - " .. end_time .. "s (outro: " .. outro_length .. "s)")
-            end
+-- Path (without extension) of the first cache found, or nil
+function find_cache_base()
+    local home = os.getenv("HOME") or os.getenv("USERPROFILE")
+    local possible_dirs = {
+        home .. "/.local/share/vlc/lua/intf/",
+        home .. "/.local/share/vlc/lua/extensions/",
+        home .. "/dev/vlc-skip-intro/vlc-plugin/",
+    }
 
-            pos = obj_start + 1
+    for _, dir in ipairs(possible_dirs) do
+        if cache_layout(dir .. CACHE_NAME) then
+            return dir .. CACHE_NAME
         end
     end
+    return nil
+end
 
-    return cache
+-- Generation written by the exporter after every export, or nil
+function read_stamp(base)
+    local file = io.open(base .. ".stamp", "r")
+    if not file then
+        return nil
+    end
+    local stamp = tonumber(file:read("*l"))
+    file:close()
+    return stamp
 end
 
 -- Load cache file
@@ -222,36 +356,107 @@ function load_cache()
         return cache_data
     end
 
-    local home = os.getenv("HOME") or os.getenv("USERPROFILE")
-    local possible_paths = {
-        home .. "/.local/share/vlc/lua/intf/intro_timestamps_cache.json",
-        home .. "/.local/share/vlc/lua/extensions/intro_timestamps_cache.json",
-        home .. "/dev/vlc-skip-intro/vlc-plugin/intro_timestamps_cache.json",
-    }
-
-    for _, path in ipairs(possible_paths) do
-        local file = io.open(path, "r")
-        if file then
-            local content = file:read("*all")
-            file:close()
+    cache_base = find_cache_base()
+    if cache_base then
+        -- Read before the cache: if an export finishes in between, the next check reloads
+        cache_stamp = read_stamp(cache_base)
+        cache_data = open_cache(cache_base)
+        if cache_data then
+            return cache_data
+        end
+    end
 
-            vlc.msg.dbg("[Skip Intro] Cache file size: " .. #content .. " bytes")
+    vlc.msg.warn("[Skip Intro] Cache file not found!")
+    return empty_cache()
+end
 
-            cache_data = parse_json_cache(content)
+-- Apply the exporter's delta from the loaded generation to stamp, if there is
+-- one; all of it is applied within one loop iteration
+function apply_delta(cache, base, stamp)
+    local file = io.open(base .. ".delta", "r")
+    if not file then
+        return false
+    end
+    local content = file:read("*all")
+    file:close()
 
-            local file_count = 0
-            local hash_count = 0
-            for _ in pairs(cache_data.by_file) do file_count = file_count + 1 end
-            for _ in pairs(cache_data.by_hash) do hash_count = hash_count + 1 end
+    local from, to = string.match(content, "^#intro%-delta\t%d+\t(%d+)\t(%d+)")
+    if not cache_stamp or tonumber(from) ~= cache_stamp or tonumber(to) ~= stamp then
+        return false
+    end
 
-            vlc.msg.info(string.format("[Skip Intro] Loaded %d by_file, %d by_hash from: %s",
-                file_count, hash_count, path))
-            return cache_data
+    local count = parse_tsv_cache(content, cache)
+    for kind, key in string.gmatch(content, "\n%-([hf])\t([^\t\n]+)") do
+        if kind == "h" then
+            cache.by_hash[key] = nil
+        else
+            cache.by_file[key] = nil
         end
+        count = count + 1
     end
+    cache.sizes_complete = has_complete_sizes(content)
+    vlc.msg.info(string.format("[Skip Intro] Applied cache delta %d -> %d: %d changes", cache_stamp, stamp, count))
+    return true
+end
 
-    vlc.msg.warn("[Skip Intro] Cache file not found!")
-    return {by_file = {}, by_hash = {}}
+-- Use a newly loaded cache from now on, and look up the current file again
+function swap_cache(cache, base, stamp)
+    cache_data = cache
+    cache_base = base
+    cache_stamp = stamp
+    if current_file then
+        intro_data = find_intro(cache_data, current_file)
+    end
+end
+
+-- Pick up a new export of the cache while VLC is running: checks the stamp
+-- every RELOAD_CHECK_INTERVAL seconds, applies the delta if it fits and
+-- otherwise builds the new cache a few milliseconds per call, so the main
+-- loop keeps running; the old cache is used until the new one is complete
+function check_cache_reload()
+    if reload_job then
+        local started = os.clock()
+        repeat
+            local ok, err = coroutine.resume(reload_job)
+            if not ok then
+                vlc.msg.err("[Skip Intro] Reloading the cache failed: " .. tostring(err))
+                reload_job = nil
+            elseif coroutine.status(reload_job) == "dead" then
+                reload_job = nil
+            end
+        until not reload_job or os.clock() - started >= RELOAD_BUDGET
+        return
+    end
+
+    local now = os.time()
+    if now - last_reload_check < RELOAD_CHECK_INTERVAL then
+        return
+    end
+    last_reload_check = now
+
+    local base = cache_base or find_cache_base()
+    if not base then
+        return
+    end
+    local stamp = read_stamp(base)
+    if cache_data and base == cache_base and stamp == cache_stamp then
+        return
+    end
+
+    -- Shards are only read on demand, so a sharded cache is simply opened again
+    if cache_data and base == cache_base and stamp and not cache_data.shard_dir
+            and cache_data.layout == cache_layout(base) and apply_delta(cache_data, base, stamp) then
+        swap_cache(cache_data, base, stamp)
+        return
+    end
+
+    vlc.msg.info("[Skip Intro] Cache changed, reloading: " .. base)
+    reload_job = coroutine.create(function()
+        local cache = open_cache(base, coroutine.yield)
+        if cache then
+            swap_cache(cache, base, stamp)
+        end
+    end)
 end
 
 -- Decode URI
@@ -302,6 +507,9 @@ function check_file()
         current_file = filepath
         skip_triggered = false
         outro_triggered = false
+        last_position = nil
+        playlist_position = nil
+        item_change_until = nil
 
         -- Extract just the filename
         local filename = get_filename(filepath)
@@ -309,57 +517,204 @@ function check_file()
         vlc.msg.dbg("[Skip Intro] Full path: " .. filepath)
         vlc.msg.dbg("[Skip Intro] Filename: " .. filename)
 
-        -- Load cache
-        local cache = load_cache()
+        intro_data = find_intro(load_cache(), filepath)
+    end
+
+    return true
+end
+
+-- Look up the intro of a file, by name and then by hash
+function find_intro(cache, filepath)
+    local filename = get_filename(filepath)
+
+    -- Strategy 1: Try filename match first (fast, no I/O)
+    local found = cache_lookup_file(cache, filename)
+
+    if found then
+        vlc.msg.info(string.format("[Skip Intro] [OK] Found by filename '%s': %s - %s",
+            filename,
+            format_time(found.start_time),
+            format_time(found.end_time)))
+    else
+        vlc.msg.dbg("[Skip Intro] No filename match, trying hash...")
+
+        -- Strategy 2: Try hash match (slower but more reliable), unless
+        -- no cached file has this size
+        local file_size = get_file_size(filepath)
+        local hash = nil
+        if file_size and cache_has_size(cache, file_size) then
+            hash = get_file_hash(filepath, file_size)
+        elseif file_size then
+            vlc.msg.dbg("[Skip Intro] No cached file has size " .. file_size .. ", not hashing")
+        end
 
-        -- Strategy 1: Try filename match first (fast, no I/O)
-        intro_data = cache.by_file[filename]
+        if hash then
+            vlc.msg.dbg("[Skip Intro] Calculated hash: " .. hash)
+            found = cache_lookup_hash(cache, hash)
 
-        if intro_data then
-            vlc.msg.info(string.format("[Skip Intro] [OK] Found by filename '%s': %s - %s",
-                filename,
-                format_time(intro_data.start_time),
-                format_time(intro_data.end_time)))
+            if found then
+                vlc.msg.info(string.format("[Skip Intro] [OK] Found by hash '%s': %s - %s",
+                    hash,
+                    format_time(found.start_time),
+                    format_time(found.end_time)))
+            else
+                vlc.msg.info("[Skip Intro] No match found (tried filename and hash)")
+            end
+        elseif file_size and not cache_has_size(cache, file_size) then
+            vlc.msg.info("[Skip Intro] No match found (no filename match, no cached file of this size)")
         else
-            vlc.msg.dbg("[Skip Intro] No filename match, trying hash...")
+            vlc.msg.info("[Skip Intro] No match found (filename failed, hash unavailable)")
+        end
+    end
 
-            -- Strategy 2: Try hash match (slower but more reliable)
-            local hash = calculate_opensubtitles_hash(filepath)
+    return found
+end
 
-            if hash then
-                vlc.msg.dbg("[Skip Intro] Calculated hash: " .. hash)
-                intro_data = cache.by_hash[hash]
+-- Index of the current item in the playlist and the number of items; the
+-- playlist is walked at most every PLAYLIST_CACHE_TIME seconds, not on every
+-- check in the outro, so items added or removed meanwhile are still noticed
+function get_playlist_position()
+    local now = vlc.misc.mdate()
+    if playlist_position and now - playlist_position.checked < PLAYLIST_CACHE_TIME * 1000000 then
+        return playlist_position.index, playlist_position.count
+    end
 
-                if intro_data then
-                    vlc.msg.info(string.format("[Skip Intro] [OK] Found by hash '%s': %s - %s",
-                        hash,
-                        format_time(intro_data.start_time),
-                        format_time(intro_data.end_time)))
-                else
-                    vlc.msg.info("[Skip Intro] No match found (tried filename and hash)")
-                end
+    local playlist = vlc.playlist.get("playlist")
+    if not playlist or not playlist.children then
+        return nil, 0
+    end
+
+    local current_index = nil
+    local item = vlc.input.item()
+    local current_uri = item and item:uri()
+    if current_uri then
+        for i, child in ipairs(playlist.children) do
+            if child.path == current_uri then
+                current_index = i
+                break
+            end
+        end
+    end
+
+    local previous = playlist_position
+    playlist_position = {index = current_index, count = #playlist.children, checked = now}
+    if previous and previous.index == current_index and previous.count == #playlist.children then
+        playlist_position.logged = previous.logged
+    end
+    return current_index, #playlist.children
+end
+
+-- Seconds until the next check: until FINE_WINDOW before the next skip point
+-- ahead (intro start, outro start, end of the file, after which the next item
+-- starts), then FINE_INTERVAL until it is reached; never more than
+-- IDLE_INTERVAL, so file changes are noticed, or SEEK_INTERVAL while the file
+-- has intro data, as a seek may move into the intro at any time
+function next_check_delay(current_pos, outro_start, media_end, rate, playing)
+    local delay = IDLE_INTERVAL
+    if intro_data then
+        delay = SEEK_INTERVAL
+    end
+    if not playing or rate <= 0 then
+        return delay
+    end
+
+    local points = {}
+    if intro_data and not skip_triggered then
+        table.insert(points, intro_data.start_time)
+    end
+    if intro_data and not outro_triggered and outro_start then
+        table.insert(points, outro_start)
+    end
+    if media_end then
+        table.insert(points, media_end)
+    end
+
+    for _, point in ipairs(points) do
+        local remaining = (point - current_pos) / rate
+        if remaining > 0 then
+            if remaining <= FINE_WINDOW then
+                delay = math.min(delay, FINE_INTERVAL)
             else
-                vlc.msg.info("[Skip Intro] No match found (filename failed, hash unavailable)")
+                delay = math.min(delay, remaining - FINE_WINDOW)
             end
         end
     end
+    return delay
+end
 
-    return true
+-- Check often until another item starts (or ITEM_CHANGE_TIMEOUT passed), so
+-- an intro at its very beginning is still skipped right away
+function expect_item_change()
+    item_change_until = vlc.misc.mdate() + ITEM_CHANGE_TIMEOUT * 1000000
 end
 
--- Check if we should skip
-function check_skip()
-    if not intro_data then
+-- Compare the position with the one expected since the last check; a jump
+-- means the user seeked, which re-arms the skips that lie ahead again. The
+-- seek may have landed anywhere in the time since the last check, so a skip
+-- point up to that much playback behind the position counts as ahead
+function detect_seek(current_pos, outro_start, rate, playing)
+    local now = vlc.misc.mdate()
+    local previous = last_position
+    last_position = {pos = current_pos, clock = now}
+    if not previous then
         return
     end
 
+    local expected = previous.pos
+    if playing then
+        expected = expected + (now - previous.clock) / 1000000.0 * rate
+    end
+    if math.abs(current_pos - expected) <= SEEK_TOLERANCE then
+        return
+    end
+
+    vlc.msg.dbg(string.format("[Skip Intro] Seek detected: %s -> %s", format_time(expected), format_time(current_pos)))
+    local landed = current_pos
+    if playing then
+        landed = current_pos - (now - previous.clock) / 1000000.0 * rate
+    end
+    if skip_triggered and landed < intro_data.start_time then
+        skip_triggered = false
+        vlc.msg.dbg("[Skip Intro] Reset intro skip (seeked back)")
+    end
+    if outro_triggered and outro_start and landed < outro_start then
+        outro_triggered = false
+    end
+end
+
+-- Check if we should skip; returns the seconds until the next check
+function check_skip()
     local input = vlc.object.input()
-    if not input then return end
+    if not input then return IDLE_INTERVAL end
 
     local time = vlc.var.get(input, "time")
-    if not time then return end
+    if not time then return IDLE_INTERVAL end
 
     local current_pos = time / 1000000.0
+    local rate = vlc.var.get(input, "rate") or 1.0
+    local state = vlc.var.get(input, "state")
+    local playing = state == nil or state == PLAYING_STATE
+
+    local media_end = nil
+    local length = vlc.var.get(input, "length")
+    if length and length > 0 then
+        media_end = length / 1000000.0
+        if playing and media_end - current_pos <= FINE_WINDOW then
+            expect_item_change()
+        end
+    end
+
+    if not intro_data then
+        -- Nothing to skip here, but notice the next item soon
+        return math.min(NO_INTRO_INTERVAL, next_check_delay(current_pos, nil, media_end, rate, playing))
+    end
+
+    local outro_start = nil
+    if media_end and intro_data.outro_length and intro_data.outro_length > 0 then
+        outro_start = media_end - intro_data.outro_length
+    end
+
+    detect_seek(current_pos, outro_start, rate, playing)
 
     -- Check intro skip
     if not skip_triggered and current_pos >= intro_data.start_time and current_pos < intro_data.end_time then
@@ -370,6 +725,8 @@ function check_skip()
         -- SKIP!
         vlc.var.set(input, "time", intro_data.end_time * 1000000)
         skip_triggered = true
+        current_pos = intro_data.end_time
+        last_position = {pos = current_pos, clock = vlc.misc.mdate()}
 
         -- Show OSD (ASCII only, no emoji)
         pcall(function()
@@ -378,60 +735,31 @@ function check_skip()
     end
 
     -- Check outro skip (trigger playlist next)
-    if not outro_triggered and intro_data.outro_length and intro_data.outro_length > 0 then
-        -- Get video duration
-        local length = vlc.var.get(input, "length")
-        if length and length > 0 then
-            local duration = length / 1000000.0
-            local outro_start = duration - intro_data.outro_length
-
-            -- In outro range?
-            if current_pos >= outro_start then
-                -- Check if current item is not the last in playlist
-                local playlist = vlc.playlist.get("playlist")
-                if playlist and playlist.children and #playlist.children > 1 then
-                    -- Find current item index in playlist
-                    local current_index = nil
-                    local item = vlc.input.item()
-                    local current_uri = item and item:uri()
-
-                    if current_uri then
-                        for i, child in ipairs(playlist.children) do
-                            if child.path == current_uri then
-                                current_index = i
-                                break
-                            end
-                        end
-                    end
-
-                    -- Only skip if we're not on the last item
-                    if current_index and current_index < #playlist.children then
-                        vlc.msg.info(string.format("[Skip Intro] >> OUTRO DETECTED! %s -> next episode (item %d of %d)",
-                            format_time(current_pos), current_index, #playlist.children))
-
-                        outro_triggered = true
-
-                        -- Show OSD
-                        pcall(function()
-                            vlc.osd.message(">> Outro skipped - Next episode!", 2)
-                        end)
-
-                        -- Trigger next
-                        vlc.playlist.next()
-                    elseif current_index then
-                        vlc.msg.dbg(string.format("[Skip Intro] Outro detected but on last item (%d of %d), not skipping",
-                            current_index, #playlist.children))
-                    end
-                end
-            end
+    if not outro_triggered and outro_start and current_pos >= outro_start then
+        -- Only skip if we're not on the last item
+        local current_index, count = get_playlist_position()
+        if current_index and current_index < count then
+            vlc.msg.info(string.format("[Skip Intro] >> OUTRO DETECTED! %s -> next episode (item %d of %d)",
+                format_time(current_pos), current_index, count))
+
+            outro_triggered = true
+
+            -- Show OSD
+            pcall(function()
+                vlc.osd.message(">> Outro skipped - Next episode!", 2)
+            end)
+
+            -- Trigger next
+            vlc.playlist.next()
+            expect_item_change()
+        elseif current_index and not playlist_position.logged then
+            playlist_position.logged = true
+            vlc.msg.dbg(string.format("[Skip Intro] Outro detected but on last item (%d of %d), not skipping",
+                current_index, count))
         end
     end
 
-    -- Reset if seeked back
-    if skip_triggered and current_pos < intro_data.start_time then
-        skip_triggered = false
-        vlc.msg.dbg("[Skip Intro] Reset intro skip (seeked back)")
-    end
+    return next_check_delay(current_pos, outro_start, media_end, rate, playing)
 end
 
 -- Main loop
@@ -439,7 +767,8 @@ function run()
     vlc.msg.info("[Skip Intro] ========================================")
     vlc.msg.info("[Skip Intro] Interface script started!")
     vlc.msg.info("[Skip Intro] Monitoring all playback automatically")
-    vlc.msg.info("[Skip Intro] Check interval: " .. CHECK_INTERVAL .. " seconds")
+    vlc.msg.info(string.format("[Skip Intro] Check interval: %g to %g seconds, finest near skip points",
+        FINE_INTERVAL, IDLE_INTERVAL))
     vlc.msg.info("[Skip Intro] ========================================")
 
     -- Load cache on startup
@@ -447,9 +776,11 @@ function run()
 
     -- Main monitoring loop with error handling
     while true do
+        local delay = IDLE_INTERVAL
         local success, err = pcall(function()
+            check_cache_reload()
             if check_file() then
-                check_skip()
+                delay = check_skip()
             end
         end)
 
@@ -457,9 +788,23 @@ function run()
             vlc.msg.err("[Skip Intro] Error in main loop: " .. tostring(err))
         end
 
+        -- Keep a cache reload going in small steps
+        if reload_job then
+            delay = math.min(delay, RELOAD_STEP_INTERVAL)
+        end
+
+        -- Pick up the next item as soon as it starts
+        if item_change_until then
+            if vlc.misc.mdate() < item_change_until then
+                delay = math.min(delay, ITEM_CHANGE_INTERVAL)
+            else
+                item_change_until = nil
+            end
+        end
+
         -- Sleep with error handling - if this fails, VLC might be shutting down
         local sleep_ok = pcall(function()
-            vlc.misc.mwait(vlc.misc.mdate() + (CHECK_INTERVAL * 1000000))
+            vlc.misc.mwait(vlc.misc.mdate() + (delay * 1000000))
         end)
 
         if not sleep_ok then
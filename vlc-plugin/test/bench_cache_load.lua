@@ -0,0 +1,162 @@
+#!/usr/bin/env lua
+-- Benchmark loading the intro cache and looking up files, for every cache
+-- format (JSON, single TSV index, sharded TSV index) and library size.
+--
+-- Uses the functions of ../skip_intro_intf.lua on synthetic caches written
+-- to a temporary directory.
+--
+-- Usage: lua bench_cache_load.lua [max entries, default 100000]
+
+local max_entries = tonumber(arg[1]) or 100000
+local script_dir = string.match(arg[0], "^(.*)/[^/]*$") or "."
+
+-- Load the plugin without starting its main loop
+local silent = function() end
+vlc = {msg = {info = silent, dbg = silent, warn = print, err = print}}
+local plugin = io.open(script_dir .. "/../skip_intro_intf.lua", "r")
+local source = plugin:read("*all")
+plugin:close()
+source = string.gsub(source, "\n%-%- Start\nrun%(%)%s*$", "\n")
+assert((loadstring or load)(source))()
+
+local tmp_dir = os.tmpname()
+os.remove(tmp_dir)
+os.execute("mkdir -p '" .. tmp_dir .. "'")
+
+function entry_name(i)
+    return string.format("Some Show S%02dE%02d.mkv", math.floor(i / 25) % 100, i % 25)
+        .. (i >= 2500 and ("." .. i) or "")
+end
+
+function entry_hash(i)
+    -- Spread over all shards like real hashes
+    return string.format("%08x%08x", (i * 2654435761) % 4294967296, i)
+end
+
+function entry_size(i)
+    return 300000000 + i * 7919
+end
+
+-- Write a cache of n entries in every format; returns the base path
+function write_caches(n)
+    local base = tmp_dir .. "/cache_" .. n
+    local json = {'{"version":3,"watermark":0,"entries":['}
+    local hash_lines, file_lines, size_lines = {}, {}, {}
+    for i = 1, n do
+        local name, hash = entry_name(i), entry_hash(i)
+        json[#json + 1] = string.format('{"f":"%s","h":"%s","z":%d,"s":%d.5,"e":%d.5,"o":30.0}%s',
+            name, hash, entry_size(i), 60 + i % 7, 80 + i % 7, i < n and "," or "")
+        hash_lines[#hash_lines + 1] = string.format("h\t%s\t%d.5\t%d.5\t30.0\n", hash, 60 + i % 7, 80 + i % 7)
+        file_lines[#file_lines + 1] = string.format("f\t%s\t%d.5\t%d.5\t30.0\n", name, 60 + i % 7, 80 + i % 7)
+        size_lines[#size_lines + 1] = string.format("s\t%d\n", entry_size(i))
+    end
+    json[#json + 1] = "]}\n"
+    table.sort(hash_lines)
+    table.sort(file_lines)
+
+    local f = io.open(base .. ".json", "w")
+    f:write(table.concat(json, "\n"))
+    f:close()
+
+    f = io.open(base .. ".tsv", "w")
+    f:write("#intro-cache\t1\t2024-01-01 00:00:00\tsizes\n", table.concat(hash_lines), table.concat(file_lines),
+        table.concat(size_lines))
+    f:close()
+
+    local shards = {}
+    for _, line in ipairs(hash_lines) do
+        local shard = string.sub(line, 3, 4)
+        shards[shard] = shards[shard] or {}
+        table.insert(shards[shard], line)
+    end
+    for _, line in ipairs(file_lines) do
+        local shard = filename_shard(string.match(line, "^f\t([^\t]+)"))
+        shards[shard] = shards[shard] or {}
+        table.insert(shards[shard], line)
+    end
+    for i, line in ipairs(size_lines) do
+        local shard = string.format("%02x", entry_size(i) % 256)
+        shards[shard] = shards[shard] or {}
+        table.insert(shards[shard], line)
+    end
+    os.execute("mkdir -p '" .. base .. "_sharded.d'")
+    for shard, lines in pairs(shards) do
+        f = io.open(base .. "_sharded.d/" .. shard .. ".tsv", "w")
+        f:write("#intro-cache\t1\n", table.concat(lines))
+        f:close()
+    end
+    f = io.open(base .. "_sharded.d/index", "w")
+    f:write("#intro-cache\t1\t2024-01-01 00:00:00\t" .. (3 * n) .. "\tsizes\n")
+    f:close()
+    return base, shards
+end
+
+function remove_caches(base, shards)
+    os.remove(base .. ".json")
+    os.remove(base .. ".tsv")
+    for shard in pairs(shards) do
+        os.remove(base .. "_sharded.d/" .. shard .. ".tsv")
+    end
+    os.remove(base .. "_sharded.d/index")
+    os.remove(base .. "_sharded.d")
+end
+
+-- Open a cache with only the given format present
+function open_format(base, format)
+    if format == "json" then
+        local f = io.open(base .. ".json", "r")
+        local cache = empty_cache()
+        local parsed = parse_json_cache(f:read("*all"))
+        f:close()
+        cache.by_file, cache.by_hash = parsed.by_file, parsed.by_hash
+        cache.sizes, cache.sizes_complete = parsed.sizes, parsed.sizes_complete
+        return cache
+    elseif format == "tsv" then
+        local f = io.open(base .. ".tsv", "r")
+        local cache = empty_cache()
+        local content = f:read("*all")
+        f:close()
+        parse_tsv_cache(content, cache)
+        cache.sizes_complete = has_complete_sizes(content)
+        return cache
+    end
+    return open_cache(base .. "_sharded")
+end
+
+print(string.format("%-8s %-8s %12s %14s %14s", "entries", "format", "startup ms", "first play ms", "lookup us"))
+
+local n = 100
+while n <= max_entries do
+    local base, shards = write_caches(n)
+    for _, format in ipairs({"json", "tsv", "sharded"}) do
+        local started = os.clock()
+        local cache = open_format(base, format)
+        local startup = os.clock() - started
+
+        -- First video: a file name lookup (which loads a shard if sharded)
+        started = os.clock()
+        local found = cache_lookup_file(cache, entry_name(n))
+        local first = os.clock() - started
+        assert(found and found.outro_length == 30, format .. ": entry not found")
+
+        -- Further videos: lookups spread over the library, by name, hash and size;
+        -- the second pass is timed, after all shards a lookup needs are loaded
+        local lookups = 2000
+        local per_lookup
+        for pass = 1, 2 do
+            started = os.clock()
+            for i = 1, lookups do
+                local k = 1 + (i * 7919) % n
+                assert(cache_lookup_file(cache, entry_name(k)) and cache_lookup_hash(cache, entry_hash(k)))
+                assert(cache_has_size(cache, entry_size(k)) and not cache_has_size(cache, entry_size(k) + 1))
+            end
+            per_lookup = (os.clock() - started) / (4 * lookups)
+        end
+
+        print(string.format("%-8d %-8s %12.2f %14.2f %14.2f", n, format, startup * 1000, first * 1000, per_lookup * 1e6))
+    end
+    remove_caches(base, shards)
+    n = n * 10
+end
+
+os.remove(tmp_dir)
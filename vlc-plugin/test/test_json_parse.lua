@@ -1,6 +1,13 @@
 #!/usr/bin/env lua
 -- Test JSON parsing
 
+function json_field(obj, short_key, long_key, value_pattern)
+    return string.match(obj, '"' .. short_key .. '"%s*:%s*' .. value_pattern)
+        or string.match(obj, '"' .. long_key .. '"%s*:%s*' .. value_pattern)
+end
+
+-- Same approach as skip_intro_intf.lua: every entry is an innermost {...}
+-- (version 2 short keys or version 1 long keys)
 function parse_json_cache(json_str)
     if not json_str or #json_str < 10 then
         print("ERROR: JSON string too short")
@@ -8,33 +15,19 @@ function parse_json_cache(json_str)
     end
 
     local cache = {}
-    local pos = 1
-
-    while true do
-        local name_start = string.find(json_str, '"file_name"%s*:%s*"', pos)
-        if not name_start then break end
-
-        local name_value_start = string.find(json_str, '"', name_start + 13)
-        if not name_value_start then break end
 
-        local name_value_end = string.find(json_str, '"', name_value_start + 1)
-        if not name_value_end then break end
+    for obj in string.gmatch(json_str, '{[^{}]*}') do
+        local filename = json_field(obj, "f", "file_name", '"(.-)"%s*[,}]')
+        local start_time = tonumber(json_field(obj, "s", "start_time", '([%d%.eE+-]+)'))
+        local end_time = tonumber(json_field(obj, "e", "end_time", '([%d%.eE+-]+)'))
 
-        local filename = string.sub(json_str, name_value_start + 1, name_value_end - 1)
-
-        local obj_region = string.sub(json_str, name_value_end, name_value_end + 500)
-        local start_time = tonumber(string.match(obj_region, '"start_time"%s*:%s*([%d%.]+)'))
-        local end_time = tonumber(string.match(obj_region, '"end_time"%s*:%s*([%d%.]+)'))
-
-        if filename and start_time and end_time then
+        if filename and start_time and end_time and not cache[filename] then
             cache[filename] = {
                 start_time = start_time,
                 end_time = end_time
             }
             print(string.format("✓ %s -> %ds - %ds", filename, start_time, end_time))
         end
-
-        pos = name_value_end + 1
     end
 
     return cache
@@ -1,10 +1,18 @@
 #!/bin/bash
 # Quick script to update VLC cache when database changes
+#
+# SHARDS=1 exports the sharded index (intro_timestamps_cache.d/) instead of the
+# single .tsv file, for big libraries. INSTALL_DIR=<dir> also installs the
+# cache into that VLC Lua directory (make update-db uses the intf directory).
 
 set -e
 
 DB_PATH="${1:-../intro_timestamps.db}"
 CACHE_FILE="intro_timestamps_cache.json"
+INDEX_FILE="intro_timestamps_cache.tsv"
+DELTA_FILE="intro_timestamps_cache.delta"
+STAMP_FILE="intro_timestamps_cache.stamp"
+SHARD_DIR="intro_timestamps_cache.d"
 
 if [ ! -f "$DB_PATH" ]; then
     echo "Error: Database not found at $DB_PATH"
@@ -12,8 +20,45 @@ if [ ! -f "$DB_PATH" ]; then
     exit 1
 fi
 
+EXPORT_ARGS=()
+if [ "${SHARDS:-0}" = "1" ]; then
+    EXPORT_ARGS+=(--shards)
+fi
+
 echo "Exporting database to cache (filename-based)..."
-python3 export_db_cache.py "$DB_PATH" "$CACHE_FILE"
+python3 export_db_cache.py "$DB_PATH" "$CACHE_FILE" "${EXPORT_ARGS[@]}"
+
+# Copy the cache into a VLC Lua directory. Files are copied next to the
+# target and renamed, so VLC never reads a partial file; the stamp goes last,
+# it makes a running VLC reload the cache
+install_cache() {
+    local DIR="$1"
+
+    # The plugin prefers the shards over the .tsv, so only the layout of this
+    # export may be installed
+    if [ -d "$SHARD_DIR" ]; then
+        rm -rf "$DIR/.$SHARD_DIR.tmp" "$DIR/.$SHARD_DIR.old"
+        cp -r "$SHARD_DIR" "$DIR/.$SHARD_DIR.tmp"
+        if [ -d "$DIR/$SHARD_DIR" ]; then
+            mv "$DIR/$SHARD_DIR" "$DIR/.$SHARD_DIR.old"
+        fi
+        mv "$DIR/.$SHARD_DIR.tmp" "$DIR/$SHARD_DIR"
+        rm -rf "$DIR/.$SHARD_DIR.old" "$DIR/$INDEX_FILE"
+    else
+        rm -rf "$DIR/$SHARD_DIR"
+    fi
+
+    for FILE in "$CACHE_FILE" "$INDEX_FILE" "$DELTA_FILE" "$STAMP_FILE"; do
+        [ -f "$FILE" ] || continue
+        cp "$FILE" "$DIR/.$FILE.tmp"
+        mv "$DIR/.$FILE.tmp" "$DIR/$FILE"
+    done
+}
+
+if [ -n "$INSTALL_DIR" ]; then
+    echo "Copying cache to $INSTALL_DIR..."
+    install_cache "$INSTALL_DIR"
+fi
 
 # Determine VLC extensions directory
 if [[ "$OSTYPE" == "linux-gnu"* ]]; then
@@ -28,10 +73,10 @@ fi
 # Copy to VLC if extension is installed
 if [ -f "$VLC_EXT_DIR/skip_intro_standalone.lua" ]; then
     echo "Copying cache to VLC extensions directory..."
-    cp "$CACHE_FILE" "$VLC_EXT_DIR/"
+    install_cache "$VLC_EXT_DIR"
     echo "✓ Cache updated in VLC!"
     echo ""
-    echo "The extension will use the new cache next time you play a video."
+    echo "A running VLC picks up the new cache within a few seconds."
 else
     echo "Note: VLC extension not found at $VLC_EXT_DIR"
     echo "Cache file saved to: $(pwd)/$CACHE_FILE"